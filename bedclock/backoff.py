@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+# Exponential backoff with jitter, for reconnecting to the mqtt broker.
+# When the broker restarts, every clock in the house loses it at the same
+# moment. Without jitter they would all come back at the same moments too,
+# one storm of connects, subscribes and retained messages after another.
+# With it, each wait is picked at random from the top `jitter` part of the
+# exponential delay (all of it with a jitter of 1, "full jitter").
+
+import random
+
+
+class Backoff(object):
+    def __init__(self, minSeconds, maxSeconds, jitter=1.0, rng=None):
+        self.minSeconds = minSeconds
+        self.maxSeconds = maxSeconds
+        self.jitter = jitter
+        self.rng = rng if rng is not None else random.Random()
+        self.attempts = 0
+
+    def next_delay(self):
+        """Seconds to wait before the next attempt."""
+        ceiling = min(self.maxSeconds, self.minSeconds * 2 ** min(self.attempts, 32))
+        self.attempts += 1
+        return ceiling - self.rng.uniform(0, ceiling * self.jitter)
+
+    def reset(self):
+        """Called once an attempt worked."""
+        self.attempts = 0
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Minimal reader for the BDF fonts shipped with rpi-rgb-led-matrix, so text
+# can be rendered into pixels we own, instead of straight into a canvas.
+# Ref: https://adobe-type-tools.github.io/font-tech-notes/pdfs/5005.BDF_Spec.pdf
+
+REPLACEMENT_CODEPOINT = 0xFFFD
+
+
+class Glyph(object):
+    def __init__(self, deviceWidth, pixels):
+        self.deviceWidth = deviceWidth
+        # lit pixels as (dx, dy), relative to pen position and baseline
+        self.pixels = pixels
+
+
+class Font(object):
+    def __init__(self):
+        self.glyphs = {}
+        self.ascent = 0
+        self.descent = 0
+        self.height = 0
+
+    def glyph(self, codepoint):
+        g = self.glyphs.get(codepoint)
+        if g is None:
+            g = self.glyphs.get(REPLACEMENT_CODEPOINT)
+        return g
+
+    def character_width(self, codepoint):
+        g = self.glyph(codepoint)
+        return g.deviceWidth if g else -1
+
+    def text_width(self, text):
+        width = 0
+        for c in text:
+            g = self.glyph(ord(c))
+            if g:
+                width += g.deviceWidth
+        return width
+
+    def text_pixels(self, text, x, baseline):
+        """Yield (x, y) of every lit pixel, like graphics.DrawText would set."""
+        for c in text:
+            g = self.glyph(ord(c))
+            if g is None:
+                continue
+            for dx, dy in g.pixels:
+                yield x + dx, baseline + dy
+            x += g.deviceWidth
+
+
+# =============================================================================
+
+
+def _glyph_pixels(bbx, bitmapRows):
+    width, height, xOffset, yOffset = bbx
+    pixels = []
+    top = -(height + yOffset)
+    for row, hexRow in enumerate(bitmapRows):
+        bits = int(hexRow, 16)
+        numBits = len(hexRow) * 4
+        for col in range(width):
+            if bits & (1 << (numBits - 1 - col)):
+                pixels.append((xOffset + col, top + row))
+    return pixels
+
+
+def parse_font(lines):
+    font = Font()
+    encoding = None
+    deviceWidth = 0
+    bbx = (0, 0, 0, 0)
+    bitmapRows = None
+    for line in lines:
+        tokens = line.split()
+        if not tokens:
+            continue
+        keyword = tokens[0]
+        if bitmapRows is not None:
+            if keyword == "ENDCHAR":
+                if encoding is not None and encoding >= 0:
+                    font.glyphs[encoding] = Glyph(
+                        deviceWidth, _glyph_pixels(bbx, bitmapRows)
+                    )
+                bitmapRows = None
+            else:
+                bitmapRows.append(keyword)
+        elif keyword == "FONT_ASCENT":
+            font.ascent = int(tokens[1])
+        elif keyword == "FONT_DESCENT":
+            font.descent = int(tokens[1])
+        elif keyword == "FONTBOUNDINGBOX":
+            font.height = int(tokens[2])
+        elif keyword == "STARTCHAR":
+            encoding = None
+            deviceWidth = 0
+        elif keyword == "ENCODING":
+            encoding = int(tokens[-1])
+        elif keyword == "DWIDTH":
+            deviceWidth = int(tokens[1])
+        elif keyword == "BBX":
+            bbx = tuple(int(t) for t in tokens[1:5])
+        elif keyword == "BITMAP":
+            bitmapRows = []
+    if not font.height:
+        font.height = font.ascent + font.descent
+    return font
+
+
+def load_font(filename):
+    with open(filename, encoding="latin-1") as f:
+        return parse_font(f)
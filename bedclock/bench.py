@@ -0,0 +1,823 @@
+#!/usr/bin/env python3
+
+# Benchmarks that run bedclock modules against the simulated hardware in
+# sim.py, so they can run on any machine. Example:
+#   python3 bedclock/bench.py render --vsync-ms 0 16 50
+
+import argparse
+from datetime import datetime
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+
+# need this because exported python path gets lost when invoking sudo
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+from bedclock import clocks  # noqa
+from bedclock import const  # noqa
+from bedclock import ctlsock  # noqa
+from bedclock import events  # noqa
+from bedclock import framemirror  # noqa
+from bedclock import log  # noqa
+from bedclock import mqttclient  # noqa
+from bedclock import screen  # noqa
+from bedclock import sensors  # noqa
+from bedclock import shmring  # noqa
+from bedclock import sim  # noqa
+
+
+def summary(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {"count": 0, "mean": 0, "p50": 0, "p99": 0, "max": 0}
+    pick = lambda pct: samples[min(len(samples) - 1, int(len(samples) * pct))]
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples),
+        "p50": pick(0.50),
+        "p99": pick(0.99),
+        "max": samples[-1],
+    }
+
+
+def summary_ms_str(s):
+    return "mean {:.2f} p50 {:.2f} p99 {:.2f} max {:.2f}".format(
+        *[s[k] * 1000 for k in ["mean", "p50", "p99", "max"]]
+    )
+
+
+def wait_for(predicate, timeout):
+    end = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.0001)
+    return True
+
+
+def run_isolated(fun, *args):
+    # modules keep their state in globals, so each run gets its own process
+    with multiprocessing.Pool(1) as pool:
+        return pool.apply(fun, args)
+
+
+# =============================================================================
+
+
+def _screen_loop(stopEvent):
+    while not stopEvent.is_set():
+        screen.do_iterate()
+
+
+def render(vsyncSeconds, seconds, inline, message):
+    # screen starts dark and goes back to dark shortly after each wake up,
+    # so it keeps fading in and out, which keeps the renderer busy
+    const.scr_wakeupTimeoutInSeconds = 1
+    const.snapshot_dir = None
+    screen.do_init(None)
+    state = screen._state
+    state.currentBrightness = state.wantedBrightness = const.scr_brightnessOff
+    state.stayOnCurrentBrightnessDeadline = None
+    state.matrix = sim.FakeMatrix(vsyncSeconds=vsyncSeconds)
+    state.fonts = sim.screen_fonts()
+    screen.init_widgets()
+    screen.init_timer_ticks()
+    if inline:
+        # baseline: rendering in the command thread
+        state.renderWorker = screen.InlineRenderer()
+    else:
+        screen.init_render_worker()
+    screen.drawClock()
+    if message:
+        screen._do_handle_display_message(message)
+
+    stopEvent = threading.Event()
+    threading.Thread(target=_screen_loop, args=(stopEvent,), daemon=True).start()
+    # latency is measured from queuing proximity until the command thread
+    # has handled it
+    latencies = []
+    proximity = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        proximity = 0 if proximity else 10
+        start = time.monotonic()
+        screen.do_handle_motion_proximity(proximity)
+        if wait_for(lambda: state.cachedProximity == proximity, 5):
+            latencies.append(time.monotonic() - start)
+        # dark room, so brightness goes back down once wake up times out
+        screen.do_handle_motion_lux(0)
+        time.sleep(0.1)
+    stopEvent.set()
+    return {
+        "latency": summary(latencies),
+        "swaps": state.matrix.swaps,
+        "submitted": state.renderWorker.submitted,
+        "dropped": state.renderWorker.dropped,
+    }
+
+
+def cmd_render(args):
+    for vsyncMs in args.vsync_ms:
+        for inline in [True, False]:
+            results = run_isolated(
+                render, vsyncMs / 1000.0, args.seconds, inline, args.message
+            )
+            print(
+                "vsync {}ms {:6} renderer: {} frames, {} of {} snapshots dropped, "
+                "proximity latency ms: {}".format(
+                    vsyncMs,
+                    "inline" if inline else "thread",
+                    results["swaps"],
+                    results["dropped"],
+                    results["submitted"],
+                    summary_ms_str(results["latency"]),
+                )
+            )
+
+
+# =============================================================================
+
+
+def restart(snapshotDir, lux, luxDelaySeconds, timeout):
+    # lux shows up luxDelaySeconds after it is asked for, like it would
+    # with motion having to init the sensor first
+    def queueEventFun(event):
+        if event.name == "LuxUpdateRequest":
+            threading.Timer(
+                luxDelaySeconds, screen.do_handle_motion_lux, [lux]
+            ).start()
+
+    const.snapshot_dir = snapshotDir
+    screen.do_init(queueEventFun)
+    state = screen._state
+    state.matrix = sim.FakeMatrix()
+    state.fonts = sim.screen_fonts()
+    stopEvent = threading.Event()
+    threading.Thread(target=_screen_loop, args=(stopEvent,), daemon=True).start()
+    wait_for(lambda: state.matrix.swaps, timeout)
+    firstFrameBrightness = state.matrix.frontCanvas.brightness
+    wait_for(lambda: state.settledTimestamp is not None, timeout)
+    stopEvent.set()
+    state.snapshotter.flush()
+    return {
+        "restored": state.restoredSnapshot,
+        "firstFrameBrightness": firstFrameBrightness,
+        "settledBrightness": state.currentBrightness,
+        "settled": (state.settledTimestamp or time.monotonic()) - state.startTime,
+    }
+
+
+def cmd_restart(args):
+    with tempfile.TemporaryDirectory() as snapshotDir:
+        # first run has no snapshot to start from, second run uses the
+        # one saved by the first
+        for _ in range(2):
+            results = run_isolated(
+                restart, snapshotDir, args.lux, args.lux_delay, args.timeout
+            )
+            print(
+                "{}: first frame brightness {}, settled at brightness {} "
+                "after {:.2f}s".format(
+                    "warm (snapshot)" if results["restored"] else "cold",
+                    results["firstFrameBrightness"],
+                    results["settledBrightness"],
+                    results["settled"],
+                )
+            )
+
+
+def midnight():
+    return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def day(hours):
+    with sim.Simulation(midnight()) as simulation:
+        results = simulation.run(hours * 3600)
+    screenState = simulation.states["screen"]
+    results["events"] = dict(simulation.eventCounts)
+    results["screen"] = {
+        "currentBrightness": screenState.currentBrightness,
+        "frames": screenState.matrix.swaps,
+    }
+    results["mqtt"] = dict(
+        simulation.states["mqttclient"].mqtt_client.publishCounts
+    )
+    return results
+
+
+def cmd_day(args):
+    results = run_isolated(day, args.hours)
+    print(
+        "{:.0f} simulated seconds in {:.2f}s ({:.0f}x real time), {} steps".format(
+            results["simSeconds"],
+            results["wallSeconds"],
+            results["simSecondsPerWallSecond"],
+            results["steps"],
+        )
+    )
+    for name, count in sorted(results["events"].items()):
+        print("  {:20} {:6} events".format(name, count))
+    print("  final screen state: {}".format(results["screen"]))
+    print("  mqtt publishes: {}".format(results["mqtt"]))
+
+
+def flood(messages, perMessage):
+    # the bench plays paho's network thread, getting a burst of temperatures
+    # from the broker with a single stay message in the middle of it
+    handled = []
+    dropped = []
+    state = sim.sim_mqttclient(handled.append)
+    if perMessage:
+        # how messages were handled before the inbox: one command each
+        def deliver(topic, payload):
+            if not mqttclient._enqueue_cmd(
+                (mqttclient._do_handle_mqtt_msg, [topic, payload])
+            ):
+                dropped.append(topic)
+
+    else:
+        deliver = state.mqtt_client.deliver
+    temperatureTopic = const.mqtt_topics_sub[const.mqtt_topic_sub_temperature]
+    stayTopic = const.mqtt_topics_sub[const.mqtt_topic_sub_stay]
+    start = time.perf_counter()
+    for i in range(messages):
+        deliver(temperatureTopic, str(i).encode())
+        if i == messages // 2:
+            deliver(stayTopic, b"on")
+    elapsed = time.perf_counter() - start
+    sim.wait_idle([state.cmdq])
+    temperatures = [e.value for e in handled if e.name == "OutsideTemperature"]
+    stats = state.inbox.stats()
+    return {
+        "seconds": elapsed,
+        "temperatures": len(temperatures),
+        "lastTemperature": temperatures[-1] if temperatures else None,
+        "stayHandled": any(e.name == "ScreenStaysOn" for e in handled),
+        "coalesced": stats["coalesced"],
+        "dropped": len(dropped) + stats["dropped"],
+    }
+
+
+def cmd_flood(args):
+    for perMessage in [True, False]:
+        results = run_isolated(flood, args.messages, perMessage)
+        print(
+            "{}: {} messages in {:.3f}s, {} temperatures handled (last {}), "
+            "stay handled {}, {} coalesced, {} dropped".format(
+                "command per message" if perMessage else "inbox",
+                args.messages + 1,
+                results["seconds"],
+                results["temperatures"],
+                results["lastTemperature"],
+                results["stayHandled"],
+                results["coalesced"],
+                results["dropped"],
+            )
+        )
+
+
+def ctl(clients, requests):
+    # the hub end is a multiprocessing queue, like main's event queue, with a
+    # thread taking the events out of it
+    eventq = multiprocessing.Queue()
+
+    def hub():
+        while eventq.get() is not None:
+            pass
+
+    hubThread = threading.Thread(target=hub)
+    hubThread.start()
+    state = {"brightness": 8, "lux": 3, "proximity": 0, "message": None}
+    with tempfile.TemporaryDirectory() as tmpDir:
+        server = ctlsock.Server(
+            os.path.join(tmpDir, "ctl.sock"),
+            lambda: dict(state),
+            eventq.put_nowait,
+            clients,
+        ).start()
+        latencies = {"state": [], "commands": []}
+
+        def run():
+            client = ctlsock.Client(server.path)
+            for i in range(requests):
+                start = time.perf_counter()
+                if i % 2:
+                    client.commands([["temperature", "72"], ["lux_report"]])
+                    latencies["commands"].append(time.perf_counter() - start)
+                else:
+                    client.state()
+                    latencies["state"].append(time.perf_counter() - start)
+            client.close()
+
+        threads = [threading.Thread(target=run) for _ in range(clients)]
+        start = time.perf_counter()
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        elapsed = time.perf_counter() - start
+        server.stop()
+    eventq.put(None)
+    hubThread.join()
+    return elapsed, latencies
+
+
+def cmd_ctl(args):
+    for clients in args.clients:
+        elapsed, latencies = ctl(clients, args.requests)
+        total = clients * args.requests
+        print(
+            "{} clients: {} requests in {:.2f}s ({:.0f}/s)".format(
+                clients, total, elapsed, total / elapsed
+            )
+        )
+        for op, samples in latencies.items():
+            print("  {:8} latency ms: {}".format(op, summary_ms_str(summary(samples))))
+
+
+def _ipc_child(eventq, cmdq, count):
+    # answer each command with an event, then send count events, as fast as
+    # the transport takes them
+    while True:
+        cmd = cmdq.get(True, 10)
+        if cmd == b"stop":
+            break
+        eventq.put_nowait(events.MotionProximity(0))
+    for i in range(count):
+        while True:
+            try:
+                eventq.put_nowait(events.MotionLux(i))
+                break
+            except queue.Full:
+                time.sleep(0)
+
+
+def ipc(transport, roundTrips, count):
+    context = multiprocessing.get_context("fork")
+    if transport == "shmring":
+        hub = shmring.EventHub(const.ipc_event_slots, const.ipc_slot_size)
+        eventq = hub.producer()
+        cmdq = shmring.CommandQueue(100, const.ipc_slot_size)
+    else:
+        hub = eventq = context.Queue(1000)
+        cmdq = context.Queue(100)
+    child = context.Process(target=_ipc_child, args=(eventq, cmdq, count))
+    child.start()
+    latencies = []
+    cmd = b"x" * 200  # about the size of a dill pickled command
+    for _ in range(roundTrips):
+        start = time.perf_counter()
+        cmdq.put_nowait(cmd)
+        hub.get(True, 10)
+        latencies.append(time.perf_counter() - start)
+    cmdq.put_nowait(b"stop")
+    start = time.perf_counter()
+    for _ in range(count):
+        hub.get(True, 10)
+    elapsed = time.perf_counter() - start
+    child.join()
+    return latencies, count / elapsed
+
+
+def cmd_ipc(args):
+    for transport in ["queue", "shmring"]:
+        latencies, eventsPerSecond = ipc(transport, args.round_trips, args.events)
+        print(
+            "{:8} {:.0f} events/s, round trip ms: {}".format(
+                transport, eventsPerSecond, summary_ms_str(summary(latencies))
+            )
+        )
+
+
+def wake(lanes, seconds, floodPerMs):
+    if not lanes:
+        # baseline: one fifo for all commands
+        screen.CMD_URGENT_TAGS = screen.CMD_LATEST_TAGS = []
+    const.snapshot_dir = None
+    state = sim.sim_screen()
+    stopEvent = threading.Event()
+
+    def flood():
+        i = 0
+        while not stopEvent.is_set():
+            for _ in range(floodPerMs):
+                i += 1
+                screen.do_handle_outside_temperature(str(i % 100))
+                if i % 4 == 0:
+                    screen.do_handle_display_message("flood {}".format(i))
+            time.sleep(0.001)
+
+    threading.Thread(target=flood, daemon=True).start()
+    latencies = []
+    lost = 0
+    proximity = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        proximity = 0 if proximity else 10
+        start = time.monotonic()
+        if screen.do_handle_motion_proximity(proximity) and wait_for(
+            lambda: state.cachedProximity == proximity, 5
+        ):
+            latencies.append(time.monotonic() - start)
+        else:
+            lost += 1
+        time.sleep(0.05)
+    stopEvent.set()
+    return {
+        "latency": summary(latencies),
+        "lost": lost,
+        "coalesced": state.cmdLanes.coalesced,
+        "dropped": state.cmdLanes.dropped,
+    }
+
+
+def cmd_wake(args):
+    for lanes in [False, True]:
+        results = run_isolated(wake, lanes, args.seconds, args.flood_per_ms)
+        print(
+            "{:5}: {} wake ups, {} lost, latency ms: {}, {} coalesced".format(
+                "lanes" if lanes else "fifo",
+                results["latency"]["count"],
+                results["lost"],
+                summary_ms_str(results["latency"]),
+                results["coalesced"],
+            )
+        )
+
+
+def publishes(mode, hours):
+    from bedclock import main
+
+    const.mqtt_publish_mode = mode
+    with sim.Simulation(midnight()) as simulation:
+        simulation.run(hours * 3600)
+    client = simulation.states["mqttclient"].mqtt_client
+    return {
+        "counts": dict(client.publishCounts),
+        "bytes": sum(client.publishBytes.values()),
+        # what publishing each of the document's fields to a topic would take
+        "fieldChanges": sum(simulation.eventCounts[name] for name in main.STATE_EVENTS),
+        "lastPublished": client.lastPublished,
+    }
+
+
+def cmd_publishes(args):
+    for mode in ["topics", "statedoc"]:
+        results = run_isolated(publishes, mode, args.hours)
+        total = sum(results["counts"].values())
+        print(
+            "{:8}: {:.1f} publishes per hour, {:.0f} payload bytes per hour".format(
+                mode, total / args.hours, results["bytes"] / args.hours
+            )
+        )
+        for topic, count in sorted(results["counts"].items()):
+            print("  {:24} {:6}".format(topic, count))
+    print(
+        "a topic per state document field: {:.1f} publishes per hour".format(
+            results["fieldChanges"] / args.hours
+        )
+    )
+
+
+def telemetry_export(hours):
+    const.telemetry_enabled = True
+    with sim.Simulation(midnight()) as simulation:
+        simulation.run(hours * 3600)
+    batcher = simulation.states["motion"].telemetry
+    client = simulation.states["mqttclient"].mqtt_client
+    topic = const.mqtt_topics_pub[const.mqtt_topic_pub_telemetry]
+    # what a json message per sample would look like
+    jsonBytes = len(
+        json.dumps({"t": round(time.time(), 3), "name": "proximity", "value": 12})
+    )
+    return {
+        "samples": batcher.samples,
+        "payloads": client.publishCounts[topic],
+        "bytes": client.publishBytes[topic],
+        "jsonBytes": jsonBytes,
+    }
+
+
+def cmd_telemetry(args):
+    results = run_isolated(telemetry_export, args.hours)
+    samples = max(1, results["samples"])
+    print(
+        "{} samples in {} payloads: {:.1f} payloads per hour, {:.2f} bytes per "
+        "sample".format(
+            results["samples"],
+            results["payloads"],
+            results["payloads"] / args.hours,
+            results["bytes"] / samples,
+        )
+    )
+    print(
+        "a json message per sample: {:.0f} publishes per hour, {} bytes "
+        "per sample".format(results["samples"] / args.hours, results["jsonBytes"])
+    )
+
+
+def mirror_render_loop(fps, seconds):
+    width, height = const.scr_led_cols, const.scr_led_rows
+    mirror = framemirror.Mirror(
+        width,
+        height,
+        const.mirror_tile_size,
+        const.mirror_max_fps,
+        const.mirror_cpu_budget,
+        const.mirror_keyframe_seconds,
+        const.mirror_max_payload_bytes,
+    )
+    payloadSizes = []
+    worker = framemirror.Worker(mirror, lambda p: payloadSizes.append(len(p)))
+    worker.start()
+    frame = bytearray(width * height * 3)
+    offerTimes = []
+    cpuStart = time.process_time()
+    start = time.monotonic()
+    nextFrameTime = start
+    x = 0
+    while time.monotonic() - start < seconds:
+        # a block scrolling by, like a message
+        frame[:] = bytes(len(frame))
+        for y in range(8):
+            offset = (y * width + x) * 3
+            frame[offset:offset + 8 * 3] = b"\xff\x00\x00" * 8
+        x = (x + 1) % (width - 8)
+        t = time.perf_counter()
+        mirror.offer(frame, 50)
+        offerTimes.append(time.perf_counter() - t)
+        nextFrameTime += 1.0 / fps
+        time.sleep(max(0, nextFrameTime - time.monotonic()))
+    elapsed = time.monotonic() - start
+    return {
+        "offer": summary(offerTimes),
+        "payloadsPerSecond": len(payloadSizes) / elapsed,
+        "payloadBytes": summary(payloadSizes),
+        "cpuShare": mirror.cpuTime / elapsed,
+        "processCpuShare": (time.process_time() - cpuStart) / elapsed,
+    }
+
+
+def mirror_day(hours):
+    const.mirror_enabled = True
+    with sim.Simulation(midnight()) as simulation:
+        simulation.run(hours * 3600)
+    mirror = simulation.states["screen"].mirror
+    return {
+        "offers": mirror.offers,
+        "payloads": mirror.payloads,
+        "payloadBytes": mirror.payloadBytes,
+        "oversized": mirror.oversized,
+    }
+
+
+def cmd_mirror(args):
+    results = mirror_render_loop(args.fps, args.seconds)
+    print(
+        "render loop at {} fps, offer: {}ms".format(
+            args.fps, summary_ms_str(results["offer"])
+        )
+    )
+    sizes = results["payloadBytes"]
+    print(
+        "{:.2f} payloads per second of {:.0f} bytes on average (max {}), "
+        "encoding used {:.2%} of a cpu, the whole loop {:.2%}".format(
+            results["payloadsPerSecond"],
+            sizes["mean"],
+            sizes["max"],
+            results["cpuShare"],
+            results["processCpuShare"],
+        )
+    )
+    results = run_isolated(mirror_day, args.hours)
+    print(
+        "simulated {} hours: {} frames offered, {:.1f} payloads per hour, "
+        "{:.0f} bytes per hour, {} too big".format(
+            args.hours,
+            results["offers"],
+            results["payloads"] / args.hours,
+            results["payloadBytes"] / args.hours,
+            results["oversized"],
+        )
+    )
+
+
+# name, bus, lux seconds, proximity seconds, seconds per read
+BENCH_SENSORS = [
+    ("left", "mux", 0, 0, 0.004),
+    ("right", "mux", 0, 0, 0.004),
+    ("ceiling", "second", 5, 1, 0.006),
+    ("door", "third", 1, 0, 0.008),
+]
+
+
+def sensor_polls(threads, seconds, pollSeconds):
+    clock = clocks.RealClock()
+    locks = {}
+    sensorList = [
+        sensors.Sensor(
+            name,
+            sim.FakeAPDS(clock, sim.daylight_lux, sim.restless_proximity, readSeconds),
+            locks.setdefault(bus, threading.Lock()),
+            luxSeconds,
+            proximitySeconds,
+        )
+        for name, bus, luxSeconds, proximitySeconds, readSeconds in BENCH_SENSORS
+    ]
+    array = sensors.SensorArray(sensorList, sim.FakeColorUtility.calculate_lux, threads)
+    pollTimes = []
+    start = time.monotonic()
+    while time.monotonic() - start < seconds:
+        t = time.perf_counter()
+        array.poll(clock.monotonic(), True, True, timeout=1)
+        pollTimes.append(time.perf_counter() - t)
+        time.sleep(pollSeconds)
+    array.shutdown()
+    return summary(pollTimes), array.stats()
+
+
+def cmd_sensors(args):
+    for threads in [0, args.threads]:
+        pollSummary, stats = sensor_polls(threads, args.seconds, args.poll_ms / 1000)
+        print(
+            "{} threads, poll: {}ms".format(threads, summary_ms_str(pollSummary))
+        )
+        for name, bus, luxSeconds, proximitySeconds, readSeconds in BENCH_SENSORS:
+            s = stats[name]
+            print(
+                "  {:8} bus {:6} lux every {}s, proximity every {}s: {:4} reads, "
+                "latency p50 {:.2f} p99 {:.2f}ms".format(
+                    name,
+                    bus,
+                    luxSeconds,
+                    proximitySeconds,
+                    s["reads"],
+                    s["p50Ms"],
+                    s["p99Ms"],
+                )
+            )
+
+
+def layout_render(chain, parallel, frames):
+    const.snapshot_dir = None
+    const.scr_led_chain, const.scr_led_parallel = chain, parallel
+    const.scr_pixel_mapper_config = ""
+    clock = clocks.VirtualClock(datetime.now().replace(hour=9, minute=0, second=0))
+    screen.do_init(None, clock=clock)
+    state = screen._state
+    state.matrix = sim.FakeMatrix()
+    state.fonts = sim.screen_fonts()
+    screen.init_widgets()
+    screen.init_render_worker()
+    compositor = state.compositor
+
+    def timed_frames(step):
+        panelFrames = sum(compositor.panelFrames)
+        times = []
+        for i in range(frames):
+            step(i)
+            start = time.perf_counter()
+            screen.renderFrame(screen.RenderSnapshot(state))
+            times.append(time.perf_counter() - start)
+        panels = (sum(compositor.panelFrames) - panelFrames) / frames
+        return summary(times)["mean"], panels
+
+    results = {
+        "size": (state.matrix.width, state.matrix.height),
+        "panels": len(compositor.panels),
+    }
+    results["full"] = timed_frames(lambda i: compositor.invalidate())
+    # the temperature, at the bottom left, changes. Three values, so each
+    # frame differs from the previous one drawn into the same buffer
+    state.cachedOutsideTemperatureTimestamp = clock.monotonic()
+
+    def temperature(i):
+        state.cachedOutsideTemperature = [72, 8, 100][i % 3]
+
+    results["temperature"] = timed_frames(temperature)
+    # a message scrolling across the top
+    state.displayMessage = "scroll" * state.matrix.width
+
+    def scroll(i):
+        clock.advance_to(clock.t + 1.0 / const.scr_animationFps)
+
+    results["marquee"] = timed_frames(scroll)
+    return results
+
+
+def cmd_layout(args):
+    for chain, parallel in [(1, 1), (2, 1), (2, 2), (4, 2)]:
+        results = run_isolated(layout_render, chain, parallel, args.frames)
+        print(
+            "{}x{} ({} panels): full frame {:.2f}ms, temperature change {:.2f}ms "
+            "({:.1f} panels drawn), marquee {:.2f}ms ({:.1f} panels drawn)".format(
+                results["size"][0],
+                results["size"][1],
+                results["panels"],
+                results["full"][0] * 1000,
+                results["temperature"][0] * 1000,
+                results["temperature"][1],
+                results["marquee"][0] * 1000,
+                results["marquee"][1],
+            )
+        )
+
+
+# =============================================================================
+
+
+# globals
+logger = log.getLogger()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="bedclock benchmarks")
+    parser.add_argument("--debug", action="store_true")
+    subparsers = parser.add_subparsers(dest="bench")
+    subparsers.required = True
+
+    p = subparsers.add_parser(
+        "render", help="proximity handling latency versus render time"
+    )
+    p.add_argument("--vsync-ms", type=int, nargs="+", default=[0, 16, 50])
+    p.add_argument("--seconds", type=int, default=10)
+    p.add_argument("--message", default="a message long enough to scroll by")
+    p.set_defaults(fun=cmd_render)
+
+    p = subparsers.add_parser(
+        "restart", help="time until the display is right after a restart"
+    )
+    p.add_argument("--lux", type=int, default=const.motion_luxDarkRoomThreshold + 1)
+    p.add_argument("--lux-delay", type=float, default=1.0)
+    p.add_argument("--timeout", type=int, default=60)
+    p.set_defaults(fun=cmd_restart)
+
+    p = subparsers.add_parser(
+        "day", help="run a simulated day of sensor input on a virtual clock"
+    )
+    p.add_argument("--hours", type=float, default=24)
+    p.set_defaults(fun=cmd_day)
+
+    p = subparsers.add_parser(
+        "flood", help="burst of inbound mqtt messages, as on a reconnect"
+    )
+    p.add_argument("--messages", type=int, default=5000)
+    p.set_defaults(fun=cmd_flood)
+
+    p = subparsers.add_parser("ctl", help="control socket round trip latency")
+    p.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    p.add_argument("--requests", type=int, default=2000)
+    p.set_defaults(fun=cmd_ctl)
+
+    p = subparsers.add_parser(
+        "ipc", help="shared memory rings versus multiprocessing.Queue"
+    )
+    p.add_argument("--round-trips", type=int, default=2000)
+    p.add_argument("--events", type=int, default=50000)
+    p.set_defaults(fun=cmd_ipc)
+
+    p = subparsers.add_parser(
+        "wake", help="wake up latency under a flood of other screen commands"
+    )
+    p.add_argument("--seconds", type=int, default=10)
+    p.add_argument("--flood-per-ms", type=int, default=50)
+    p.set_defaults(fun=cmd_wake)
+
+    p = subparsers.add_parser(
+        "publishes", help="mqtt publishes of a simulated day, per publish mode"
+    )
+    p.add_argument("--hours", type=float, default=24)
+    p.set_defaults(fun=cmd_publishes)
+
+    p = subparsers.add_parser(
+        "telemetry", help="size of the batched sensor sample telemetry"
+    )
+    p.add_argument("--hours", type=float, default=24)
+    p.set_defaults(fun=cmd_telemetry)
+
+    p = subparsers.add_parser(
+        "mirror", help="cost and size of mirroring the frames shown"
+    )
+    p.add_argument("--fps", type=int, default=const.scr_animationFps)
+    p.add_argument("--seconds", type=int, default=10)
+    p.add_argument("--hours", type=float, default=24)
+    p.set_defaults(fun=cmd_mirror)
+
+    p = subparsers.add_parser(
+        "sensors", help="read latency of several simulated motion sensors"
+    )
+    p.add_argument("--threads", type=int, default=const.motion_sensor_threads)
+    p.add_argument("--seconds", type=int, default=10)
+    p.add_argument("--poll-ms", type=int, default=const.motion_pollInMs)
+    p.set_defaults(fun=cmd_sensors)
+
+    p = subparsers.add_parser("layout", help="render time as panel count grows")
+    p.add_argument("--frames", type=int, default=200)
+    p.set_defaults(fun=cmd_layout)
+
+    args = parser.parse_args()
+    log.log_to_console()
+    if args.debug:
+        log.set_log_level_debug()
+    args.fun(args)
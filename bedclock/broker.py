@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+
+# A stand-in mqtt broker, for load tests (see fleet.py) on machines without
+# mosquitto. It speaks just enough MQTT 3.1.1 for paho clients: connect,
+# subscribe with + and # wildcards, publish at qos 0 and 1 (qos 2 is taken
+# at 1), retained messages, pings and persistent sessions: the
+# subscriptions of a client connecting with clean session off are kept, and
+# qos 1 messages for it are queued while it is away. Like mosquitto, a
+# client connecting with the client id of a connected one takes over, and
+# the old connection is closed.
+#
+#   $ python3 bedclock/broker.py --port 1883
+
+import argparse
+import selectors
+import socket
+import struct
+import threading
+import time
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+RECV_SIZE = 65536
+MAX_PACKET_SIZE = 1 << 20
+# most messages queued for a persistent session while its client is away
+MAX_QUEUED = 1000
+
+
+def topic_matches(topicFilter, topic):
+    """Does topic match the subscription topicFilter?"""
+    filterLevels = topicFilter.split("/")
+    topicLevels = topic.split("/")
+    for i, level in enumerate(filterLevels):
+        if level == "#":
+            return True
+        if i >= len(topicLevels):
+            return False
+        if level != "+" and level != topicLevels[i]:
+            return False
+    return len(filterLevels) == len(topicLevels)
+
+
+def _subscribed_qos(subscriptions, topic):
+    """Highest qos of the subscriptions matching topic, or None."""
+    qos = None
+    for topicFilter, subQos in subscriptions.items():
+        if topic_matches(topicFilter, topic):
+            qos = subQos if qos is None else max(qos, subQos)
+    return qos
+
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _packet(kind, flags, body):
+    return bytes([kind << 4 | flags]) + _encode_length(len(body)) + body
+
+
+def _string(data, offset):
+    (length,) = struct.unpack_from(">H", data, offset)
+    offset += 2
+    return data[offset:offset + length].decode("utf-8"), offset + length
+
+
+def _encode_string(value):
+    encoded = value.encode("utf-8")
+    return struct.pack(">H", len(encoded)) + encoded
+
+
+def publish_packet(topic, payload, qos=0, retain=False, packetId=0):
+    body = _encode_string(topic)
+    if qos:
+        body += struct.pack(">H", packetId)
+    return _packet(PUBLISH, qos << 1 | int(retain), body + payload)
+
+
+def read_packet(buf):
+    """Return (kind, flags, body, size) of the first packet in buf, or None
+    when it is not all there yet.
+    """
+    length = 0
+    for i in range(1, 5):
+        if i >= len(buf):
+            return None
+        length += (buf[i] & 0x7F) << (7 * (i - 1))
+        if not buf[i] & 0x80:
+            break
+    else:
+        raise ValueError("bad remaining length")
+    if length > MAX_PACKET_SIZE:
+        raise ValueError("packet of {} bytes is too big".format(length))
+    size = i + 1 + length
+    if len(buf) < size:
+        return None
+    return buf[0] >> 4, buf[0] & 0x0F, bytes(buf[i + 1:size]), size
+
+
+class _Connection(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.inBuf = bytearray()
+        self.outBuf = bytearray()
+        self.clientId = None
+        self.subscriptions = {}  # topic filter: qos
+        self.nextPacketId = 0
+
+    def packet_id(self):
+        self.nextPacketId = self.nextPacketId % 0xFFFF + 1
+        return self.nextPacketId
+
+
+class Broker(object):
+    """Sessions and retained messages, as returned by persisted(), can be
+    handed to the next Broker, like mosquitto does with persistence on.
+    """
+
+    def __init__(self, host="127.0.0.1", port=1883, sessions=None, retained=None):
+        self.host = host
+        self.port = port
+        self.selector = None
+        self.listener = None
+        self.thread = None
+        self.stopping = False
+        self.connections = {}  # socket: _Connection
+        self.clients = {}  # client id: _Connection
+        self.retained = retained if retained is not None else {}  # topic: payload
+        # client id: {"subscriptions": {topic filter: qos}, "queued": [...]}
+        self.sessions = sessions if sessions is not None else {}
+        self.lock = threading.Lock()  # for stats()
+        # stats
+        self.connects = 0
+        self.connectTimes = []  # (time, client id)
+        self.takeovers = 0
+        self.sessionsResumed = 0
+        self.subscribes = 0
+        self.retainedSent = 0
+        self.queuedSent = 0
+        self.queuedDropped = 0
+        self.publishesIn = 0
+        self.publishesOut = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+
+    def start(self):
+        """Listen and serve in a thread. Port 0 picks a free port."""
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.listener.listen(128)
+        self.listener.setblocking(False)
+        self.port = self.listener.getsockname()[1]
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.stopping = False
+        self.thread = threading.Thread(target=self._serve, name="broker", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and drop every client, like a broker going away."""
+        self.stopping = True
+        self.thread.join()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "clients": len(self.clients),
+                "connects": self.connects,
+                "connectTimes": list(self.connectTimes),
+                "takeovers": self.takeovers,
+                "sessionsResumed": self.sessionsResumed,
+                "subscribes": self.subscribes,
+                "retainedSent": self.retainedSent,
+                "queuedSent": self.queuedSent,
+                "queuedDropped": self.queuedDropped,
+                "publishesIn": self.publishesIn,
+                "publishesOut": self.publishesOut,
+                "bytesIn": self.bytesIn,
+                "bytesOut": self.bytesOut,
+            }
+
+    def persisted(self):
+        """(sessions, retained), once stopped."""
+        return self.sessions, self.retained
+
+    def _serve(self):
+        while not self.stopping:
+            for key, mask in self.selector.select(0.1):
+                if key.fileobj is self.listener:
+                    self._accept()
+                    continue
+                conn = self.connections.get(key.fileobj)
+                if conn is None:
+                    continue  # closed while handling an earlier event
+                if mask & selectors.EVENT_WRITE:
+                    self._flush(conn)
+                if mask & selectors.EVENT_READ and conn.sock in self.connections:
+                    self._receive(conn)
+        for conn in list(self.connections.values()):
+            self._close(conn)
+        self.selector.unregister(self.listener)
+        self.listener.close()
+        self.selector.close()
+
+    def _accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections[sock] = _Connection(sock)
+        self.selector.register(sock, selectors.EVENT_READ)
+
+    def _close(self, conn):
+        if self.connections.pop(conn.sock, None) is None:
+            return
+        with self.lock:
+            if self.clients.get(conn.clientId) is conn:
+                del self.clients[conn.clientId]
+        self.selector.unregister(conn.sock)
+        conn.sock.close()
+
+    def _send(self, conn, data):
+        if not conn.outBuf:
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE
+            self.selector.modify(conn.sock, events)
+        conn.outBuf += data
+        with self.lock:
+            self.bytesOut += len(data)
+
+    def _flush(self, conn):
+        try:
+            sent = conn.sock.send(conn.outBuf)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._close(conn)
+            return
+        del conn.outBuf[:sent]
+        if not conn.outBuf:
+            self.selector.modify(conn.sock, selectors.EVENT_READ)
+
+    def _receive(self, conn):
+        try:
+            data = conn.sock.recv(RECV_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(conn)
+            return
+        with self.lock:
+            self.bytesIn += len(data)
+        conn.inBuf += data
+        try:
+            while conn.sock in self.connections:
+                packet = read_packet(conn.inBuf)
+                if packet is None:
+                    break
+                kind, flags, body, size = packet
+                del conn.inBuf[:size]
+                if conn.clientId is None and kind != CONNECT:
+                    raise ValueError("{} before connect".format(kind))
+                self._handle(conn, kind, flags, body)
+        except (ValueError, IndexError, struct.error):
+            self._close(conn)
+
+    def _handle(self, conn, kind, flags, body):
+        if kind == CONNECT:
+            self._handle_connect(conn, body)
+        elif kind == PUBLISH:
+            self._handle_publish(conn, flags, body)
+        elif kind == PUBREL:
+            self._send(conn, _packet(PUBCOMP, 0, body[:2]))
+        elif kind == SUBSCRIBE:
+            self._handle_subscribe(conn, body)
+        elif kind == UNSUBSCRIBE:
+            offset = 2
+            while offset < len(body):
+                topicFilter, offset = _string(body, offset)
+                conn.subscriptions.pop(topicFilter, None)
+            self._send(conn, _packet(UNSUBACK, 0, body[:2]))
+        elif kind == PINGREQ:
+            self._send(conn, _packet(PINGRESP, 0, b""))
+        elif kind == DISCONNECT:
+            self._close(conn)
+        # acks of what we sent (PUBACK, PUBREC, PUBCOMP) need nothing
+
+    def _handle_connect(self, conn, body):
+        protocol, offset = _string(body, 0)
+        level, connectFlags = body[offset], body[offset + 1]
+        if protocol not in ("MQTT", "MQIsdp"):
+            raise ValueError("not mqtt")
+        offset += 4  # level, flags and keep alive
+        clientId, offset = _string(body, offset)
+        if level < 3 or level > 4:
+            self._send(conn, _packet(CONNACK, 0, b"\x00\x01"))
+            return
+        if not clientId:
+            clientId = "auto-{}".format(id(conn))
+        with self.lock:
+            self.connects += 1
+            self.connectTimes.append((time.time(), clientId))
+            old = self.clients.get(clientId)
+            self.clients[clientId] = conn
+            if old is not None:
+                self.takeovers += 1
+        if old is not None:
+            self._close(old)
+        conn.clientId = clientId
+        session = None
+        if connectFlags & 0x02:  # clean session
+            self.sessions.pop(clientId, None)
+        else:
+            session = self.sessions.get(clientId)
+        if session is None:
+            self._send(conn, _packet(CONNACK, 0, b"\x00\x00"))
+            if not connectFlags & 0x02:
+                self.sessions[clientId] = {"subscriptions": {}, "queued": []}
+                conn.subscriptions = self.sessions[clientId]["subscriptions"]
+            return
+        with self.lock:
+            self.sessionsResumed += 1
+            self.queuedSent += len(session["queued"])
+        self._send(conn, _packet(CONNACK, 0, b"\x01\x00"))
+        conn.subscriptions = session["subscriptions"]
+        for topic, payload in session["queued"]:
+            self._send(conn, publish_packet(topic, payload, 1, False, conn.packet_id()))
+        session["queued"] = []
+
+    def _handle_publish(self, conn, flags, body):
+        qos = min((flags >> 1) & 0x03, 1)
+        topic, offset = _string(body, 0)
+        if qos or flags & 0x06:
+            packetId = body[offset:offset + 2]
+            offset += 2
+        payload = body[offset:]
+        with self.lock:
+            self.publishesIn += 1
+        if (flags >> 1) & 0x03 == 2:
+            self._send(conn, _packet(PUBREC, 0, packetId))
+        elif qos:
+            self._send(conn, _packet(PUBACK, 0, packetId))
+        if flags & 0x01:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        for other in list(self.connections.values()):
+            if other.clientId is None:
+                continue  # not connected yet
+            subQos = _subscribed_qos(other.subscriptions, topic)
+            if subQos is None:
+                continue
+            outQos = min(qos, subQos)
+            packet = publish_packet(
+                topic, payload, outQos, False, other.packet_id() if outQos else 0
+            )
+            self._send(other, packet)
+            with self.lock:
+                self.publishesOut += 1
+        if not qos:
+            return
+        # qos 1 messages wait for persistent sessions whose client is away
+        for clientId, session in self.sessions.items():
+            if clientId in self.clients:
+                continue
+            if not _subscribed_qos(session["subscriptions"], topic):
+                continue
+            if len(session["queued"]) >= MAX_QUEUED:
+                with self.lock:
+                    self.queuedDropped += 1
+                continue
+            session["queued"].append((topic, payload))
+
+    def _handle_subscribe(self, conn, body):
+        packetId = body[:2]
+        offset = 2
+        granted = bytearray()
+        topicFilters = []
+        while offset < len(body):
+            topicFilter, offset = _string(body, offset)
+            qos = min(body[offset] & 0x03, 1)
+            offset += 1
+            conn.subscriptions[topicFilter] = qos
+            topicFilters.append((topicFilter, qos))
+            granted.append(qos)
+        with self.lock:
+            self.subscribes += 1
+        self._send(conn, _packet(SUBACK, 0, packetId + bytes(granted)))
+        for topic, payload in self.retained.items():
+            for topicFilter, qos in topicFilters:
+                if topic_matches(topicFilter, topic):
+                    packetId = conn.packet_id() if qos else 0
+                    packet = publish_packet(topic, payload, qos, True, packetId)
+                    self._send(conn, packet)
+                    with self.lock:
+                        self.retainedSent += 1
+                    break
+
+
+# =============================================================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="stand-in mqtt broker")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--port", type=int, default=1883, help="port to listen on")
+    args = parser.parse_args()
+    broker = Broker(args.host, args.port).start()
+    print("listening on {}:{}".format(args.host, broker.port), flush=True)
+    try:
+        broker.thread.join()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# Where motion, screen and mqttclient get the time from, and how they wait.
+# RealClock is what the processes use. VirtualClock lets a simulation (see
+# sim.Simulation) run a day worth of these modules in a fraction of that.
+
+from datetime import datetime
+import queue
+import time
+
+
+class RealClock(object):
+    virtual = False
+
+    def now(self):
+        return datetime.now()
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def get(self, q, timeout=None):
+        """Like q.get(True, timeout)."""
+        return q.get(True, timeout)
+
+
+class VirtualClock(object):
+    """Time only moves when advance_to() is called.
+
+    Waits never block. Instead, the earliest time a wait would end is kept
+    in wakeTime, so whoever steps the modules knows when to step them next.
+    """
+
+    virtual = True
+
+    def __init__(self, start=None):
+        if start is None:
+            start = datetime.now()
+        self.epoch = start.timestamp()
+        self.t = 0.0
+        self.wakeTime = None
+
+    def now(self):
+        return datetime.fromtimestamp(self.epoch + self.t)
+
+    def time(self):
+        return self.epoch + self.t
+
+    def monotonic(self):
+        return self.t
+
+    def sleep(self, seconds):
+        self._wake_at(self.t + seconds)
+
+    def get(self, q, timeout=None):
+        try:
+            return q.get_nowait()
+        except queue.Empty:
+            self._wake_at(float("inf") if timeout is None else self.t + timeout)
+            raise
+
+    def _wake_at(self, t):
+        if self.wakeTime is None or t < self.wakeTime:
+            self.wakeTime = t
+
+    def advance_to(self, t):
+        self.t = max(self.t, t)
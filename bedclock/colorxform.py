@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import functools
+
+from bedclock import const
+
+MODE_DAY = "day"
+MODE_NIGHT = "night"
+
+
+# =============================================================================
+
+
+def select_mode(now, lux):
+    """Night mode is used during night hours, as long as the room is dark."""
+    if not const.scr_nightModeEnabled:
+        return MODE_DAY
+    start, end = const.scr_nightModeStartHour, const.scr_nightModeEndHour
+    if start <= end:
+        nightHours = start <= now.hour < end
+    else:
+        # window wraps around midnight
+        nightHours = now.hour >= start or now.hour < end
+    if nightHours and lux <= const.scr_nightModeLuxThreshold:
+        return MODE_NIGHT
+    return MODE_DAY
+
+
+def brightness_bucket(brightness):
+    buckets = const.scr_colorXformBuckets
+    bucket = int(brightness * buckets / (const.scr_brightnessMaxValue + 1))
+    return min(buckets - 1, bucket)
+
+
+def xform_key(now, lux, brightness):
+    return select_mode(now, lux), brightness_bucket(brightness)
+
+
+# =============================================================================
+
+
+@functools.lru_cache(maxsize=None)
+def build_luts(mode, bucket):
+    """Return a 256 entry lookup table for each of the red, green and blue
+    channels. Tables are built once per (mode, bucket) and cached.
+    """
+    identity = bytes(range(256))
+    if mode != MODE_NIGHT:
+        return identity, identity, identity
+
+    # the dimmer the screen, the further down the colors get scaled
+    minScale = const.scr_nightModeMinScale
+    scale = minScale
+    if const.scr_colorXformBuckets > 1:
+        scale += (1.0 - minScale) * bucket / (const.scr_colorXformBuckets - 1)
+    gamma = const.scr_nightModeGamma
+    luts = []
+    for gain in const.scr_nightModeRgbGain:
+        lut = bytearray(256)
+        for i in range(1, 256):
+            value = int(round(255 * ((i / 255.0) ** gamma) * gain * scale))
+            # do not let a lit pixel go completely dark
+            lut[i] = min(255, max(1 if gain else 0, value))
+        luts.append(bytes(lut))
+    return tuple(luts)
+
+
+def transform_rgb(luts, rgb):
+    return tuple(lut[c] for lut, c in zip(luts, rgb))
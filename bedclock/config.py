@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+
+# Knobs from a config file, on top of the defaults in const.py. The file is
+# read when bedclock starts and again whenever it changes, but never by the
+# code using the knobs: that keeps reading const, where each process puts
+# the values of the latest snapshot. A snapshot has a version and all the
+# knobs of the file. It goes to every process as a single command, so the
+# knobs in it change together, between two iterations of that process.
+#
+# Some knobs are only read when a process starts: the broker, the led panel,
+# the sensors, the queues between processes, ... Setting them later would
+# not change a thing, so a file that changes one of them is rejected while
+# bedclock runs. They take effect on the next restart.
+
+import fnmatch
+import json
+import os
+import sys
+import threading
+import time
+import types
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None  # older than python 3.11: json only
+
+# need this because exported python path gets lost when invoking sudo
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+from bedclock import const  # noqa
+from bedclock import events  # noqa
+from bedclock import log  # noqa
+
+# knobs only read when a process starts, as fnmatch patterns
+REINIT_KEYS = [
+    "config_*",
+    "mqtt_broker_*",
+    "mqtt_enabled",
+    "mqtt_topic*",
+    "mqtt_instance",
+    "mqtt_client_id",
+    "mqtt_inbox_max_topics",
+    "mqtt_statedoc_full_seconds",
+    "mqtt_reconnect_*",
+    "mqtt_clean_session",
+    "scr_led_*",
+    "scr_row_address_type",
+    "scr_fonts_dir",
+    "scr_pixel_mapper_config",
+    "scr_clockOffsetY",
+    "scr_stayOnInDarkRoomDefault",
+    "scr_marqueeGapPixels",
+    # the color lookup tables are built once, see colorxform.build_luts
+    "scr_nightModeRgbGain",
+    "scr_nightModeGamma",
+    "scr_nightModeMinScale",
+    "scr_colorXformBuckets",
+    "motion_sensors",
+    "motion_sensor_threads",
+    "motion_mux_address",
+    "motion_proximityMinThreshold",
+    "proc_*",
+    "ipc_*",
+    "mem_*",
+    "snapshot_dir",
+    "ts_dir",
+    "ts_tiers",
+    "eventlog_*",
+    "ctlsock_*",
+    "telemetry_*",
+    "mirror_*",
+]
+# in const, but not for a config file to set
+FIXED_KEYS = {"config_path", "mqtt_topics_pub", "mqtt_topics_sub"}
+# knobs that const.py documents None for, besides the ones that are None
+NONE_KEYS = {"mqtt_republish_seconds", "snapshot_dir", "ts_dir", "ctlsock_path"}
+# knobs that const.py sets from another knob, and follow it unless the
+# file sets them too
+DERIVED_KEYS = {
+    "motion_luxDarkRoomThreshold": "motion_luxLowWatermark",
+    "scr_nightModeLuxThreshold": "motion_luxHighWatermark",
+}
+_INVALID = object()
+
+
+class Snapshot(object):
+    def __init__(self, version, values):
+        self.version = version
+        self.values = values  # knob: value, as in the file
+
+    def __repr__(self):
+        return "Snapshot(version={}, knobs={})".format(self.version, len(self.values))
+
+
+# =============================================================================
+
+
+def is_reinit(name):
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in REINIT_KEYS)
+
+
+def read_file(path):
+    """Return the knobs in a config file, or {} when there is no file.
+
+    Files ending in .toml are TOML, everything else is JSON. Raises
+    ValueError when the file cannot be parsed.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}
+    if path.endswith(".toml"):
+        if tomllib is None:
+            raise ValueError("reading TOML needs python 3.11 or newer")
+        values = tomllib.loads(data.decode())
+    else:
+        values = json.loads(data)
+    if not isinstance(values, dict):
+        raise ValueError("expected an object with knob names and values")
+    return values
+
+
+def _check_value(name, default, value):
+    # the value to use, with the type of the default, or _INVALID
+    if isinstance(default, (tuple, set)) and isinstance(value, list):
+        return type(default)(value)  # json and toml only have lists
+    if default is None or (value is None and name in NONE_KEYS):
+        return value
+    if isinstance(default, bool) or isinstance(value, bool):
+        sameType = isinstance(default, bool) and isinstance(value, bool)
+        return value if sameType else _INVALID
+    # not the other way around: code stepping an int knob would never settle
+    if isinstance(default, float) and isinstance(value, int):
+        return float(value)
+    return value if isinstance(value, type(default)) else _INVALID
+
+
+def _effective(values):
+    # every knob, with values over the defaults
+    effective = dict(_defaults)
+    effective.update(values)
+    for name, source in DERIVED_KEYS.items():
+        if name not in values:
+            effective[name] = effective[source]
+    return effective
+
+
+def _changes(values):
+    # knobs that values would change in this process
+    effective = _effective(values)
+    return sorted(n for n, v in effective.items() if getattr(const, n) != v)
+
+
+def check(values, live=False):
+    """Return the values of a config file with the types of the defaults,
+    and a list of what is wrong with them. Live, that includes changing a
+    knob that is only read when a process starts.
+    """
+    result = {}
+    errors = []
+    for name, value in sorted(values.items()):
+        if name not in _defaults:
+            errors.append("{}: not a knob".format(name))
+            continue
+        checked = _check_value(name, _defaults[name], value)
+        if checked is _INVALID:
+            errors.append(
+                "{}: expected {}, not {!r}".format(
+                    name, type(_defaults[name]).__name__, value
+                )
+            )
+            continue
+        result[name] = checked
+    if live:
+        reinit = [n for n in _changes(result) if is_reinit(n)]
+        if reinit:
+            errors.append("restart bedclock to change {}".format(", ".join(reinit)))
+    return result, errors
+
+
+def apply(snapshot):
+    """Put the knobs of a snapshot in const, and the defaults back for the
+    ones not in it. Each process calls this from the thread running its
+    commands, so it happens between two of its iterations. The screen has
+    its render thread call it between two frames, see RenderWorker.
+    """
+    global _current
+    effective = _effective(snapshot.values)
+    changed = _changes(snapshot.values)
+    for name in changed:
+        setattr(const, name, effective[name])
+    if any(n == "mqtt_instance" or n.startswith("mqtt_topic") for n in changed):
+        const.mqtt_topics_pub, const.mqtt_topics_sub = const.mqtt_topics(
+            const.mqtt_instance
+        )
+    _current = snapshot
+    logger.info(
+        "config version {} applied, changed: {}".format(
+            snapshot.version, ", ".join(changed) or "nothing"
+        )
+    )
+    return changed
+
+
+def current():
+    return _current
+
+
+# =============================================================================
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class Watcher(threading.Thread):
+    # there is no inotify in the standard library, so the file gets polled:
+    # a stat every few seconds costs next to nothing
+    def __init__(self, path, pollSeconds, queueEventFun, stamp=None):
+        threading.Thread.__init__(self, name="config-watcher", daemon=True)
+        self.path = path
+        self.pollSeconds = pollSeconds
+        self.queueEventFun = queueEventFun
+        self.stamp = stamp
+
+    def poll(self):
+        """Return the knobs in the file if it changed since last time."""
+        stamp = _stamp(self.path)
+        if stamp == self.stamp:
+            return None
+        # taken before reading, so a write while reading is not missed
+        self.stamp = stamp
+        try:
+            return read_file(self.path)
+        except (OSError, ValueError) as e:
+            logger.error("ignoring config {}: {}".format(self.path, e))
+            return None
+
+    def run(self):
+        while True:
+            time.sleep(self.pollSeconds)
+            values = self.poll()
+            if values is None:
+                continue
+            try:
+                self.queueEventFun(events.ConfigReload(values, self.path))
+            except RuntimeError as e:
+                logger.error("cannot reload config: {}".format(e))
+                self.stamp = None  # try again next time
+
+
+# =============================================================================
+
+
+# called from outside this module
+def do_init():
+    """Read the config file when bedclock starts, when any knob can be set.
+    Returns the stamp of what was read, for the watcher.
+    """
+    path = const.config_path
+    if not path:
+        return None
+    stamp = _stamp(path)
+    try:
+        values = read_file(path)
+    except (OSError, ValueError) as e:
+        logger.error("ignoring config {}: {}".format(path, e))
+        return stamp
+    values, errors = check(values)
+    if errors:
+        logger.error("ignoring config {}: {}".format(path, "; ".join(errors)))
+        return stamp
+    if values:
+        apply(Snapshot(_current.version + 1, values))
+    return stamp
+
+
+# called from outside this module
+def do_reload(values):
+    """Check the knobs of a file that changed and apply them in this process.
+    Returns the snapshot for the other processes, or None if there is none.
+    """
+    values, errors = check(values, live=True)
+    if errors:
+        logger.error(
+            "config rejected, still on version {}: {}".format(
+                _current.version, "; ".join(errors)
+            )
+        )
+        return None
+    if not _changes(values):
+        logger.debug("config has no changes")
+        return None
+    snapshot = Snapshot(_current.version + 1, values)
+    apply(snapshot)
+    return snapshot
+
+
+# called from outside this module
+def start_watcher(queueEventFun, stamp=None):
+    if not const.config_path:
+        return None
+    watcher = Watcher(
+        const.config_path, const.config_poll_seconds, queueEventFun, stamp
+    )
+    watcher.start()
+    return watcher
+
+
+# globals
+logger = log.getLogger()
+# what const had before any config file, for the knobs a file can set
+_defaults = {
+    name: value
+    for name, value in vars(const).items()
+    if not (name.startswith("_") or name in FIXED_KEYS)
+    if not isinstance(value, (types.FunctionType, types.ModuleType))
+}
+_current = Snapshot(0, {})
@@ -2,28 +2,89 @@
 
 # options related to mqtt
 mqtt_broker_ip = "192.168.10.238"
+mqtt_broker_port = 1883
 mqtt_enabled = True
 mqtt_topic_prefix = "bedclock"
 mqtt_topic_pub_light = "light"
 mqtt_topic_pub_motion = "motion"
-mqtt_topics_pub = {
-    t: "/{}/{}".format(mqtt_topic_prefix, t)
-    for t in [mqtt_topic_pub_light, mqtt_topic_pub_motion]
-}
+mqtt_topic_pub_query_result = "query_result"
+mqtt_topic_pub_state = "state"
+mqtt_topic_pub_state_delta = "state/delta"
+mqtt_topic_pub_telemetry = "telemetry"
+mqtt_topic_pub_frame = "frame"
 mqtt_topic_sub_msg = "msg"
 mqtt_topic_sub_stay = "stay"
 mqtt_topic_sub_temperature = "temperature_outside"
-mqtt_topics_sub = {
-    t: "/{}/{}".format(p, t)
-    for p, t in [
-        (mqtt_topic_prefix, mqtt_topic_sub_stay),
-        ("sensor", mqtt_topic_sub_temperature),
-    ]
-}
-mqtt_topics_sub[mqtt_topic_sub_msg] = "/msg"
+mqtt_topic_sub_profile = "profile"
+mqtt_topic_sub_query = "query"
+# with more than one clock on a broker, give each of them an instance name:
+# the topics of a clock then go under /bedclock/<instance>/, while /msg and
+# the outside temperature stay shared by all clocks. The client id is
+# bedclock-<instance>, or bedclock-<hostname> when there is no instance,
+# so clocks do not kick each other off the broker
+mqtt_instance = None
+mqtt_client_id = None  # overrides the above
+
+
+def mqtt_topics(instance):
+    """Return the (publish, subscribe) topics of a clock, by topic name."""
+    prefix = mqtt_topic_prefix
+    if instance:
+        prefix = "{}/{}".format(mqtt_topic_prefix, instance)
+    topicsPub = {
+        t: "/{}/{}".format(prefix, t)
+        for t in [
+            mqtt_topic_pub_light,
+            mqtt_topic_pub_motion,
+            mqtt_topic_pub_query_result,
+            mqtt_topic_pub_state,
+            mqtt_topic_pub_state_delta,
+            mqtt_topic_pub_telemetry,
+            mqtt_topic_pub_frame,
+        ]
+    }
+    topicsSub = {
+        t: "/{}/{}".format(p, t)
+        for p, t in [
+            (prefix, mqtt_topic_sub_stay),
+            (prefix, mqtt_topic_sub_profile),
+            (prefix, mqtt_topic_sub_query),
+            ("sensor", mqtt_topic_sub_temperature),
+        ]
+    }
+    topicsSub[mqtt_topic_sub_msg] = "/msg"
+    return topicsPub, topicsSub
+
+
+mqtt_topics_pub, mqtt_topics_sub = mqtt_topics(mqtt_instance)
 mqtt_value_enable = set(
     ["on", "true", "enable", "enabled", "1", "up", "yes", "yeah", "yup", "y"]
 )
+# most topics with inbound mqtt messages waiting to be handled. Only the
+# latest message of each topic is kept (see inbox.py)
+mqtt_inbox_max_topics = 32
+# what gets published: "topics" is one topic per value (light and motion),
+# "statedoc" is the whole state as a retained document (see statedoc.py) and
+# "both" is both. The document goes out at most every mqtt_statedoc_seconds,
+# with only the fields that changed, except for a full one every
+# mqtt_statedoc_full_seconds
+mqtt_publish_mode = "topics"
+mqtt_statedoc_seconds = 5
+mqtt_statedoc_full_seconds = 3600
+# after losing the broker, wait between mqtt_reconnect_min_seconds and
+# mqtt_reconnect_max_seconds before trying again, doubling each time, with
+# mqtt_reconnect_jitter of each wait picked at random (see backoff.py), so
+# clocks do not all come back at the same moment after a broker restart
+mqtt_reconnect_min_seconds = 1
+mqtt_reconnect_max_seconds = 120
+mqtt_reconnect_jitter = 1.0
+# a persistent session keeps subscriptions and qos 1 messages at the broker
+# while disconnected, so reconnecting needs no subscribe, and no burst of
+# retained messages comes with it
+mqtt_clean_session = False
+# a light or motion value equal to the last one published is published
+# again only after this many seconds. None always publishes it
+mqtt_republish_seconds = 900
 
 # options passed into rgb matrix
 # ['regular', 'adafruit-hat', 'adafruit-hat-pwm']
@@ -40,9 +101,16 @@ scr_led_pwm_bits = 11
 scr_led_pwm_lsb_nanoseconds = 130
 scr_led_rgb_sequence = "RBG"
 scr_led_show_refresh = False
+# without a limit, the refresh thread spins as fast as it can, regardless
+# of how many pwm bits are in use
+scr_led_limit_refresh_hz = 0
 scr_led_slowdown_gpio = None
 scr_led_no_hardware_pulse = False
 scr_pixel_mapper_config = "Rotate:90"
+# where things go on the screen is worked out from the size of the canvas
+# (see layout.py). This moves the clock, weekday and date down from the
+# middle of the space between message and temperature (up when negative)
+scr_clockOffsetY = -3
 
 # other screen related values
 scr_brightnessOff = 0
@@ -50,6 +118,10 @@ scr_brightnessMinValue = 8
 scr_brightnessMaxValue = 98
 scr_wakeupTimeoutInSeconds = 12
 scr_stayOnInDarkRoomDefault = False
+# pwm bits used while brightness is below a threshold, as a list of
+# (brightness below, pwm bits). The first match wins, otherwise
+# scr_led_pwm_bits is used. An empty list disables this policy
+scr_pwmBitsPolicy = [(16, 7), (40, 9)]
 
 # motion
 motion_proximityMinThreshold = 6
@@ -63,3 +135,172 @@ motion_luxDeltaThreshold = 196
 motion_luxMinValue = 0
 motion_luxMaxValue = 2123
 motion_luxDarkRoomThreshold = motion_luxLowWatermark
+
+# sensors polled by motion (see sensors.py), e.g. one on each side of the
+# bed. Lux is the average of what they see and proximity the highest. Each
+# entry is a dict where every key is optional:
+#   name: used in logs and stats
+#   scl, sda: board pins of its i2c bus, "SCL" and "SDA" by default
+#   mux_channel: channel of the TCA9548A mux, at motion_mux_address, that
+#     the sensor is behind
+#   lux_seconds, proximity_seconds: time between reads, 0 being every poll
+#   proximity_min_threshold: proximity below it counts as 0, by default
+#     motion_proximityMinThreshold
+#   lux_scale: what its lux gets multiplied by, to even out the sensors
+# e.g. [{"name": "left", "mux_channel": 0}, {"name": "right", "mux_channel": 1}]
+# Reads happen in motion_sensor_threads threads, and a poll waits for them
+# up to motion_sensor_read_timeout_seconds
+motion_sensors = [{"name": "default"}]
+motion_sensor_threads = 2
+motion_sensor_read_timeout_seconds = 0.25
+# a sensor whose last motion_sensor_stale_errors reads failed no longer
+# counts in the fused readings, so a stale "near" does not keep the screen
+# on. Once all of them failed motion_sensor_reinit_errors reads in a row,
+# motion initializes the sensors again, and exits when that does not help
+motion_sensor_stale_errors = 3
+motion_sensor_reinit_errors = 30
+motion_mux_address = 0x70
+
+# on demand profiling (see profiler.py). Started via SIGUSR1 or mqtt
+profile_dump_dir = "/var/lib/bedclock/profiles"
+# ['cprofile', 'sample', 'tracemalloc']
+profile_default_kind = "cprofile"
+profile_default_seconds = 30
+profile_max_seconds = 600
+profile_sample_interval_ms = 5
+profile_tracemalloc_frames = 10
+
+# process model used for the children (see main.py). With 'fork' children
+# carry everything the parent imported. 'spawn' and 'forkserver' start each
+# child with only the modules it needs (forkserver preloads the list below)
+# ['fork', 'spawn', 'forkserver']
+proc_start_method = "fork"
+proc_forkserver_preload = ["bedclock.const", "bedclock.events", "bedclock.log", "dill"]
+
+# transport between main and its children: "queue" for multiprocessing.Queue
+# or "shmring" for shared memory ring buffers (see shmring.py). Rings are
+# opt-in: their tail latency is worse than that of a queue (bench.py ipc).
+# A slot must fit a pickled event or command. Full rings drop what is put
+# into them, unless the policy for that process is "overwrite", which
+# replaces the oldest command, e.g. a stale lux to be published
+# ['queue', 'shmring']
+ipc_transport = "queue"
+ipc_slot_size = 4096
+ipc_event_slots = 256  # per process that sends events to main
+ipc_policies = {"mqttclient": "overwrite"}
+
+# memory reporting and budgets (see memstat.py). Budgets are uss in kB and
+# a budget of 0 means report only
+mem_report_period_seconds = 3600
+mem_budget_kb = {"main": 0, "mqttclient": 0, "motion": 0, "screen": 0}
+# ['warn', 'restart']
+mem_budget_action = "warn"
+
+# night mode color transform (see colorxform.py). During night hours, when
+# the room is dark, colors get shifted towards red and dimmed by gamma.
+# Lookup tables are cached per mode and brightness bucket
+scr_nightModeEnabled = True
+scr_nightModeStartHour = 22
+scr_nightModeEndHour = 7
+scr_nightModeLuxThreshold = motion_luxHighWatermark
+scr_nightModeRgbGain = (1.0, 0.45, 0.12)
+scr_nightModeGamma = 1.8
+# scale applied to the lowest brightness bucket; highest bucket uses 1.0
+scr_nightModeMinScale = 0.5
+scr_colorXformBuckets = 4
+
+# display messages wider than the screen scroll as a marquee. While that
+# happens, the screen is redrawn at a fixed frame rate
+scr_marqueeEnabled = True
+scr_marqueePixelsPerSecond = 16
+scr_marqueeGapPixels = 16
+scr_animationFps = 20
+scr_animationStatsPeriodInSeconds = 300
+
+# frames are drawn by a render thread, so handling commands (like proximity
+# waking the screen up) never waits on SwapOnVSync. Brightness fades take
+# one step per 1/scr_fadeStepsPerSecond, instead of one step per frame
+scr_fadeStepsPerSecond = 100
+
+# deep idle: when the screen is dark and idle, motion only looks at color
+# every motion_idleLuxPollInSeconds, and polls proximity every
+# motion_idlePollInMs instead of every motion_pollInMs. Reaching for the
+# clock in the dark then takes up to that long to wake the screen up
+motion_pollInMs = 321
+motion_idlePollInMs = 642
+motion_idleLuxPollInSeconds = 10
+
+# cpu affinity and scheduling per process (see cpusched.py). Each process
+# entry may have: cpus (list), policy (other, batch, idle, fifo or rr),
+# priority (for fifo and rr) and nice. None means leave it all alone
+proc_sched_profile = None
+proc_sched_profiles = {
+    # rgbmatrix pins its refresh thread to the last core of a 4 core Pi,
+    # so keep everything else away from it
+    "display-reserved": {
+        "main": {"cpus": [0, 1, 2], "nice": 5},
+        "mqttclient": {"cpus": [0, 1, 2], "nice": 10},
+        "motion": {"cpus": [0, 1, 2], "nice": 0},
+        "screen": {"cpus": [0, 1, 2], "nice": -5},
+    },
+}
+
+# state snapshots (see snapshot.py), so a restarted process comes back up
+# the way it was. Writes happen at most every snapshot_debounce_seconds and
+# snapshots older than snapshot_max_age_seconds are ignored. A
+# snapshot_dir of None disables them. Like the other directories bedclock
+# writes in, it must not be writable by other users (see safefs.py)
+snapshot_dir = "/var/lib/bedclock"
+snapshot_debounce_seconds = 5
+snapshot_max_age_seconds = 86400
+
+# sensor time series kept by motion (see timeseries.py). Each tier is
+# (bucket seconds, capacity), where 0 seconds keeps every sample and the
+# others keep min, max and average per bucket. These take about 1MB per
+# series: 6 hours of samples, a week per minute and 3 months per 15 minutes.
+# A ts_dir of None disables them
+ts_dir = "/var/lib/bedclock/timeseries"
+ts_tiers = [(0, 65536), (60, 10080), (900, 8640)]
+ts_query_max_points = 500
+
+# recording of the events that go through main (see eventlog.py). None
+# means not recording. When the log reaches eventlog_max_bytes, or main
+# restarts, the current log becomes <eventlog_path>.1
+eventlog_path = None
+eventlog_max_bytes = 8 * 1024 * 1024
+
+# local control socket served by main (see ctlsock.py), for reading state
+# and sending commands without going through the mqtt broker. None disables it
+ctlsock_path = "/run/bedclock/ctl.sock"
+ctlsock_max_clients = 32
+
+# every lux and proximity sample motion reads, published in batches to the
+# telemetry topic (see telemetry.py). A batch goes out every
+# telemetry_flush_seconds, or sooner once a series has
+# telemetry_flush_samples samples. Batches of both series must fit in an
+# ipc_slot_size slot, on their way to mqttclient
+telemetry_enabled = False
+telemetry_flush_seconds = 60
+telemetry_flush_samples = 256
+
+# copies of the frames the screen shows, published to the frame topic and
+# served by the control socket (see framemirror.py). At most mirror_max_fps
+# frames a second get encoded, using at most mirror_cpu_budget of a cpu,
+# and only when something changed. Each payload has the tiles that changed
+# since the previous one, and all of them every mirror_keyframe_seconds.
+# Payloads must fit in an ipc_slot_size slot, on their way to mqttclient
+mirror_enabled = False
+mirror_max_fps = 2
+mirror_cpu_budget = 0.02
+mirror_tile_size = 8
+mirror_keyframe_seconds = 60
+mirror_max_payload_bytes = 3072
+
+# knobs read from a file, over the ones in here (see config.py): a JSON
+# object of knob names and values, or TOML when the path ends in .toml and
+# python is 3.11 or newer. A missing file means no changes, and None means
+# no file. Main checks it every config_poll_seconds and, when it changed,
+# every process gets the new knobs between two of its iterations. Knobs only
+# read when bedclock starts, config.REINIT_KEYS, cannot change that way
+config_path = "/etc/bedclock/config.json"
+config_poll_seconds = 2
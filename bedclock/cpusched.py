@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+# need this because exported python path gets lost when invoking sudo
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+from bedclock import const  # noqa
+from bedclock import log  # noqa
+
+POLICIES = {
+    "other": os.SCHED_OTHER,
+    "batch": os.SCHED_BATCH,
+    "idle": os.SCHED_IDLE,
+    "fifo": os.SCHED_FIFO,
+    "rr": os.SCHED_RR,
+}
+
+
+# =============================================================================
+
+
+def current_settings():
+    policy = os.sched_getscheduler(0)
+    policyName = {v: k for k, v in POLICIES.items()}.get(policy, str(policy))
+    return "cpus {} policy {} priority {} nice {}".format(
+        sorted(os.sched_getaffinity(0)),
+        policyName,
+        os.sched_getparam(0).sched_priority,
+        os.getpriority(os.PRIO_PROCESS, 0),
+    )
+
+
+def apply_settings(procName, settings):
+    # Note: these apply to the calling thread, and are inherited by threads
+    #       it creates afterwards. So call this before any threads are started
+    cpus = settings.get("cpus")
+    if cpus is not None:
+        available = os.sched_getaffinity(0)
+        usable = set(cpus) & available
+        if usable:
+            os.sched_setaffinity(0, usable)
+        else:
+            logger.warning(
+                "{}: none of cpus {} are available in {}".format(
+                    procName, cpus, sorted(available)
+                )
+            )
+    policyName = settings.get("policy")
+    if policyName is not None:
+        priority = settings.get("priority", 0)
+        try:
+            os.sched_setscheduler(0, POLICIES[policyName], os.sched_param(priority))
+        except (KeyError, OSError) as e:
+            logger.warning(
+                "{}: unable to set policy {} priority {}: {}".format(
+                    procName, policyName, priority, e
+                )
+            )
+    nice = settings.get("nice")
+    if nice is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, nice)
+        except OSError as e:
+            logger.warning("{}: unable to set nice {}: {}".format(procName, nice, e))
+
+
+def apply_profile(procName, profileName=None):
+    if profileName is None:
+        profileName = const.proc_sched_profile
+    settings = const.proc_sched_profiles.get(profileName, {}).get(procName)
+    if settings:
+        apply_settings(procName, settings)
+    logger.info(
+        "{} scheduling (profile {}): {}".format(procName, profileName, current_settings())
+    )
+
+
+# =============================================================================
+
+
+def _burn(stopEvent, profileName, busySeconds, idleSeconds):
+    # bursty load, like mqtt traffic: spin for a while, then rest a bit
+    apply_profile("mqttclient", profileName)
+    while not stopEvent.is_set():
+        end = time.monotonic() + busySeconds
+        while time.monotonic() < end:
+            pass
+        time.sleep(idleSeconds)
+
+
+def measure_jitter(fps, seconds):
+    period = 1.0 / fps
+    lateness = []
+    nextFrame = time.monotonic() + period
+    end = nextFrame + seconds
+    while nextFrame < end:
+        time.sleep(max(0, nextFrame - time.monotonic()))
+        lateness.append(time.monotonic() - nextFrame)
+        nextFrame += period
+    lateness.sort()
+    pick = lambda pct: lateness[min(len(lateness) - 1, int(len(lateness) * pct))]
+    return {
+        "frames": len(lateness),
+        "mean": sum(lateness) / len(lateness),
+        "p50": pick(0.50),
+        "p99": pick(0.99),
+        "max": lateness[-1],
+    }
+
+
+def benchmark(profileName, procName, loadProcesses, fps, seconds):
+    stopEvent = multiprocessing.Event()
+    loaders = [
+        multiprocessing.Process(
+            target=_burn, args=(stopEvent, profileName, 0.05, 0.01), daemon=True
+        )
+        for _ in range(loadProcesses)
+    ]
+    [p.start() for p in loaders]
+    try:
+        apply_profile(procName, profileName)
+        return measure_jitter(fps, seconds)
+    finally:
+        stopEvent.set()
+        [p.join() for p in loaders]
+
+
+# =============================================================================
+
+
+# globals
+logger = log.getLogger()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="measure frame jitter under synthetic load for a scheduling profile"
+    )
+    parser.add_argument("--profile", default=const.proc_sched_profile)
+    parser.add_argument("--process", default="screen")
+    parser.add_argument("--load", type=int, default=os.cpu_count())
+    parser.add_argument("--fps", type=int, default=const.scr_animationFps)
+    parser.add_argument("--seconds", type=int, default=20)
+    args = parser.parse_args()
+    log.log_to_console()
+    log.set_log_level_debug()
+    results = benchmark(args.profile, args.process, args.load, args.fps, args.seconds)
+    print(
+        "profile {} with {} load processes: {} frames, lateness ms: "
+        "mean {:.2f} p50 {:.2f} p99 {:.2f} max {:.2f}".format(
+            args.profile,
+            args.load,
+            results["frames"],
+            *[results[k] * 1000 for k in ["mean", "p50", "p99", "max"]]
+        )
+    )
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+# Control of the clock from the same host, without going through the mqtt
+# broker. Main serves a unix domain socket where each request and response
+# is a line of json:
+#   {"op": "state"}
+#       -> {"ok": true, "state": {"brightness": 8, "lux": 3, ...}}
+#   {"op": "commands", "commands": [["stay", true], ["message", "hi"]]}
+#       -> {"ok": true, "queued": 2}
+#   {"op": "frame"}
+#       -> {"ok": true, "png": "<base64 of what the screen shows>"}
+# A request may carry an "id", which is copied into its response, so clients
+# can send several requests before reading the responses. The server runs in
+# a thread of its own and only hands events to the event hub, so slow or
+# many clients never hold up the hub.
+
+import argparse
+import base64
+import json
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+
+# need this because exported python path gets lost when invoking sudo
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+from bedclock import const  # noqa
+from bedclock import events  # noqa
+from bedclock import log  # noqa
+from bedclock import safefs  # noqa
+
+REQUESTER = "ctlsock"
+MAX_LINE_SIZE = 16 * 1024
+RECV_SIZE = 64 * 1024
+SELECT_TIMEOUT = 1  # seconds, how long stop() may take
+
+
+def _stay_event(value):
+    enable = value is True or str(value).lower() in const.mqtt_value_enable
+    return events.ScreenStaysOn(enable, REQUESTER)
+
+
+# command name: function that makes the event for its value
+COMMANDS = {
+    "stay": _stay_event,
+    "message": lambda value: events.DisplayMessage(value, REQUESTER),
+    "temperature": lambda value: events.OutsideTemperature(value, REQUESTER),
+    "lux_report": lambda _value: events.LuxUpdateRequest(REQUESTER),
+}
+
+
+# =============================================================================
+
+
+class _Connection(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+
+
+class Server(object):
+    """Serves requests on path, in a thread. stateFun returns the current
+    state as a dict and queueEventFun takes the events made by commands.
+    frameFun, if given, returns a png of what the screen shows, or None.
+    """
+
+    def __init__(self, path, stateFun, queueEventFun, maxClients, frameFun=None):
+        self.path = path
+        self.stateFun = stateFun
+        self.queueEventFun = queueEventFun
+        self.frameFun = frameFun
+        self.maxClients = maxClients
+        self.requests = 0
+        self.stopped = False
+        self.selector = selectors.DefaultSelector()
+        self.connections = {}
+        safefs.secure_dir(os.path.dirname(path) or ".")
+        # a socket left behind by a previous run would make bind fail
+        if os.path.lexists(path):
+            os.unlink(path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen(maxClients)
+        self.listener.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self._serve, name="ctlsock", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped = True
+        self.thread.join()
+        for connection in list(self.connections.values()):
+            self._close(connection)
+        self.selector.unregister(self.listener)
+        self.listener.close()
+        self.selector.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _serve(self):
+        while not self.stopped:
+            for key, mask in self.selector.select(SELECT_TIMEOUT):
+                if key.fileobj is self.listener:
+                    self._accept()
+                    continue
+                connection = self.connections.get(key.fileobj)
+                if connection is None:
+                    continue
+                if mask & selectors.EVENT_READ:
+                    self._read(connection)
+                if mask & selectors.EVENT_WRITE and connection.sock in self.connections:
+                    self._write(connection)
+
+    def _accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except BlockingIOError:
+            return
+        if len(self.connections) >= self.maxClients:
+            logger.warning("too many control clients, refusing one")
+            sock.close()
+            return
+        sock.setblocking(False)
+        self.connections[sock] = _Connection(sock)
+        self.selector.register(sock, selectors.EVENT_READ)
+
+    def _close(self, connection):
+        self.selector.unregister(connection.sock)
+        del self.connections[connection.sock]
+        connection.sock.close()
+
+    def _read(self, connection):
+        try:
+            data = connection.sock.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(connection)
+            return
+        connection.inbuf += data
+        while True:
+            end = connection.inbuf.find(b"\n")
+            if end < 0:
+                break
+            line = bytes(connection.inbuf[:end])
+            del connection.inbuf[: end + 1]
+            connection.outbuf += self.handle_line(line)
+        if len(connection.inbuf) > MAX_LINE_SIZE:
+            logger.warning("control request too long, closing its connection")
+            self._close(connection)
+            return
+        self._write(connection)
+
+    def _write(self, connection):
+        if connection.outbuf:
+            try:
+                sent = connection.sock.send(connection.outbuf)
+                del connection.outbuf[:sent]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self._close(connection)
+                return
+        # only ask to be told about writability while there is a backlog
+        wanted = selectors.EVENT_READ
+        if connection.outbuf:
+            wanted |= selectors.EVENT_WRITE
+        if self.selector.get_key(connection.sock).events != wanted:
+            self.selector.modify(connection.sock, wanted)
+
+    def handle_line(self, line):
+        self.requests += 1
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request is not an object")
+        except ValueError as e:
+            return _encode({"ok": False, "error": "bad request: {}".format(e)})
+        try:
+            response = self.handle_request(request)
+        except Exception as e:
+            # a bug handling one request must not stop the server
+            logger.exception("control request {} failed".format(request.get("op")))
+            response = {"ok": False, "error": "failed: {}".format(e)}
+        if "id" in request:
+            response["id"] = request["id"]
+        return _encode(response)
+
+    def handle_request(self, request):
+        op = request.get("op")
+        if op == "state":
+            return {"ok": True, "state": self.stateFun()}
+        if op == "frame":
+            png = self.frameFun() if self.frameFun else None
+            if png is None:
+                return {"ok": False, "error": "no frame mirrored"}
+            return {"ok": True, "png": base64.b64encode(png).decode()}
+        if op != "commands":
+            return {"ok": False, "error": "unknown op {}".format(op)}
+        # make all events first, so a bad command means none are queued
+        commands = request.get("commands") or []
+        if not isinstance(commands, list):
+            return {"ok": False, "error": "commands is not a list"}
+        batch = []
+        for command in commands:
+            if not isinstance(command, list) or len(command) not in (1, 2):
+                return {"ok": False, "error": "bad command {}".format(command)}
+            if not isinstance(command[0], str):
+                return {"ok": False, "error": "bad command name {}".format(command[0])}
+            makeEvent = COMMANDS.get(command[0])
+            if makeEvent is None:
+                return {"ok": False, "error": "unknown command {}".format(command[0])}
+            batch.append(makeEvent(command[1] if len(command) > 1 else None))
+        queued = 0
+        try:
+            for event in batch:
+                self.queueEventFun(event)
+                queued += 1
+        except Exception as e:
+            return {"ok": False, "error": str(e), "queued": queued}
+        return {"ok": True, "queued": queued}
+
+
+def _encode(message):
+    return json.dumps(message).encode() + b"\n"
+
+
+def start_server(stateFun, queueEventFun, frameFun=None):
+    if not const.ctlsock_path:
+        return None
+    try:
+        server = Server(
+            const.ctlsock_path,
+            stateFun,
+            queueEventFun,
+            const.ctlsock_max_clients,
+            frameFun,
+        )
+    except OSError as e:
+        logger.error("cannot serve control socket {}: {}".format(const.ctlsock_path, e))
+        return None
+    logger.info("serving control socket {}".format(const.ctlsock_path))
+    return server.start()
+
+
+# =============================================================================
+
+
+class Client(object):
+    def __init__(self, path=None, timeout=5):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path or const.ctlsock_path)
+        self.reader = self.sock.makefile("rb")
+
+    def send(self, request):
+        self.sock.sendall(_encode(request))
+
+    def receive(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("control socket closed")
+        return json.loads(line)
+
+    def request(self, request):
+        self.send(request)
+        return self.receive()
+
+    def state(self):
+        return self.request({"op": "state"})
+
+    def commands(self, commands):
+        return self.request({"op": "commands", "commands": commands})
+
+    def frame(self):
+        return self.request({"op": "frame"})
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+def parse_command(text):
+    # name or name=value
+    name, _, value = text.partition("=")
+    return [name, value] if value else [name]
+
+
+# =============================================================================
+
+
+# globals
+logger = log.getLogger()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="control a running bedclock")
+    parser.add_argument("--path", default=const.ctlsock_path)
+    subparsers = parser.add_subparsers(dest="op")
+    subparsers.required = True
+    subparsers.add_parser("state", help="print the current state")
+    p = subparsers.add_parser("send", help="send a batch of commands")
+    p.add_argument(
+        "commands",
+        nargs="+",
+        metavar="name[=value]",
+        help="one of: {}".format(", ".join(sorted(COMMANDS))),
+    )
+    p = subparsers.add_parser("frame", help="save what the screen shows")
+    p.add_argument("--out", default="frame.png")
+    args = parser.parse_args()
+    client = Client(args.path)
+    start = time.perf_counter()
+    if args.op == "state":
+        response = client.state()
+    elif args.op == "frame":
+        response = client.frame()
+        if response.get("ok"):
+            with open(args.out, "wb") as f:
+                f.write(base64.b64decode(response.pop("png")))
+            response["out"] = args.out
+    else:
+        response = client.commands([parse_command(c) for c in args.commands])
+    elapsed = time.perf_counter() - start
+    client.close()
+    print(json.dumps(response, indent=1))
+    print("round trip {:.3f}ms".format(elapsed * 1000), file=sys.stderr)
+    if not response.get("ok"):
+        sys.exit(1)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+# Record of the events that go through main's event hub, so a night of
+# behavior can be looked at and replayed. The log is a file header followed
+# by one record per event: monotonic seconds since recording started, size
+# of the payload and the payload, which is the event's name, description
+# and value, marshalled.
+# Ref: https://docs.python.org/3/library/marshal.html
+
+import argparse
+import logging
+import marshal
+import os
+import struct
+import sys
+import time
+
+# need this because exported python path gets lost when invoking sudo
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+from bedclock import const  # noqa
+from bedclock import events  # noqa
+from bedclock import log  # noqa
+from bedclock import safefs  # noqa
+
+MAGIC = b"BCEV"
+VERSION = 1
+# magic, version, wall clock time when recording started
+FILE_HEADER = struct.Struct("<4sHd")
+# monotonic seconds since recording started, payload size
+RECORD_HEADER = struct.Struct("<dI")
+FLUSH_PERIOD_SECONDS = 1
+# not replayed, since they act on the process doing the replay
+REPLAY_SKIP = set(["ProfileRequest"])
+
+
+# =============================================================================
+
+
+def encode_event(event):
+    try:
+        return marshal.dumps((event.name, event.description, event.value))
+    except ValueError:
+        return marshal.dumps((event.name, event.description, repr(event.value)))
+
+
+def decode_event(payload):
+    name, description, value = marshal.loads(payload)
+    cls = getattr(events, name, None)
+    if not isinstance(cls, type) or not issubclass(cls, events.Base):
+        cls = events.Base
+    # constructors differ per event, so build it the way Base does
+    event = cls.__new__(cls)
+    events.Base.__init__(event, description, value)
+    event.name = name
+    return event
+
+
+class Recorder(object):
+    def __init__(self, path, maxBytes):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.f = None
+        self.records = 0
+        self._open()
+
+    def _open(self):
+        safefs.secure_dir(os.path.dirname(self.path) or ".")
+        # keep the previous log around, e.g. the one of a run that crashed
+        if os.path.lexists(self.path):
+            os.replace(self.path, "{}.1".format(self.path))
+        self.f = os.fdopen(safefs.create_exclusive(self.path), "wb")
+        self.f.write(FILE_HEADER.pack(MAGIC, VERSION, time.time()))
+        self.startTime = time.monotonic()
+        self.lastFlush = self.startTime
+
+    def record(self, event):
+        if self.f is None:
+            return
+        now = time.monotonic()
+        payload = encode_event(event)
+        try:
+            self.f.write(RECORD_HEADER.pack(now - self.startTime, len(payload)))
+            self.f.write(payload)
+            self.records += 1
+            if now - self.lastFlush >= FLUSH_PERIOD_SECONDS:
+                self.f.flush()
+                self.lastFlush = now
+            if self.f.tell() >= self.maxBytes:
+                self.f.close()
+                self._open()
+        except OSError as e:
+            # recording is not worth taking the event hub down for
+            logger.error("stopped recording events to {}: {}".format(self.path, e))
+            self.f = None
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+def open_recorder():
+    if not const.eventlog_path:
+        return None
+    try:
+        recorder = Recorder(const.eventlog_path, const.eventlog_max_bytes)
+    except OSError as e:
+        logger.error("cannot record events to {}: {}".format(const.eventlog_path, e))
+        return None
+    logger.info("recording events to {}".format(const.eventlog_path))
+    return recorder
+
+
+def read_events(path):
+    """Yield (seconds since recording started, event) for each record.
+
+    A record cut short, as the last one may be after a crash, ends the log.
+    """
+    with open(path, "rb") as f:
+        magic, version, _startWallTime = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} event log".format(path, VERSION))
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            t, size = RECORD_HEADER.unpack(header)
+            payload = f.read(size)
+            if len(payload) < size:
+                return
+            yield t, decode_event(payload)
+
+
+def read_start_time(path):
+    with open(path, "rb") as f:
+        return FILE_HEADER.unpack(f.read(FILE_HEADER.size))[2]
+
+
+# =============================================================================
+
+
+class _CountingHandler(logging.Handler):
+    def __init__(self, text):
+        logging.Handler.__init__(self)
+        self.text = text
+        self.count = 0
+
+    def emit(self, record):
+        if record.getMessage().startswith(self.text):
+            self.count += 1
+
+
+def replay(path, speed):
+    """Feed the events in path through main.processEvent, against simulated
+    screen, motion and mqtt backends. A speed of 0 means as fast as possible.
+    """
+    # imported here, so recording and reading logs stay light
+    from bedclock import sim
+
+    with sim.no_persistence():
+        return _replay(path, speed)
+
+
+def _replay(path, speed):
+    from bedclock import main, sim
+
+    screenState = sim.sim_screen()
+    motionState = sim.sim_motion()
+    mqttState = sim.sim_mqttclient()
+    dropped = _CountingHandler("command queue is full")
+    logger.addHandler(dropped)
+
+    latencies = {}
+    skipped = 0
+    start = time.monotonic()
+    for t, event in read_events(path):
+        if speed:
+            time.sleep(max(0, start + t / speed - time.monotonic()))
+        if event.name in REPLAY_SKIP:
+            skipped += 1
+            continue
+        handlerStart = time.perf_counter()
+        main.processEvent(event)
+        latency = time.perf_counter() - handlerStart
+        latencies.setdefault(event.name, []).append(latency)
+    elapsed = time.monotonic() - start
+    sim.wait_idle([screenState.cmdq, motionState.cmdq, mqttState.cmdq])
+    logger.removeHandler(dropped)
+
+    processed = sum(len(v) for v in latencies.values())
+    return {
+        "events": processed,
+        "skipped": skipped,
+        "seconds": elapsed,
+        "eventsPerSecond": processed / max(elapsed, 1e-9),
+        "droppedCommands": dropped.count,
+        "latencies": latencies,
+        "screen": {
+            name: getattr(screenState, name)
+            for name in [
+                "currentBrightness",
+                "wantedBrightness",
+                "stayOnInDarkRoom",
+                "cachedOutsideTemperature",
+                "displayMessage",
+                "deepIdle",
+            ]
+        },
+        "motion": {
+            name: getattr(motionState, name)
+            for name in ["luxNotifyEnabled", "proximityNotifyEnabled", "deepIdle"]
+        },
+        "mqtt": dict(mqttState.mqtt_client.publishCounts),
+    }
+
+
+def print_replay(results):
+    print(
+        "{} events in {:.2f}s ({:.0f} events/s), {} skipped, "
+        "{} commands dropped".format(
+            results["events"],
+            results["seconds"],
+            results["eventsPerSecond"],
+            results["skipped"],
+            results["droppedCommands"],
+        )
+    )
+    for name, samples in sorted(results["latencies"].items()):
+        samples = sorted(samples)
+        print(
+            "  {:20} {:6} handled, latency us: "
+            "p50 {:.0f} p99 {:.0f} max {:.0f}".format(
+                name,
+                len(samples),
+                samples[len(samples) // 2] * 1e6,
+                samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6,
+                samples[-1] * 1e6,
+            )
+        )
+    for backend in ["screen", "motion", "mqtt"]:
+        print("  final {} state: {}".format(backend, results[backend]))
+
+
+def dump(path):
+    startTime = read_start_time(path)
+    for t, event in read_events(path):
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(startTime + t))
+        print("{} +{:10.3f} {:20} {}".format(when, t, event.name, event.description))
+
+
+# =============================================================================
+
+
+# globals
+logger = log.getLogger()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="look at or replay an event log")
+    parser.add_argument("--debug", action="store_true")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    p = subparsers.add_parser("dump", help="print the events in the log")
+    p.add_argument("path", nargs="?", default=const.eventlog_path)
+    p = subparsers.add_parser("replay", help="replay the log against simulations")
+    p.add_argument("path", nargs="?", default=const.eventlog_path)
+    p.add_argument(
+        "--speed", type=float, default=0, help="1 for real time, 0 for max speed"
+    )
+    args = parser.parse_args()
+    log.log_to_console()
+    if args.debug:
+        log.set_log_level_debug()
+    if args.command == "dump":
+        dump(args.path)
+    else:
+        from bedclock import bench
+
+        # simulations leave threads behind, so replay in a process of its own
+        print_replay(bench.run_isolated(replay, args.path, args.speed))
@@ -55,3 +55,60 @@ class DisplayMessage(Base):
             "set screen display message to '{}' by {}".format(message, requester),
             message,
         )
+
+
+class ProfileRequest(Base):
+    def __init__(self, target, kind, seconds, requester="anonymous"):
+        Base.__init__(
+            self,
+            "{} profile of {} for {} seconds requested by {}".format(
+                kind, target, seconds, requester
+            ),
+            (target, kind, seconds),
+        )
+
+
+class ScreenDeepIdle(Base):
+    def __init__(self, enable, requester="anonymous"):
+        Base.__init__(
+            self, "screen deep idle {} reported by {}".format(enable, requester), enable
+        )
+
+
+class ScreenBrightness(Base):
+    def __init__(self, brightness, requester="anonymous"):
+        Base.__init__(
+            self,
+            "screen brightness at {} reported by {}".format(brightness, requester),
+            brightness,
+        )
+
+
+class Telemetry(Base):
+    def __init__(self, payload):
+        Base.__init__(
+            self, "telemetry batch of {} bytes".format(len(payload)), payload
+        )
+
+
+class FrameMirror(Base):
+    def __init__(self, payload):
+        Base.__init__(self, "mirrored frame of {} bytes".format(len(payload)), payload)
+
+
+class ConfigReload(Base):
+    def __init__(self, values, requester="anonymous"):
+        Base.__init__(
+            self,
+            "config of {} knobs reloaded by {}".format(len(values), requester),
+            values,
+        )
+
+
+class ConfigApplied(Base):
+    def __init__(self, version, requester="anonymous"):
+        Base.__init__(
+            self,
+            "config version {} applied by {}".format(version, requester),
+            (requester, version),
+        )
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+
+# Load generator: a fleet of simulated bedclocks on one mqtt broker, to size
+# the broker for a house full of them. Each clock is a sim.Simulation in a
+# process of its own, with simulated sensors and screen but the real
+# mqttclient, under an instance name of its own (see const.mqtt_instance).
+# Simulated time runs --speedup times faster than the wall clock, which is
+# what sets how much each clock publishes.
+#
+# A probe client subscribes to what the clocks publish and, for every clock,
+# publishes a time series query (answered with a query_result) --rate times
+# a second, which is the round trip latency reported per clock. It also
+# sends a /msg to all clocks every second, to check they all get it. Without
+# --broker, a stand-in broker (see broker.py) runs in a process of its own
+# and --bounce restarts it halfway, to see how long the clocks take to be
+# back. Example:
+#
+#   $ python3 bedclock/fleet.py --instances 1 4 16 --seconds 20
+
+import argparse
+from datetime import datetime
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+# need this because exported python path gets lost when invoking sudo
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+from bedclock import broker  # noqa
+from bedclock import const  # noqa
+from bedclock import log  # noqa
+from bedclock import mqttclient  # noqa
+from bedclock import sim  # noqa
+
+INSTANCE_PREFIX = "fleet-"
+PROBE_CLIENT_ID = "fleet-probe"
+# how long the clocks get to connect before measuring starts
+CONNECT_TIMEOUT = 30
+# what the stand-in broker is down for, when bounced
+BOUNCE_SECONDS = 1.0
+# window for the peak rate of reconnects after a bounce
+PEAK_WINDOW_SECONDS = 0.1
+
+
+def _summary_ms(samples):
+    samples = sorted(samples)
+    if not samples:
+        return "-"
+    pick = lambda pct: samples[min(len(samples) - 1, int(len(samples) * pct))]
+    return "p50 {:.1f}ms p99 {:.1f}ms".format(pick(0.5) * 1000, pick(0.99) * 1000)
+
+
+# =============================================================================
+
+
+def _run_instance(index, host, port, speedup, knobs, stopEvent, results):
+    name = "{}{}".format(INSTANCE_PREFIX, index)
+    for knob, value in knobs.items():
+        setattr(const, knob, value)
+    const.mqtt_instance = name
+    const.mqtt_topics_pub, const.mqtt_topics_sub = const.mqtt_topics(name)
+    const.mqtt_broker_port = port
+    # what goes wrong shows in the numbers, rather than as a log line each
+    log.getLogger().addHandler(logging.NullHandler())
+    with sim.Simulation(datetime.now()) as simulation:
+        state = simulation.states["mqttclient"]
+        # connect for real, when mqttclient iterates
+        state.mqtt_broker_ip = host
+        state.mqtt_client = None
+        while not stopEvent.is_set():
+            simulation.run(speedup, speedup)
+        mqttclient.do_disconnect()
+    results.put(
+        {
+            "name": name,
+            "connects": state.connects,
+            "connectAttempts": state.connectAttempts,
+            "disconnects": state.disconnects,
+            "suppressed": state.suppressed,
+            "messages": simulation.eventCounts["DisplayMessage"],
+        }
+    )
+
+
+def _run_broker(port, persisted, conn):
+    # serves until told to stop, then hands back its stats, plus sessions
+    # and retained messages for the next run, like mosquitto's persistence
+    stand_in = broker.Broker("127.0.0.1", port, *persisted).start()
+    conn.send(stand_in.port)
+    conn.recv()
+    stand_in.stop()
+    conn.send((stand_in.stats(), stand_in.persisted()))
+
+
+class StandInBroker(object):
+    def __init__(self, context):
+        self.context = context
+        self.port = 0
+        self.process = None
+        self.conn = None
+        self.stats = []  # of each run
+        self.persisted = (None, None)
+
+    def start(self):
+        self.conn, childConn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_run_broker, args=(self.port, self.persisted, childConn), daemon=True
+        )
+        self.process.start()
+        self.port = self.conn.recv()
+
+    def stop(self):
+        self.conn.send("stop")
+        stats, self.persisted = self.conn.recv()
+        self.stats.append(stats)
+        self.process.join()
+
+    def total(self, key):
+        return sum(s[key] for s in self.stats)
+
+
+# =============================================================================
+
+
+class Probe(object):
+    def __init__(self, host, port, names):
+        import paho.mqtt.client as mqtt
+
+        self.names = names
+        self.lock = threading.Lock()
+        self.received = {name: 0 for name in names}
+        self.pings = {}  # ping id: (name, time sent)
+        self.pingsSent = 0
+        self.latencies = {name: [] for name in names}
+        self.lastAnswer = {name: None for name in names}
+        self.restartTime = None
+        self.backTimes = {}  # first answer to a ping sent after restartTime
+        self.nextPing = 0
+        self.client = mqtt.Client(client_id=PROBE_CLIENT_ID)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        # back quickly after a bounce, so it is the clocks that get measured
+        self.client.reconnect_delay_set(0.1, 0.1)
+        self.client.connect_async(host, port)
+        self.client.loop_start()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        mqttclient._set_nodelay(client)
+        client.subscribe("/{}/+/#".format(const.mqtt_topic_prefix), 1)
+
+    def _on_message(self, client, userdata, msg):
+        now = time.monotonic()
+        name = msg.topic.split("/")[2]
+        with self.lock:
+            if name not in self.received:
+                return
+            self.received[name] += 1
+            if not msg.topic.endswith("/" + const.mqtt_topic_pub_query_result):
+                return
+            series = json.loads(msg.payload).get("series", "")
+            sent = self.pings.pop(series, None)
+            if sent is not None:
+                self.latencies[sent[0]].append(now - sent[1])
+                self.lastAnswer[sent[0]] = now
+                if self.restartTime is not None and sent[1] >= self.restartTime:
+                    self.backTimes.setdefault(sent[0], now - self.restartTime)
+
+    def ping_all(self):
+        if not self.client.is_connected():
+            return
+        for name in self.names:
+            topics = const.mqtt_topics(name)[1]
+            with self.lock:
+                self.nextPing += 1
+                pingId = "ping-{}".format(self.nextPing)
+                self.pings[pingId] = (name, time.monotonic())
+                self.pingsSent += 1
+            self.client.publish(topics[const.mqtt_topic_sub_query], pingId, qos=1)
+
+    def retain(self):
+        # what a house has retained for its clocks, which a clock without a
+        # persistent session gets again every time it subscribes
+        for name in self.names:
+            topics = const.mqtt_topics(name)[1]
+            self.client.publish(topics[const.mqtt_topic_sub_stay], "off", 1, True)
+        topic = const.mqtt_topics_sub[const.mqtt_topic_sub_temperature]
+        self.client.publish(topic, "54", qos=1, retain=True)
+
+    def broadcast(self, message):
+        if not self.client.is_connected():
+            return False
+        topic = const.mqtt_topics_sub[const.mqtt_topic_sub_msg]
+        self.client.publish(topic, message, qos=1)
+        return True
+
+    def answering(self):
+        with self.lock:
+            return sum(t is not None for t in self.lastAnswer.values())
+
+    def reset(self):
+        with self.lock:
+            for name in self.names:
+                self.received[name] = 0
+                self.latencies[name] = []
+            self.pingsSent = 0
+            self.pings.clear()
+
+    def close(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+def run_fleet(count, args, context):
+    standIn = None
+    host, port = args.broker, args.port
+    if host is None:
+        standIn = StandInBroker(context)
+        standIn.start()
+        host, port = "127.0.0.1", standIn.port
+    stopEvent = context.Event()
+    results = context.Queue()
+    knobs = {
+        "mqtt_clean_session": args.clean_session,
+        "mqtt_reconnect_jitter": args.reconnect_jitter,
+        "mqtt_republish_seconds": args.republish_seconds,
+    }
+    processes = [
+        context.Process(
+            target=_run_instance,
+            args=(i, host, port, args.speedup, knobs, stopEvent, results),
+            daemon=True,
+        )
+        for i in range(count)
+    ]
+    start = time.monotonic()
+    for p in processes:
+        p.start()
+    names = ["{}{}".format(INSTANCE_PREFIX, i) for i in range(count)]
+    probe = Probe(host, port, names)
+
+    # a clock that answers has subscribed to all of its topics
+    while probe.answering() < count and time.monotonic() - start < CONNECT_TIMEOUT:
+        probe.ping_all()
+        time.sleep(0.1)
+    connectSeconds = time.monotonic() - start
+    connected = probe.answering()
+    probe.retain()
+    probe.reset()
+
+    start = time.monotonic()
+    end = start + args.seconds
+    nextPing = nextBroadcast = start
+    bounceTime = start + args.seconds / 2 if args.bounce and standIn else None
+    restartTime = restartWallTime = None
+    broadcasts = 0
+    while time.monotonic() < end:
+        now = time.monotonic()
+        if bounceTime is not None and now >= bounceTime:
+            bounceTime = None
+            standIn.stop()
+            time.sleep(BOUNCE_SECONDS)
+            standIn.start()
+            restartTime = time.monotonic()
+            restartWallTime = time.time()
+            probe.restartTime = restartTime
+        if now >= nextBroadcast:
+            nextBroadcast += 1
+            if probe.broadcast("fleet {}".format(broadcasts)):
+                broadcasts += 1
+        if now >= nextPing:
+            nextPing += 1.0 / args.rate
+            probe.ping_all()
+        time.sleep(max(0, min(nextPing, nextBroadcast) - time.monotonic()))
+    seconds = time.monotonic() - start
+    probe.close()
+    stopEvent.set()
+    instances = [results.get(timeout=30) for _ in processes]
+    for p in processes:
+        p.join()
+    if standIn is not None:
+        standIn.stop()
+
+    published = sum(probe.received.values())
+    latencies = sum(probe.latencies.values(), [])
+    answered = len(latencies)
+    worst = max(
+        names, key=lambda n: sorted(probe.latencies[n] or [0])[-1], default=None
+    )
+    print(
+        "{} clocks: {}/{} connected in {:.1f}s, {:.1f} publishes/s received "
+        "({:.2f} per clock)".format(
+            count,
+            connected,
+            count,
+            connectSeconds,
+            published / seconds,
+            published / seconds / count,
+        )
+    )
+    print(
+        "  round trips: {} of {} answered, {}; slowest clock {} {}".format(
+            answered,
+            probe.pingsSent,
+            _summary_ms(latencies),
+            worst,
+            _summary_ms(probe.latencies[worst]),
+        )
+    )
+    print(
+        "  /msg: {} sent, {} delivered of {}".format(
+            broadcasts,
+            sum(i["messages"] for i in instances),
+            broadcasts * count,
+        )
+    )
+    if standIn is not None:
+        print(
+            "  stand-in broker: {:.0f} publishes/s in, {:.0f} out, {} takeovers".format(
+                standIn.total("publishesIn") / seconds,
+                standIn.total("publishesOut") / seconds,
+                standIn.total("takeovers"),
+            )
+        )
+    print(
+        "  reconnects: {} connects in {} attempts, {} disconnects over {} clocks; "
+        "{} unchanged values not published again".format(
+            sum(i["connects"] for i in instances),
+            sum(i["connectAttempts"] for i in instances),
+            sum(i["disconnects"] for i in instances),
+            count,
+            sum(i["suppressed"] for i in instances),
+        )
+    )
+    if restartTime is not None:
+        _print_bounce(standIn.stats[-1], restartWallTime, probe, count)
+
+
+def _print_bounce(stats, restartWallTime, probe, count):
+    # stats are those of the broker since it came back
+    connectTimes = sorted(
+        t - restartWallTime
+        for t, clientId in stats["connectTimes"]
+        if clientId.startswith("bedclock-" + INSTANCE_PREFIX)
+    )
+    peak = max(
+        (
+            sum(1 for u in connectTimes if t <= u < t + PEAK_WINDOW_SECONDS)
+            for t in connectTimes
+        ),
+        default=0,
+    )
+    if connectTimes:
+        print(
+            "  after the bounce: {} clocks connected from {:.2f}s to {:.2f}s, at "
+            "most {} in {:.0f}ms".format(
+                len(connectTimes),
+                connectTimes[0],
+                connectTimes[-1],
+                peak,
+                PEAK_WINDOW_SECONDS * 1000,
+            )
+        )
+    print(
+        "  and {} subscribes, {} retained and {} queued messages sent, {} sessions "
+        "resumed".format(
+            stats["subscribes"],
+            stats["retainedSent"],
+            stats["queuedSent"],
+            stats["sessionsResumed"],
+        )
+    )
+    backSeconds = list(probe.backTimes.values())
+    if backSeconds:
+        print(
+            "  {} of {} clocks answering again, the last one after {:.1f}s".format(
+                len(backSeconds), count, max(backSeconds)
+            )
+        )
+
+
+# =============================================================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="load test a broker with bedclocks")
+    parser.add_argument(
+        "--instances", type=int, nargs="+", default=[1, 4, 16], help="fleet sizes"
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=20, help="measured per fleet size"
+    )
+    parser.add_argument(
+        "--speedup",
+        type=float,
+        default=60,
+        help="simulated seconds per second, so clocks publish that much more",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=2, help="round trips per second per clock"
+    )
+    parser.add_argument(
+        "--broker", help="host of a broker to use, rather than the stand-in one"
+    )
+    parser.add_argument(
+        "--port", type=int, default=const.mqtt_broker_port, help="of --broker"
+    )
+    parser.add_argument(
+        "--bounce", action="store_true", help="restart the stand-in broker halfway"
+    )
+    parser.add_argument(
+        "--clean-session",
+        action="store_true",
+        help="clocks do not keep a session at the broker",
+    )
+    parser.add_argument(
+        "--reconnect-jitter",
+        type=float,
+        default=const.mqtt_reconnect_jitter,
+        help="part of each reconnect wait picked at random",
+    )
+    parser.add_argument(
+        "--republish-seconds",
+        type=float,
+        default=const.mqtt_republish_seconds,
+        help="before publishing an unchanged value again, 0 to always do it",
+    )
+    args = parser.parse_args()
+    # no forked copies of the broker's sockets or the probe's threads
+    context = multiprocessing.get_context("spawn")
+    for count in args.instances:
+        run_fleet(count, args, context)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+# Copies of what the screen shows, for looking at the clock from elsewhere.
+# The render thread offers the composed frame (see widgets.Compositor) right
+# before SwapOnVSync, which is only a compare and a copy when it changed.
+# Encoding happens later, at most maxFps times a second and using at most
+# cpuBudget of a cpu, so mirroring never holds up rendering: frames offered
+# meanwhile just replace each other.
+#
+# A payload is a header followed by the zlib compressed tiles of the frame
+# that changed since the previous payload, each of them a tile index and
+# its rgb bytes. Key frames, with all tiles, go out every keyframeSeconds,
+# even when nothing changes, so a late subscriber (or one that missed a
+# payload) catches up. To look at them:
+#
+#   $ mosquitto_sub -h ${MQTT_BROKER} -t /bedclock/frame -F %x | \
+#       python3 bedclock/framemirror.py --hex --out frame.png
+
+import argparse
+import binascii
+import struct
+import sys
+import threading
+import time
+import zlib
+
+MAGIC = b"FM"
+VERSION = 1
+FLAG_KEYFRAME = 0x01
+# magic, version, flags, width, height, tile size, brightness, sequence
+# number, number of tiles
+HEADER = struct.Struct("<2sBBHHBBIH")
+TILE_INDEX = struct.Struct("<H")
+
+
+def _tiles(width, height, tileSize):
+    """Yield (x, y, width, height) of each tile, in index order."""
+    for y in range(0, height, tileSize):
+        for x in range(0, width, tileSize):
+            yield x, y, min(tileSize, width - x), min(tileSize, height - y)
+
+
+def _tile_bytes(frame, stride, tile):
+    x, y, w, h = tile
+    return b"".join(
+        frame[row * stride + x * 3:row * stride + (x + w) * 3]
+        for row in range(y, y + h)
+    )
+
+
+class Mirror(object):
+    def __init__(
+        self,
+        width,
+        height,
+        tileSize,
+        maxFps,
+        cpuBudget,
+        keyframeSeconds,
+        maxPayloadSize,
+    ):
+        self.width = width
+        self.height = height
+        self.tileSize = tileSize
+        self.tiles = list(_tiles(width, height, tileSize))
+        self.minPeriod = 1.0 / maxFps
+        self.cpuBudget = cpuBudget
+        self.keyframeSeconds = keyframeSeconds
+        self.maxPayloadSize = maxPayloadSize
+        self.cond = threading.Condition()
+        self.pending = None  # (frame, brightness) offered, not encoded yet
+        self.offered = None
+        self.exported = None  # last frame encoded, as its tiles
+        self.exportedFrame = None  # and as offered
+        self.seq = 0
+        self.nextTime = 0
+        self.nextKeyframeTime = 0
+        # stats
+        self.offers = 0
+        self.replaced = 0
+        self.payloads = 0
+        self.payloadBytes = 0
+        self.oversized = 0
+        self.cpuTime = 0
+
+    def offer(self, frame, brightness):
+        """Called by the render thread with the composed frame. Cheap."""
+        if self.offered is not None and self.offered == (frame, brightness):
+            return
+        self.offered = (bytes(frame), brightness)
+        with self.cond:
+            self.offers += 1
+            if self.pending is not None:
+                self.replaced += 1
+            self.pending = self.offered
+            self.cond.notify()
+
+    def wait_time(self, now):
+        """How long until poll() may have something to do. None is forever."""
+        if self.pending is None:
+            if self.exported is None:
+                return None
+            return max(0, self.nextKeyframeTime - now)
+        return max(0, self.nextTime - now)
+
+    def poll(self, now):
+        """Return the payload to publish, if one is due."""
+        with self.cond:
+            if self.pending is None:
+                if self.exported is None or now < self.nextKeyframeTime:
+                    return None
+                # nothing changed, but a key frame is due
+                self.pending = self.exportedFrame
+            if now < self.nextTime:
+                return None
+            (frame, brightness), self.pending = self.pending, None
+        cpuStart = time.thread_time()
+        payload = self._encode(frame, brightness, now)
+        cost = time.thread_time() - cpuStart
+        self.cpuTime += cost
+        self.nextTime = now + max(self.minPeriod, cost / self.cpuBudget)
+        return payload
+
+    def _encode(self, frame, brightness, now):
+        stride = self.width * 3
+        tiles = [_tile_bytes(frame, stride, tile) for tile in self.tiles]
+        keyframe = self.exported is None or now >= self.nextKeyframeTime
+        changed = [
+            (i, data)
+            for i, data in enumerate(tiles)
+            if keyframe or data != self.exported[i]
+        ]
+        header = HEADER.pack(
+            MAGIC,
+            VERSION,
+            FLAG_KEYFRAME if keyframe else 0,
+            self.width,
+            self.height,
+            self.tileSize,
+            brightness,
+            self.seq + 1,
+            len(changed),
+        )
+        body = b"".join(TILE_INDEX.pack(i) + data for i, data in changed)
+        payload = header + zlib.compress(body)
+        if len(payload) > self.maxPayloadSize:
+            # leave exported alone, so the next payload has these tiles too
+            self.oversized += 1
+            return None
+        self.seq += 1
+        self.exported = tiles
+        self.exportedFrame = (frame, brightness)
+        if keyframe:
+            self.nextKeyframeTime = now + self.keyframeSeconds
+        self.payloads += 1
+        self.payloadBytes += len(payload)
+        return payload
+
+
+class Worker(threading.Thread):
+    """Encodes what gets offered to mirror, handing payloads to publishFun."""
+
+    def __init__(self, mirror, publishFun):
+        threading.Thread.__init__(self, name="framemirror", daemon=True)
+        self.mirror = mirror
+        self.publishFun = publishFun
+
+    def run(self):
+        mirror = self.mirror
+        while True:
+            with mirror.cond:
+                timeout = mirror.wait_time(time.monotonic())
+                if timeout != 0:
+                    mirror.cond.wait(timeout)
+            payload = mirror.poll(time.monotonic())
+            if payload is not None:
+                self.publishFun(payload)
+
+
+# =============================================================================
+
+
+class Decoder(object):
+    """Puts the frame back together from payloads, in the order published."""
+
+    def __init__(self):
+        self.width = self.height = 0
+        self.brightness = 0
+        self.frame = None
+        self.seq = None
+        self.skipped = 0
+        self.cachedPng = (None, None)  # (seq, png)
+
+    def feed(self, payload):
+        """Returns True if the frame is now up to date with payload."""
+        fields = HEADER.unpack_from(payload)
+        magic, version, flags, width, height, tileSize, brightness, seq, count = fields
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a version {} frame".format(VERSION))
+        keyframe = flags & FLAG_KEYFRAME
+        if not keyframe and (self.seq is None or seq != self.seq + 1):
+            # a payload went missing: wait for the next key frame
+            self.seq = None
+            self.skipped += 1
+            return False
+        if keyframe:
+            self.width, self.height = width, height
+            self.frame = bytearray(width * height * 3)
+        self.brightness = brightness
+        tiles = list(_tiles(width, height, tileSize))
+        body = zlib.decompress(payload[HEADER.size:])
+        stride = width * 3
+        offset = 0
+        for _ in range(count):
+            (i,) = TILE_INDEX.unpack_from(body, offset)
+            offset += TILE_INDEX.size
+            x, y, w, h = tiles[i]
+            for row in range(y, y + h):
+                start = row * stride + x * 3
+                self.frame[start:start + w * 3] = body[offset:offset + w * 3]
+                offset += w * 3
+        self.seq = seq
+        return True
+
+    def png(self):
+        """The frame as a png, or None. Only made when asked for, and reused
+        until the frame changes, so it is fine to call from another thread.
+        """
+        seq, png = self.cachedPng
+        if self.frame is None or (png is not None and seq == self.seq):
+            return png
+        seq = self.seq
+        png = to_png(self.width, self.height, self.frame)
+        self.cachedPng = (seq, png)
+        return png
+
+
+def to_png(width, height, rgb):
+    """Encode interleaved rgb bytes as a png."""
+
+    def chunk(kind, data):
+        crc = zlib.crc32(kind + data)
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+    stride = width * 3
+    # each row starts with filter type 0: none
+    raw = b"".join(
+        b"\x00" + bytes(rgb[y * stride:(y + 1) * stride]) for y in range(height)
+    )
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 9))
+        + chunk(b"IEND", b"")
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="decode bedclock frames")
+    parser.add_argument(
+        "--hex", action="store_true", help="stdin has a hex encoded payload per line"
+    )
+    parser.add_argument("--out", default="frame.png", help="png to keep up to date")
+    args = parser.parse_args()
+    decoder = Decoder()
+    if args.hex:
+        payloads = (binascii.unhexlify(line.strip()) for line in sys.stdin)
+    else:
+        payloads = [sys.stdin.buffer.read()]
+    for payload in payloads:
+        if not payload or not decoder.feed(payload):
+            continue
+        with open(args.out, "wb") as f:
+            f.write(decoder.png())
+        print(
+            "frame {} brightness {} written to {}".format(
+                decoder.seq, decoder.brightness, args.out
+            ),
+            flush=True,
+        )
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+# Inbound mqtt messages waiting to be handled. Only the latest payload of
+# each topic is kept, so a burst of messages (e.g. retained ones on
+# reconnect, or a chatty sensor) collapses into one pending message per
+# topic instead of filling up the command queue. Topics are handed out in
+# the order their latest payload arrived.
+
+import collections
+import threading
+
+
+class Inbox(object):
+    def __init__(self, maxTopics):
+        self.maxTopics = maxTopics
+        self.lock = threading.Lock()
+        self.pending = collections.OrderedDict()
+        self.received = 0
+        self.coalesced = 0  # payloads replaced by a newer one, unhandled
+        self.dropped = 0  # payloads of new topics, when maxTopics are pending
+
+    def put(self, topic, payload):
+        """Returns True when the inbox was empty, i.e. whoever takes from it
+        needs a wake up.
+        """
+        with self.lock:
+            self.received += 1
+            wasEmpty = not self.pending
+            if topic in self.pending:
+                self.coalesced += 1
+                del self.pending[topic]
+            elif len(self.pending) >= self.maxTopics:
+                self.dropped += 1
+                return False
+            self.pending[topic] = payload
+            return wasEmpty
+
+    def take_all(self):
+        """Return the pending (topic, payload)s, oldest first, and empty the
+        inbox.
+        """
+        with self.lock:
+            messages = list(self.pending.items())
+            self.pending.clear()
+        return messages
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "received": self.received,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped,
+                "pending": len(self.pending),
+            }
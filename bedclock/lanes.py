@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# Commands taken off a command queue, waiting to be handled in order of
+# priority. Each command is bytes that start with a one byte tag, given by
+# whoever queued it:
+#  - urgent tags are handled before anything else, in order;
+#  - latest tags only keep the last command with that tag, e.g. a newer lux
+#    makes an older one pointless;
+#  - anything else is handled in order, along with the latest ones.
+
+import collections
+
+
+class Lanes(object):
+    def __init__(self, urgentTags, latestTags, maxPending):
+        self.urgentTags = set(urgentTags)
+        self.latestTags = set(latestTags)
+        self.maxPending = maxPending
+        self.urgent = collections.deque()
+        # tag for latest commands, a sequence number for the others
+        self.ordered = collections.OrderedDict()
+        self.sequence = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def add(self, command):
+        """Returns False if the command was dropped for lack of room."""
+        tag, body = command[:1], command[1:]
+        if tag in self.urgentTags:
+            self.urgent.append(body)
+            return True
+        if tag in self.latestTags and tag in self.ordered:
+            self.coalesced += 1
+            del self.ordered[tag]
+        elif len(self.ordered) >= self.maxPending:
+            self.dropped += 1
+            return False
+        if tag in self.latestTags:
+            key = tag
+        else:
+            key = self.sequence
+            self.sequence += 1
+        self.ordered[key] = body
+        return True
+
+    def pop(self):
+        """Return the next command to handle, without its tag, or None."""
+        if self.urgent:
+            return self.urgent.popleft()
+        if self.ordered:
+            return self.ordered.popitem(last=False)[1]
+        return None
+
+    def __len__(self):
+        return len(self.urgent) + len(self.ordered)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# Where things go on the screen, worked out from the geometry of the canvas
+# rather than assuming a single 64x64 panel. Panels are chained along x
+# and run in parallel along y, and then the pixel mapper (e.g. "Rotate:90")
+# moves them around. panel_rects() says which part of the canvas each panel
+# ends up showing, so the compositor can track changes per panel.
+#
+# The message goes across the top and the temperature at the bottom left.
+# In between, the clock, weekday and date are stacked in a single column,
+# unless the canvas is at least twice as wide as it is tall: then the clock
+# takes the left half and weekday and date the right half.
+
+import collections
+
+# (x, y, width, height) of a widget's area, and the baseline of its text
+Placement = collections.namedtuple("Placement", "x y width height baseline")
+
+
+def _rotate(rect, angle, width, height):
+    """rect on a width x height canvas, rotated clockwise by angle."""
+    x, y, w, h = rect
+    if angle == 90:
+        return height - y - h, x, h, w
+    if angle == 180:
+        return width - x - w, height - y - h, w, h
+    if angle == 270:
+        return y, width - x - w, h, w
+    return rect
+
+
+def panel_rects(rows, cols, chain, parallel, mapperConfig=""):
+    """Return the canvas size and the rect of each panel in it, as
+    ((width, height), [(x, y, width, height), ...]).
+
+    Mappers other than Rotate and U-mapper are not understood, in which
+    case the whole canvas is taken as a single panel.
+    """
+    width, height = cols * chain, rows * parallel
+    rects = [
+        (c * cols, p * rows, cols, rows) for p in range(parallel) for c in range(chain)
+    ]
+    for mapper in (mapperConfig or "").split(";"):
+        name, _, arg = mapper.strip().partition(":")
+        if not name:
+            continue
+        if name == "Rotate":
+            angle = int(arg or 0) % 360
+            if angle not in (0, 90, 180, 270):
+                return _unknown_mapper(width, height)
+            rects = [_rotate(r, angle, width, height) for r in rects]
+            if angle in (90, 270):
+                width, height = height, width
+        elif name == "U-mapper" and chain % 2 == 0:
+            # the second half of the chain folds back, below the first half
+            half = width // 2
+            rects = [
+                (x, y, w, h) if x < half else (width - x - w, y + height, w, h)
+                for x, y, w, h in rects
+            ]
+            width, height = half, height * 2
+        else:
+            return _unknown_mapper(width, height)
+    return (width, height), rects
+
+
+def _unknown_mapper(width, height):
+    # no telling where the panels end up, or even the size of the canvas
+    return (width, height), [(0, 0, width, height)]
+
+
+def canvas_size(rows, cols, chain, parallel, mapperConfig=""):
+    return panel_rects(rows, cols, chain, parallel, mapperConfig)[0]
+
+
+def compute(width, height, fonts, clockOffsetY=0):
+    """Return {widget name: Placement} for a width x height canvas, given
+    the clock, small and tiny fonts. clockOffsetY moves the clock, weekday
+    and date down (or up, when negative) from the middle of their area.
+    """
+    clockFont, smallFont, tinyFont = fonts[:3]
+    placements = {}
+    placements["message"] = Placement(0, 0, width, tinyFont.height, tinyFont.ascent)
+    placements["temperature"] = Placement(
+        1,
+        height - tinyFont.height,
+        width - 1,
+        tinyFont.height,
+        height - tinyFont.descent,
+    )
+    placements["motion"] = Placement(width - 1, height - 1, 1, 1, None)
+    placements["stayOn"] = Placement(0, 0, 1, 1, None)
+
+    # what is left in between the message and the temperature
+    top = tinyFont.height
+    areaHeight = height - 2 * tinyFont.height
+    # weekday and date lines start right under the clock's baseline
+    lineHeight = smallFont.height
+    if width >= 2 * height:
+        half = width // 2
+        clockTop = top + (areaHeight - clockFont.height) // 2 + clockOffsetY
+        clockBaseline = clockTop + clockFont.ascent
+        placements["clock"] = Placement(
+            0, clockTop, half, clockFont.height, clockBaseline
+        )
+        dateTop = top + (areaHeight - 2 * lineHeight) // 2 + clockOffsetY
+        for i, name in enumerate(["weekday", "date"]):
+            lineTop = dateTop + i * lineHeight
+            placements[name] = Placement(
+                half, lineTop, width - half, lineHeight, lineTop + smallFont.ascent
+            )
+        return placements
+
+    blockHeight = clockFont.ascent + 2 * lineHeight
+    clockTop = top + (areaHeight - blockHeight) // 2 + clockOffsetY
+    clockBaseline = clockTop + clockFont.ascent
+    placements["clock"] = Placement(0, clockTop, width, clockFont.height, clockBaseline)
+    for i, name in enumerate(["weekday", "date"]):
+        baseline = clockBaseline + (i + 1) * lineHeight
+        placements[name] = Placement(
+            0, baseline - smallFont.ascent, width, lineHeight, baseline
+        )
+    return placements
@@ -4,25 +4,63 @@ import multiprocessing
 from six.moves import queue
 import sys
 import os
+import time
 
 # need this because exported python path gets lost when invoking sudo
 sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
 
+from bedclock import config  # noqa
 from bedclock import const  # noqa
+from bedclock import cpusched  # noqa
+from bedclock import ctlsock  # noqa
+from bedclock import eventlog  # noqa
 from bedclock import events  # noqa
+from bedclock import framemirror  # noqa
 from bedclock import log  # noqa
+from bedclock import memstat  # noqa
 from bedclock import mqttclient  # noqa
+from bedclock import profiler  # noqa
 from bedclock import screen  # noqa
+from bedclock import shmring  # noqa
 from bedclock import motion  # noqa
 
 EVENTQ_SIZE = 1000
 EVENTQ_GET_TIMEOUT = 15  # seconds
+CONFIG_RETRY_SECONDS = 5  # before sending a config again to a child behind
+
+
+def newEventq():
+    if const.ipc_transport == "shmring":
+        return shmring.EventHub(const.ipc_event_slots, const.ipc_slot_size)
+    return multiprocessing.Queue(EVENTQ_SIZE)
+
+
+def newEventProducer(eventq):
+    # a ring has a single producer, so each process gets one of its own
+    if isinstance(eventq, shmring.EventHub):
+        return eventq.producer()
+    return eventq
+
+
+def newCmdq(procName, cmdqSize):
+    if const.ipc_transport == "shmring":
+        policy = const.ipc_policies.get(procName, shmring.POLICY_DROP)
+        return shmring.CommandQueue(cmdqSize, const.ipc_slot_size, policy)
+    return multiprocessing.Queue(cmdqSize)
 
 
 class ProcessBase(multiprocessing.Process):
-    def __init__(self, eventq):
-        multiprocessing.Process.__init__(self)
-        self.eventq = eventq
+    def __init__(self, eventq, procName, cmdqSize):
+        multiprocessing.Process.__init__(self, name=procName)
+        self.eventq = newEventProducer(eventq)
+        # created here, so parent and child both get a handle to it,
+        # regardless of the process start method
+        self.cmdq = newCmdq(procName, cmdqSize)
+        # children that are not forked start with nothing but what they
+        # import, which includes the logger setup
+        self.forked = multiprocessing.get_start_method() == "fork"
+        # and what they import does not include the knobs of the config file
+        self.config = config.current()
 
     def putEvent(self, event):
         try:
@@ -34,26 +72,41 @@ class ProcessBase(multiprocessing.Process):
                 event.description,
             )
             raise RuntimeError("Main process has a full event queue")
+        except ValueError as e:
+            # too big for a ring slot
+            logger.error("Cannot add event %s: %s", event.name, e)
+
+    def initChild(self):
+        if not self.forked:
+            log.initLogger()
+            if self.config.version:
+                config.apply(self.config)
+        logger.debug("%s process started", self.name)
+        cpusched.apply_profile(self.name)
+        profiler.do_init(self.name)
+        memstat.start_monitor(self.name)
 
 
 class MqttclientProcess(ProcessBase):
     def __init__(self, eventq):
-        ProcessBase.__init__(self, eventq)
-        mqttclient.do_init(self.putEvent)
+        ProcessBase.__init__(self, eventq, "mqttclient", mqttclient.CMDQ_SIZE)
+        mqttclient.do_connect(self.cmdq)
 
     def run(self):
-        logger.debug("mqttclient process started")
+        self.initChild()
+        mqttclient.do_init(self.putEvent, cmdq=self.cmdq)
         while True:
             mqttclient.do_iterate()
 
 
 class MotionProcess(ProcessBase):
     def __init__(self, eventq):
-        ProcessBase.__init__(self, eventq)
-        motion.do_init(self.putEvent)
+        ProcessBase.__init__(self, eventq, "motion", motion.CMDQ_SIZE)
+        motion.do_connect(self.cmdq)
 
     def run(self):
-        logger.debug("motion process started")
+        self.initChild()
+        motion.do_init(self.putEvent, cmdq=self.cmdq)
         motion.do_lux_notify_on()
         motion.do_motion_notify_on()
         while True:
@@ -62,11 +115,12 @@ class MotionProcess(ProcessBase):
 
 class ScreenProcess(ProcessBase):
     def __init__(self, eventq):
-        ProcessBase.__init__(self, eventq)
-        screen.do_init(self.putEvent)
+        ProcessBase.__init__(self, eventq, "screen", screen.CMDQ_SIZE)
+        screen.do_connect(self.cmdq)
 
     def run(self):
-        logger.debug("screen process started")
+        self.initChild()
+        screen.do_init(self.putEvent, cmdq=self.cmdq)
         while True:
             screen.do_iterate()
 
@@ -106,6 +160,83 @@ def processDisplayMessage(event):
     screen.do_handle_display_message(event.value)
 
 
+def processScreenDeepIdle(event):
+    logger.debug("Handling event {}".format(event.description))
+    motion.do_handle_screen_deep_idle(event.value)
+
+
+def processScreenBrightness(event):
+    logger.debug("Handling event {}".format(event.description))
+
+
+def processTelemetry(event):
+    mqttclient.do_publish_telemetry(event.value)
+
+
+def processFrameMirror(event):
+    mqttclient.do_publish_frame(event.value)
+    frameDecoder.feed(event.value)
+
+
+def processProfileRequest(event):
+    logger.debug("Handling event {}".format(event.description))
+    target, kind, seconds = event.value
+    profileFuns = {"main": profiler.do_profile_start}
+    for p in myProcesses:
+        if isinstance(p, MqttclientProcess):
+            profileFuns["mqttclient"] = mqttclient.do_profile
+        elif isinstance(p, MotionProcess):
+            profileFuns["motion"] = motion.do_profile
+        elif isinstance(p, ScreenProcess):
+            profileFuns["screen"] = screen.do_profile
+    if target != "all" and target not in profileFuns:
+        logger.warning("Cannot profile unknown process %s", target)
+        return
+    for name, profileFun in profileFuns.items():
+        if target in ("all", name):
+            profileFun(kind, seconds)
+
+
+def processConfigReload(event):
+    logger.debug("Handling event {}".format(event.description))
+    if config.do_reload(event.value) is None:
+        return
+    configSent.clear()
+    sendConfig()
+
+
+def processConfigApplied(event):
+    logger.debug("Handling event {}".format(event.description))
+    procName, version = event.value
+    configVersions[procName] = max(version, configVersions.get(procName, 0))
+
+
+def sendConfig():
+    # until a child reports it applied the current config, send it again
+    # every so often: its command queue may have been full, or dropped it
+    snapshot = config.current()
+    now = time.monotonic()
+    applyFuns = {
+        MqttclientProcess: mqttclient.do_apply_config,
+        MotionProcess: motion.do_apply_config,
+        ScreenProcess: screen.do_apply_config,
+    }
+    for p in myProcesses:
+        if configVersions.get(p.name, 0) >= snapshot.version:
+            continue
+        if now < configSent.get(p.name, 0) + CONFIG_RETRY_SECONDS:
+            continue
+        if p.name in configSent:
+            logger.warning(
+                "%s still not on config version %s, sending it again",
+                p.name,
+                snapshot.version,
+            )
+        configSent[p.name] = now
+        if not applyFuns[type(p)](snapshot):
+            logger.error("cannot send config version %s to %s", snapshot.version, p.name)
+
+
 def processEvent(event):
     # Based on the event, call lambda(s) to handle
     syncFunHandlers = {
@@ -116,6 +247,13 @@ def processEvent(event):
         "ScreenStaysOn": [processScreenStaysOn],
         "OutsideTemperature": [processOutsideTemperature],
         "DisplayMessage": [processDisplayMessage],
+        "ScreenDeepIdle": [processScreenDeepIdle],
+        "ProfileRequest": [processProfileRequest],
+        "ScreenBrightness": [processScreenBrightness],
+        "Telemetry": [processTelemetry],
+        "FrameMirror": [processFrameMirror],
+        "ConfigReload": [processConfigReload],
+        "ConfigApplied": [processConfigApplied],
     }
     cmdFuns = syncFunHandlers.get(event.name)
     if not cmdFuns:
@@ -128,10 +266,61 @@ def processEvent(event):
             cmdFun(event)
 
 
+def trackState(event):
+    # latest values seen by the hub, for the control socket and the state
+    # document published by mqttclient
+    key = STATE_EVENTS.get(event.name)
+    if not key:
+        return
+    changed = key not in hubState or hubState[key] != event.value
+    hubState[key] = event.value
+    hubState[key + "Time"] = time.time()
+    # the age of a temperature matters even if it did not change
+    if const.mqtt_publish_mode == "topics" or not (changed or key == "temperature"):
+        return
+    # all of it, not just what changed, so a command that mqttclient had to
+    # drop or overwrite does not leave the document behind for long
+    doc = {k: hubState[k] for k in STATE_EVENTS.values() if k in hubState}
+    if "temperatureTime" in hubState:
+        doc["temperatureTime"] = int(hubState["temperatureTime"])
+    mqttclient.do_handle_state(doc)
+
+
+def getState():
+    # called from the control socket thread. Copying the dict is atomic
+    state = dict(hubState)
+    temperatureTime = state.pop("temperatureTime", None)
+    state["temperatureAge"] = (
+        None if temperatureTime is None else time.time() - temperatureTime
+    )
+    for key in STATE_EVENTS.values():
+        state.setdefault(key, None)
+        state.pop(key + "Time", None)
+    state["configVersion"] = config.current().version
+    return state
+
+
+def queueEvent(event):
+    try:
+        ctlsockEventq.put_nowait(event)
+    except queue.Full:
+        raise RuntimeError("event queue is full")
+
+
+def queueConfigEvent(event):
+    try:
+        configEventq.put_nowait(event)
+    except queue.Full:
+        raise RuntimeError("event queue is full")
+
+
 def processEvents(timeout):
     global stop_trigger
     try:
         event = eventq.get(True, timeout)
+        if eventRecorder is not None:
+            eventRecorder.record(event)
+        trackState(event)
         # logger.debug("Process event for %s", type(event))
         if isinstance(event, events.Base):
             processEvent(event)
@@ -151,12 +340,19 @@ def processEvents(timeout):
 
 
 def main():
+    global ctlsockEventq, configEventq
     try:
         # Start our processes
         [p.start() for p in myProcesses]
+        memstat.start_monitor("main")
+        ctlsockEventq = newEventProducer(eventq)
+        ctlsock.start_server(getState, queueEvent, frameDecoder.png)
+        configEventq = newEventProducer(eventq)
+        config.start_watcher(queueConfigEvent, configStamp)
         logger.debug("Starting main event processing loop")
         while not stop_trigger:
             processEvents(EVENTQ_GET_TIMEOUT)
+            sendConfig()
     except Exception as e:
         logger.error("Unexpected event: %s", e)
     # make sure all children are terminated
@@ -165,21 +361,53 @@ def main():
 
 # globals
 stop_trigger = False
-logger = None
+logger = log.getLogger()
 eventq = None
+ctlsockEventq = None
+configEventq = None
+# what the config file was like when it was read at start
+configStamp = None
+eventRecorder = None
 myProcesses = []
+# process name: config version it reported applying, and when the hub last
+# sent it the current one. See sendConfig()
+configVersions = {}
+configSent = {}
+# event name: key in hubState
+STATE_EVENTS = {
+    "ScreenBrightness": "brightness",
+    "MotionLux": "lux",
+    "MotionProximity": "proximity",
+    "DisplayMessage": "message",
+    "OutsideTemperature": "temperature",
+    "ScreenStaysOn": "stayOn",
+    "ScreenDeepIdle": "deepIdle",
+}
+hubState = {}
+# frame the screen shows, put back together from the mirrored ones
+frameDecoder = framemirror.Decoder()
 
 
 if __name__ == "__main__":
-    # global logger, eventq, myProcesses
+    # global eventq, myProcesses
 
-    logger = log.getLogger()
     log.initLogger()
     logger.debug("bedclock process started")
-    eventq = multiprocessing.Queue(EVENTQ_SIZE)
+    # before anything reads the knobs
+    configStamp = config.do_init()
+    # must happen before any queues are created
+    multiprocessing.set_start_method(const.proc_start_method)
+    if const.proc_start_method == "forkserver":
+        multiprocessing.set_forkserver_preload(const.proc_forkserver_preload)
+    cpusched.apply_profile("main")
+    profiler.do_init("main")
+    eventRecorder = eventlog.open_recorder()
+    eventq = newEventq()
     if const.mqtt_enabled:
         myProcesses.append(MqttclientProcess(eventq))
     myProcesses.append(MotionProcess(eventq))
     myProcesses.append(ScreenProcess(eventq))
+    # children start with the knobs of the config read above
+    configVersions = {p.name: config.current().version for p in myProcesses}
     main()
     raise RuntimeError("main is exiting")
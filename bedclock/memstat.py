@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import os
+import signal
+import sys
+import threading
+
+# need this because exported python path gets lost when invoking sudo
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+from bedclock import const  # noqa
+from bedclock import log  # noqa
+
+MEM_ACTION_WARN = "warn"
+MEM_ACTION_RESTART = "restart"
+
+
+# =============================================================================
+
+
+def read_memory(pid="self"):
+    """Return rss, pss and uss of a process, in kB.
+
+    uss (unique set size) is the memory that would be freed if the process
+    went away. pss splits shared pages evenly among the processes sharing
+    them, so adding up pss of all processes gives a fair total.
+    """
+    values = {}
+    try:
+        with open("/proc/{}/smaps_rollup".format(pid)) as f:
+            for line in f:
+                tokens = line.split()
+                if len(tokens) == 3 and tokens[2] == "kB":
+                    values[tokens[0].rstrip(":")] = int(tokens[1])
+    except OSError:
+        # older kernels: no smaps_rollup, so the best we can get is rss
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    values["Rss"] = int(line.split()[1])
+    rss = values.get("Rss", 0)
+    return {
+        "rss": rss,
+        "pss": values.get("Pss", rss),
+        "uss": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def memory_str(mem):
+    return "rss {rss}kB pss {pss}kB uss {uss}kB".format(**mem)
+
+
+# =============================================================================
+
+
+class MemoryMonitor(threading.Thread):
+    def __init__(self, procName, budgetKb, action, periodInSeconds):
+        threading.Thread.__init__(self, name="memory-monitor", daemon=True)
+        self.procName = procName
+        self.budgetKb = budgetKb
+        self.action = action
+        self.periodInSeconds = periodInSeconds
+        self.stopEvent = threading.Event()
+
+    def run(self):
+        while not self.stopEvent.wait(self.periodInSeconds):
+            self.check()
+
+    def check(self):
+        mem = read_memory()
+        logger.info("{} memory: {}".format(self.procName, memory_str(mem)))
+        if not self.budgetKb or mem["uss"] <= self.budgetKb:
+            return True
+        if self.action != MEM_ACTION_RESTART:
+            logger.warning(
+                "{} uss {}kB is over budget of {}kB".format(
+                    self.procName, mem["uss"], self.budgetKb
+                )
+            )
+            return False
+        # terminating is how children restart: main will notice the dead
+        # child and exit, so systemd can restart everything
+        logger.error(
+            "{} uss {}kB is over budget of {}kB: restarting".format(
+                self.procName, mem["uss"], self.budgetKb
+            )
+        )
+        os.kill(os.getpid(), signal.SIGTERM)
+        return False
+
+
+def start_monitor(procName):
+    if not const.mem_report_period_seconds:
+        return None
+    monitor = MemoryMonitor(
+        procName,
+        const.mem_budget_kb.get(procName),
+        const.mem_budget_action,
+        const.mem_report_period_seconds,
+    )
+    monitor.start()
+    return monitor
+
+
+# =============================================================================
+
+
+def _is_bedclock_main(pid):
+    try:
+        with open("/proc/{}/cmdline".format(pid), "rb") as f:
+            cmdline = f.read().split(b"\0")
+        cwd = os.readlink("/proc/{}/cwd".format(pid))
+    except OSError:
+        return False
+    # start_bedclock.sh invokes ./main.py from within the bedclock directory
+    for arg in cmdline[:2]:
+        if arg.endswith(b"bedclock/main.py"):
+            return True
+        if arg.endswith(b"main.py") and cwd.endswith("bedclock"):
+            return True
+    return False
+
+
+def find_bedclock_pids():
+    return sorted(
+        int(entry)
+        for entry in os.listdir("/proc")
+        if entry.isdigit() and int(entry) != os.getpid() and _is_bedclock_main(entry)
+    )
+
+
+def report(pids):
+    totals = {"rss": 0, "pss": 0, "uss": 0}
+    print("{:>8} {:>10} {:>10} {:>10}".format("pid", "rss kB", "pss kB", "uss kB"))
+    for pid in pids:
+        try:
+            mem = read_memory(pid)
+        except OSError as e:
+            print("{:>8} {}".format(pid, e))
+            continue
+        for k in totals:
+            totals[k] += mem[k]
+        print("{:>8} {rss:>10} {pss:>10} {uss:>10}".format(pid, **mem))
+    # note: rss total counts shared pages more than once. pss is the one to
+    #       compare when looking at different process models
+    print("{:>8} {rss:>10} {pss:>10} {uss:>10}".format("total", **totals))
+    return totals
+
+
+# =============================================================================
+
+
+# globals
+logger = log.getLogger()
+if __name__ == "__main__":
+    pids = [int(pid) for pid in sys.argv[1:]] or find_bedclock_pids()
+    if not pids:
+        sys.exit("no bedclock processes found")
+    print("configured process model: {}".format(const.proc_start_method))
+    report(pids)
@@ -1,49 +1,73 @@
 #!/usr/bin/env python3
 
-import board
-import busio
-from adafruit_apds9960.apds9960 import APDS9960
-from adafruit_apds9960 import colorutility
-from datetime import datetime
 import dill
 import multiprocessing
 import signal
 from six.moves import queue
 import sys
-import time
+import threading
 
+from bedclock import clocks
+from bedclock import config
 from bedclock import const
 from bedclock import events
 from bedclock import log
+from bedclock import profiler
+from bedclock import sensors
+from bedclock import snapshot
+from bedclock import telemetry
+from bedclock import timeseries
 
 CMDQ_SIZE = 5
+CMDQ_GET_TIMEOUT = 1  # seconds, when blocking
 _state = None
+_cmdq = None  # see do_connect
 
 
 class State(object):
-    def __init__(self, queueEventFun):
+    def __init__(self, queueEventFun, cmdq=None, clock=None):
         self.queueEventFun = queueEventFun  # queue for output events to main.py
-        self.cmdq = multiprocessing.Queue(CMDQ_SIZE)  # queue for input commands
-        self.apds = None
+        self.clock = clock if clock is not None else clocks.RealClock()
+        # queue for input commands
+        self.cmdq = cmdq if cmdq is not None else multiprocessing.Queue(CMDQ_SIZE)
+        # sensors.SensorArray, made by init_sensors()
+        self.sensors = None
+        # sensors were initialized again and none has read anything since
+        self.sensorsReinitialized = False
         self.luxAboveWatermark = True
-        self.luxLastPeriodicReport = datetime.now()
+        self.luxLastPeriodicReport = self.clock.now()
         self.forceNextLuxEvent = True
         # fudge an initial lux value, before real read takes place
         self.currLux = const.motion_luxMaxValue
         self.lastLuxReported = -1
         self.currRawProximity = 999
         self.currProximity = 0
-        self.currProximityDampenTimestamp = datetime.now()
+        self.currProximityDampenTimestamp = self.clock.now()
         # enabled via main's MotionProcess
         self.luxNotifyEnabled = False
         self.proximityNotifyEnabled = False
+        # set by main when screen is in deep idle
+        self.deepIdle = False
+        self.luxLastIdleRead = self.clock.now()
+        # lux and watermark survive restarts, so hysteresis picks up where
+        # it left off
+        self.snapshotter = snapshot.Snapshotter("motion")
+        # every sample read, kept for tuning the thresholds. See timeseries.py
+        self.luxSeries = None
+        self.proximitySeries = None
+        # every sample read, batched up for mqtt. See telemetry.py
+        self.telemetry = None
+        if const.telemetry_enabled:
+            self.telemetry = telemetry.Batcher(
+                const.telemetry_flush_seconds, const.telemetry_flush_samples
+            )
 
 
 # =============================================================================
 
 
 def ms_sleep(value):
-    time.sleep(value / 1000.0)
+    _state.clock.sleep(value / 1000.0)
 
 
 def on_off_str(boolValue):
@@ -53,12 +77,26 @@ def on_off_str(boolValue):
 # =============================================================================
 
 
-def do_init(queueEventFun=None):
+def do_init(queueEventFun=None, cmdq=None, clock=None):
     global _state
-    _state = State(queueEventFun)
+    _state = State(queueEventFun, cmdq, clock)
+    do_connect(_state.cmdq)
+    saved = snapshot.load("motion")
+    if saved:
+        _state.currLux = saved.get("lux", _state.currLux)
+        _state.luxAboveWatermark = saved.get("luxAboveWatermark", True)
     # logger.debug("init called")
 
 
+# called from outside this module
+def do_connect(cmdq):
+    """Queue commands on cmdq and nothing else, for the process starting
+    the motion one: the sensors and saved lux are only for do_init.
+    """
+    global _cmdq
+    _cmdq = cmdq
+
+
 # =============================================================================
 
 
@@ -72,16 +110,81 @@ def _notifyEvent(event):
 # =============================================================================
 
 
-def init_apds():
+def init_sensors():
     global _state
+    # sensor modules are imported here, so only the process that polls the
+    # sensors pays for loading them
+    import board
+    import busio
+    from adafruit_apds9960.apds9960 import APDS9960
+    from adafruit_apds9960 import colorutility
+
+    # (scl, sda): [i2c, lock, mux]
+    buses = {}
+    sensorList = []
+    for i, sensorConfig in enumerate(const.motion_sensors):
+        pins = (sensorConfig.get("scl", "SCL"), sensorConfig.get("sda", "SDA"))
+        try:
+            if pins not in buses:
+                i2c = busio.I2C(getattr(board, pins[0]), getattr(board, pins[1]))
+                buses[pins] = [i2c, threading.Lock(), None]
+            bus = buses[pins]
+            i2c = bus[0]
+            channel = sensorConfig.get("mux_channel")
+            if channel is not None:
+                if bus[2] is None:
+                    import adafruit_tca9548a
+
+                    bus[2] = adafruit_tca9548a.TCA9548A(i2c, const.motion_mux_address)
+                i2c = bus[2][channel]
+            apds = APDS9960(i2c)
+            apds.enable_color = True
+            apds.enable_proximity = True
+        except (OSError, RuntimeError, ValueError) as e:
+            # the other sensors can still do the job
+            logger.error("cannot initialize motion sensor {}: {}".format(sensorConfig, e))
+            continue
+        sensorList.append(sensors.from_config(sensorConfig, i, apds, bus[1]))
+    if not sensorList:
+        raise RuntimeError("no motion sensor could be initialized")
+
+    # with a virtual clock, nothing may block
+    threads = 0 if _state.clock.virtual else const.motion_sensor_threads
+    _state.sensors = sensors.SensorArray(
+        sensorList, colorutility.calculate_lux, threads
+    )
+    logger.info(
+        "motion sensors initialized: {}".format(", ".join(s.name for s in sensorList))
+    )
 
-    i2c = busio.I2C(board.SCL, board.SDA)
-    apds = APDS9960(i2c)
-    apds.enable_color = True
-    apds.enable_proximity = True
 
-    _state.apds = apds
-    logger.info("motion sensor initialized")
+def reinit_sensors():
+    global _state
+    # what a restart would do, minus losing the state of this process. If
+    # that did not help either, leave it to systemd
+    if _state.sensorsReinitialized:
+        raise RuntimeError("motion sensors keep failing")
+    logger.error("all motion sensors are failing, initializing them again")
+    _state.sensors.shutdown()
+    _state.sensors = None
+    init_sensors()
+    _state.sensorsReinitialized = True
+
+
+def init_timeseries():
+    global _state
+    if not const.ts_dir:
+        return
+    SERIES = timeseries.SERIES
+    try:
+        _state.luxSeries = timeseries.open_series(
+            timeseries.SERIES_LUX, SERIES[timeseries.SERIES_LUX]
+        )
+        _state.proximitySeries = timeseries.open_series(
+            timeseries.SERIES_PROXIMITY, SERIES[timeseries.SERIES_PROXIMITY]
+        )
+    except OSError as e:
+        logger.warning("not keeping time series: {}".format(e))
 
 
 # =============================================================================
@@ -90,47 +193,105 @@ def init_apds():
 def do_iterate():
     global _state
 
+    # Note: since we need to busy poll the motion sensor, we do not
+    #       block on input queue. We will microsleep later on
+    if do_iterate_cmdq():
+        # call iteration done for now, since we did some work if we made
+        # it here
+        return
+
+    ms_sleep(const.motion_idlePollInMs if _state.deepIdle else const.motion_pollInMs)
+
+    if _state.sensors is None:
+        init_sensors()
+        init_timeseries()
+        return
+
+    readings = _state.sensors.poll(
+        _state.clock.monotonic(),
+        wantLux(),
+        wantProximity(),
+        const.motion_sensor_read_timeout_seconds,
+    )
+    for sensor, e in readings.errors:
+        # not every time, since a sensor that is gone fails every poll
+        if sensor.consecutiveErrors in (1, 100) or sensor.consecutiveErrors % 1000 == 0:
+            logger.warning(
+                "reading motion sensor {} failed {} times in a row: {}".format(
+                    sensor.name, sensor.consecutiveErrors, e
+                )
+            )
+    if _state.sensors.failing():
+        reinit_sensors()
+        return
+    if readings.lux is not None or readings.proximity is not None:
+        _state.sensorsReinitialized = False
+    if readings.lux is not None:
+        do_iterate_light(readings.lux)
+    if readings.proximity is not None:
+        do_iterate_proximity(readings.proximity, readings.rawProximity)
+    do_iterate_telemetry()
+
+
+def do_iterate_cmdq(block=False):
+    global _state
+
+    # returns True if a command was executed
     try:
-        # Note: since we need to busy poll the motion sensor, we do not
-        #       block on input queue. We will microsleep later on
-        cmdDill = _state.cmdq.get_nowait()
+        if block:
+            cmdDill = _state.clock.get(_state.cmdq, CMDQ_GET_TIMEOUT)
+        else:
+            cmdDill = _state.cmdq.get_nowait()
         cmdFun, params = dill.loads(cmdDill)
         cmdFun(*params)
         logger.debug("executed a lambda command with params %s", params)
-        # call iteration done for now, since we did some work if we made
-        # it here
-        return
+        return True
     except queue.Empty:
         pass
     except (KeyboardInterrupt, SystemExit):
         pass
+    return False
 
-    ms_sleep(321)
 
-    if _state.apds is None:
-        init_apds()
-        return
+# =============================================================================
 
-    do_iterate_light()
-    do_iterate_proximity()
 
+def wantLux():
+    global _state
 
-# =============================================================================
+    # in deep idle, only look at color every now and then, unless
+    # a lux report was explicitly requested
+    if _state.deepIdle and not _state.forceNextLuxEvent:
+        now = _state.clock.now()
+        tdelta = now - _state.luxLastIdleRead
+        if tdelta.total_seconds() < const.motion_idleLuxPollInSeconds:
+            return False
+        _state.luxLastIdleRead = now
+    return True
 
 
-def do_iterate_light():
+def wantProximity():
     global _state
 
-    if not _state.apds.color_data_ready:
-        return
+    # dampen how often we look at proximity based on the last time
+    # the proximity got updated
+    now = _state.clock.now()
+    tdelta = now - _state.currProximityDampenTimestamp
+    return tdelta.total_seconds() >= const.motion_proximityDampenInSeconds
+
+
+def do_iterate_light(newLux):
+    global _state
 
-    # get the data and print the different channels
+    # newLux is fused from all sensors
     currLux = _state.currLux
-    r, g, b, _c = _state.apds.color_data
-    newLux = colorutility.calculate_lux(r, g, b)
+    if _state.luxSeries:
+        _state.luxSeries.append(_state.clock.time(), newLux)
+    if _state.telemetry:
+        _state.telemetry.add("lux", _state.clock.time(), max(0, newLux))
 
     _state.currLux = max(0, int(newLux))
-    now = datetime.now()
+    now = _state.clock.now()
     tdelta = now - _state.luxLastPeriodicReport
 
     # Reasons why lux should be reported:
@@ -163,6 +324,9 @@ def do_iterate_light():
     # create lux event and send it to main
     _state.luxLastPeriodicReport = now
     _state.lastLuxReported = _state.currLux
+    _state.snapshotter.save(
+        {"lux": _state.currLux, "luxAboveWatermark": _state.luxAboveWatermark}
+    )
     if _state.luxNotifyEnabled:
         event = events.MotionLux(_state.currLux)
         _notifyEvent(event)
@@ -171,23 +335,29 @@ def do_iterate_light():
 # =============================================================================
 
 
-def do_iterate_proximity():
+def do_iterate_telemetry():
     global _state
 
-    # dampen how often we look at proximity based on the last time
-    # the proximity got updated
-    now = datetime.now()
-    tdelta = now - _state.currProximityDampenTimestamp
-    if tdelta.total_seconds() < const.motion_proximityDampenInSeconds:
+    if _state.telemetry is None:
         return
+    payload = _state.telemetry.poll(_state.clock.monotonic())
+    if payload:
+        _notifyEvent(events.Telemetry(payload))
+
+
+def do_iterate_proximity(newProximity, rawProximity):
+    global _state
 
+    # newProximity is fused from all sensors, each of them having set
+    # what is below its threshold to 0
+    now = _state.clock.now()
     oldProximity = _state.currProximity
-    newProximity = _state.apds.proximity
-    _state.currRawProximity = newProximity
+    _state.currRawProximity = rawProximity
+    if _state.proximitySeries:
+        _state.proximitySeries.append(_state.clock.time(), rawProximity)
+    if _state.telemetry:
+        _state.telemetry.add("proximity", _state.clock.time(), rawProximity)
 
-    # if proximity is less than min threshold, set it to 0
-    if newProximity < const.motion_proximityMinThreshold:
-        newProximity = 0
     if abs(newProximity - _state.currProximity) <= 2:
         # too small of a change... filter it out, unless this is going to 0
         if _state.currProximity == newProximity or newProximity != 0:
@@ -219,10 +389,10 @@ def do_iterate_proximity():
 
 
 def _enqueue_cmd(l):
-    global _state
+    global _cmdq
     lDill = dill.dumps(l)
     try:
-        _state.cmdq.put_nowait(lDill)
+        _cmdq.put_nowait(lDill)
     except queue.Full:
         logger.error("command queue is full: cannot add")
         return False
@@ -236,6 +406,20 @@ def do_lux_report():
     return _enqueue_cmd((_do_lux_report, params))
 
 
+# called from outside this module
+def do_handle_screen_deep_idle(enable):
+    logger.debug("queuing screen deep idle {}".format(enable))
+    params = [enable]
+    return _enqueue_cmd((_do_handle_screen_deep_idle, params))
+
+
+def _do_handle_screen_deep_idle(enable):
+    global _state
+    _state.deepIdle = enable
+    _state.luxLastIdleRead = _state.clock.now()
+    logger.info("deep idle is now {}".format(on_off_str(enable)))
+
+
 def _do_lux_report():
     global _state
     _state.forceNextLuxEvent = True
@@ -290,6 +474,25 @@ def _do_handle_notify_admin_lux(newValue):
     _state.luxNotifyEnabled = newValue
 
 
+# called from outside this module
+def do_profile(kind, seconds):
+    logger.debug("queuing {} profile for {} seconds".format(kind, seconds))
+    params = [kind, seconds]
+    return _enqueue_cmd((profiler.do_profile_start, params))
+
+
+# called from outside this module
+def do_apply_config(configSnapshot):
+    logger.debug("queuing config version {}".format(configSnapshot.version))
+    params = [configSnapshot]
+    return _enqueue_cmd((_do_apply_config, params))
+
+
+def _do_apply_config(configSnapshot):
+    config.apply(configSnapshot)
+    _notifyEvent(events.ConfigApplied(configSnapshot.version, "motion"))
+
+
 # =============================================================================
 
 
@@ -309,6 +512,7 @@ logger = log.getLogger()
 if __name__ == "__main__":
     log.initLogger()
     do_init(None)
+    profiler.do_init("motion")
     signal.signal(signal.SIGINT, _signal_handler)
     do_lux_notify_on()
     do_motion_notify_on()
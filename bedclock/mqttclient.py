@@ -1,17 +1,26 @@
 #!/usr/bin/env python3
 
 import dill
+import json
 import multiprocessing
 import os
-import paho.mqtt.client as mqtt
 import signal
 from six.moves import queue
+import socket
 import sys
+import threading
 import time
 
+from bedclock import backoff
+from bedclock import clocks
+from bedclock import config
 from bedclock import const
 from bedclock import events
+from bedclock import inbox
 from bedclock import log
+from bedclock import profiler
+from bedclock import statedoc
+from bedclock import timeseries
 
 CMDQ_SIZE = 10  # max pending events
 CMDQ_GET_TIMEOUT = 3600  # seconds
@@ -19,26 +28,64 @@ TOPIC_QOS = 1
 STATE_ON = "on"
 STATE_OFF = "off"
 MAX_PAYLOAD_SIZE = 2048
+NETWORK_LOOP_SECONDS = 1.0  # longest paho's loop() blocks for
 _state = None
+_cmdq = None  # see do_connect
+# paho is imported by _setup_mqtt_client, so only the process that talks
+# to the broker pays for loading it
+mqtt = None
 
 
 class State(object):
-    def __init__(self, queueEventFun, mqtt_broker_ip):
+    def __init__(self, queueEventFun, mqtt_broker_ip, cmdq=None, clock=None):
         self.queueEventFun = queueEventFun  # queue for output events
-        self.cmdq = multiprocessing.Queue(CMDQ_SIZE)  # queue for input commands
+        self.clock = clock if clock is not None else clocks.RealClock()
+        # queue for input commands
+        self.cmdq = cmdq if cmdq is not None else multiprocessing.Queue(CMDQ_SIZE)
         self.mqtt_broker_ip = mqtt_broker_ip
         self.mqtt_client = None
+        self.connects = 0
+        self.disconnects = 0
+        self.connectAttempts = 0
+        self.disconnecting = False
+        self.backoff = backoff.Backoff(
+            const.mqtt_reconnect_min_seconds,
+            const.mqtt_reconnect_max_seconds,
+            const.mqtt_reconnect_jitter,
+        )
+        # topic key: (value, time) last published, see _mqtt_publish_state_value
+        self.lastValues = {}
+        self.suppressed = 0
+        # inbound messages, latest per topic, see client_message_callback
+        self.inbox = inbox.Inbox(const.mqtt_inbox_max_topics)
+        self.inboxDropped = 0
+        # see do_handle_state
+        self.stateDoc = statedoc.StateDoc(const.mqtt_statedoc_full_seconds)
+        self.nextStateDocTime = 0
 
 
 # =============================================================================
 
 
-def do_init(queueEventFun=None, mqtt_broker_ip=const.mqtt_broker_ip):
+def do_init(queueEventFun=None, mqtt_broker_ip=None, cmdq=None, clock=None):
     global _state
-    _state = State(queueEventFun, mqtt_broker_ip)
+    # const read now rather than at import, so the config file can set it
+    if mqtt_broker_ip is None:
+        mqtt_broker_ip = const.mqtt_broker_ip
+    _state = State(queueEventFun, mqtt_broker_ip, cmdq, clock)
+    do_connect(_state.cmdq)
     # logger.debug("mqttclient init called")
 
 
+# called from outside this module
+def do_connect(cmdq):
+    """Send the commands of do_motion_on and friends through cmdq. That is
+    all the process starting the mqttclient one needs: no client, no inbox.
+    """
+    global _cmdq
+    _cmdq = cmdq
+
+
 # =============================================================================
 
 
@@ -62,31 +109,92 @@ def client_connect_callback(client, userdata, flags_dict, rc):
         )
         return
     logger.info("client connected with flags %s rc %s", flags_dict, rc)
-    bedclock_topics = [(t, TOPIC_QOS) for t in const.mqtt_topics_sub.values()]
-    client.subscribe(bedclock_topics)
+    _state.connects += 1
+    _state.backoff.reset()
+    _set_nodelay(client)
+    if flags_dict.get("session present"):
+        # the broker kept our subscriptions, and queued what we missed
+        logger.info("mqtt session resumed")
+    else:
+        bedclock_topics = [(t, TOPIC_QOS) for t in const.mqtt_topics_sub.values()]
+        client.subscribe(bedclock_topics)
+        # a broker that lost our session may have lost the retained state too
+        _enqueue_cmd((_do_resend_state_doc, []))
     # artificially publish a motion off, just to trigger something
     do_motion_off()
 
 
+def _set_nodelay(client):
+    # otherwise a publish right behind another one waits for the broker to
+    # ack the first, which delayed acks make take 40ms
+    sock = client.socket()
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def client_disconnect_callback(client, userdata, rc):
+    _state.disconnects += 1
+    if rc != mqtt.MQTT_ERR_SUCCESS:
+        logger.warning("client disconnected rc %s %s", rc, mqtt.error_string(rc))
+
+
 def client_message_callback(client, userdata, msg):
     logger.debug("callback for mqtt message %s %s", msg.topic, msg.payload)
-    params = [msg.topic, msg.payload]
-    _enqueue_cmd((_do_handle_mqtt_msg, params))
+    # messages do not take a command queue slot each: the inbox keeps the
+    # latest one per topic and a single command wakes us up to handle them.
+    # If that command does not fit, do_iterate gets to the inbox anyway
+    if _state.inbox.put(msg.topic, msg.payload):
+        _enqueue_cmd((_do_handle_inbox, []))
+
+
+def _client_id():
+    if const.mqtt_client_id:
+        return const.mqtt_client_id
+    return "bedclock-{}".format(const.mqtt_instance or socket.gethostname())
 
 
 def _setup_mqtt_client(broker_ip):
+    global mqtt
+    import paho.mqtt.client as mqtt
+
     try:
-        client = mqtt.Client(client_id="bedclock")
+        client = mqtt.Client(
+            client_id=_client_id(), clean_session=const.mqtt_clean_session
+        )
         client.on_connect = client_connect_callback
+        client.on_disconnect = client_disconnect_callback
         client.on_message = client_message_callback
 
-        client.connect_async(broker_ip, port=1883, keepalive=181)
+        client.connect_async(broker_ip, port=const.mqtt_broker_port, keepalive=181)
         return client
     except Exception as e:
         logger.info("mqtt client setup did not work %s", e)
     return None
 
 
+def _network_loop(client):
+    # paho's loop_forever(), but waiting out a jittered backoff (see
+    # backoff.py) between connection attempts
+    _connect(client)
+    while not _state.disconnecting:
+        if client.loop(NETWORK_LOOP_SECONDS) == mqtt.MQTT_ERR_SUCCESS:
+            continue
+        if _state.disconnecting:
+            break
+        delay = _state.backoff.next_delay()
+        logger.info("connecting to mqtt broker in {:.1f} seconds".format(delay))
+        time.sleep(delay)
+        _connect(client)
+
+
+def _connect(client):
+    _state.connectAttempts += 1
+    try:
+        client.reconnect()
+    except OSError as e:
+        logger.warning("mqtt broker connect failed: {}".format(e))
+
+
 # =============================================================================
 
 
@@ -97,13 +205,19 @@ def do_iterate():
         _state.mqtt_client = _setup_mqtt_client(_state.mqtt_broker_ip)
         if not _state.mqtt_client:
             logger.warning("got no mqttt client")
-            time.sleep(30)
+            _state.clock.sleep(30)
             return
         logger.debug("have a mqtt_client now")
-        _state.mqtt_client.loop_start()
-
+        threading.Thread(
+            target=_network_loop, args=(_state.mqtt_client,), name="mqtt", daemon=True
+        ).start()
+
+    # wake up when the state document is due
+    timeout = CMDQ_GET_TIMEOUT
+    if _state.stateDoc.dirty:
+        timeout = max(0, _state.nextStateDocTime - _state.clock.monotonic())
     try:
-        cmdDill = _state.cmdq.get(True, CMDQ_GET_TIMEOUT)
+        cmdDill = _state.clock.get(_state.cmdq, timeout)
         cmdFun, params = dill.loads(cmdDill)
         cmdFun(*params)
         logger.debug("executed a lambda command with params %s", params)
@@ -112,11 +226,23 @@ def do_iterate():
         pass
     except (KeyboardInterrupt, SystemExit):
         pass
+    _do_handle_inbox()
+    _do_publish_state_doc()
 
 
 # =============================================================================
 
 
+def _do_handle_inbox():
+    global _state
+    for topic, payload in _state.inbox.take_all():
+        _do_handle_mqtt_msg(topic, payload)
+    stats = _state.inbox.stats()
+    if stats["dropped"] != _state.inboxDropped:
+        _state.inboxDropped = stats["dropped"]
+        logger.warning("inbox is full, dropping mqtt messages: {}".format(stats))
+
+
 def _do_handle_mqtt_msg_stay(msg):
     enable = isinstance(msg, str) and msg.lower() in const.mqtt_value_enable
     event = events.ScreenStaysOn(enable, _this_module())
@@ -134,6 +260,42 @@ def _do_handle_mqtt_msg_temperature(temperature):
         _notifyEvent(event)
 
 
+def _do_handle_mqtt_msg_profile(request):
+    # expected payload: <target> [kind] [seconds]
+    tokens = request.split() if isinstance(request, str) else []
+    if not tokens:
+        return
+    target, kind, seconds = (tokens + [None, None])[:3]
+    kind, seconds = profiler.normalize_request(kind, seconds)
+    event = events.ProfileRequest(target, kind, seconds, _this_module())
+    _notifyEvent(event)
+
+
+def _do_handle_mqtt_msg_query(request):
+    # expected payload: <series> [start] [end] [max points], where start and
+    # end are epoch seconds or, when zero or negative, relative to now
+    tokens = request.split() if isinstance(request, str) else []
+    if not tokens:
+        return
+    name = tokens[0]
+    start = tokens[1] if len(tokens) > 1 else "-3600"
+    end = tokens[2] if len(tokens) > 2 else "0"
+    try:
+        start, end = timeseries.parse_time(start), timeseries.parse_time(end)
+        maxPoints = int(tokens[3]) if len(tokens) > 3 else const.ts_query_max_points
+    except ValueError:
+        logger.warning("ignoring bad time series query: {}".format(request))
+        return
+    results = None
+    if name in timeseries.SERIES and const.ts_dir:
+        # motion keeps the series, and we only read them. Only the records
+        # in the range get copied out of the memory mapped file
+        results = timeseries.query(name, start, end, maxPoints)
+    if results is None:
+        results = {"series": name, "error": "no such series"}
+    _mqtt_publish_value(const.mqtt_topic_pub_query_result, json.dumps(results))
+
+
 def _do_handle_mqtt_msg(topic, payload):
     # logger.debug("received mqtt message %s %s", topic, payload)
 
@@ -150,6 +312,8 @@ def _do_handle_mqtt_msg(topic, payload):
         tp(const.mqtt_topic_sub_stay): _do_handle_mqtt_msg_stay,
         tp(const.mqtt_topic_sub_temperature): _do_handle_mqtt_msg_temperature,
         tp(const.mqtt_topic_sub_msg): _do_handle_mqtt_msg_msg,
+        tp(const.mqtt_topic_sub_profile): _do_handle_mqtt_msg_profile,
+        tp(const.mqtt_topic_sub_query): _do_handle_mqtt_msg_query,
     }
 
     msg_handler = msg_handlers.get(topic)
@@ -158,36 +322,80 @@ def _do_handle_mqtt_msg(topic, payload):
         msg_handler(payload)
 
 
-def _mqtt_publish_value(publish_topic_key, newValue):
+def _do_handle_state(changes):
+    global _state
+    _state.stateDoc.update(changes)
+
+
+def _do_resend_state_doc():
+    global _state
+    _state.stateDoc.resend()
+
+
+def _do_publish_state_doc():
+    global _state
+    now = _state.clock.monotonic()
+    if not _state.stateDoc.dirty or now < _state.nextStateDocTime:
+        return
+    _state.nextStateDocTime = now + const.mqtt_statedoc_seconds
+    isFull, payload = _state.stateDoc.encode(_state.clock.time())
+    topicKey = const.mqtt_topic_pub_state_delta
+    if isFull:
+        topicKey = const.mqtt_topic_pub_state
+    _mqtt_publish_value(topicKey, payload, retain=True)
+
+
+def _mqtt_publish_value(publish_topic_key, newValue, retain=False):
     global _state
     topic = const.mqtt_topics_pub.get(publish_topic_key)
     if not topic:
         # bug!?!
         logger.error("no mqtt topic for %s %s", publish_topic_key, newValue)
-        return
+        return False
     if not _state.mqtt_client:
         logger.warning("no client to publish mqtt topic %s %s", topic, newValue)
-        return
+        return False
     try:
         # logger.debug("publishing mqtt topic %s %s", topic, newValue)
-        info = _state.mqtt_client.publish(topic, newValue, qos=TOPIC_QOS)
+        info = _state.mqtt_client.publish(
+            topic, newValue, qos=TOPIC_QOS, retain=retain
+        )
         info.wait_for_publish()
     except Exception as e:
         logger.error("client failed publish mqtt topic %s %s %s", topic, newValue, e)
-        return
+        return False
     logger.debug("published mqtt topic %s %s", topic, newValue)
+    return True
+
+
+def _mqtt_publish_state_value(publish_topic_key, newValue):
+    global _state
+    # a value that did not change since it was last published only goes out
+    # again every mqtt_republish_seconds, e.g. the motion off on reconnect
+    now = _state.clock.monotonic()
+    last = _state.lastValues.get(publish_topic_key)
+    if (
+        last is not None
+        and last[0] == newValue
+        and const.mqtt_republish_seconds is not None
+        and now - last[1] < const.mqtt_republish_seconds
+    ):
+        _state.suppressed += 1
+        return
+    if _mqtt_publish_value(publish_topic_key, newValue):
+        _state.lastValues[publish_topic_key] = (newValue, now)
 
 
 # =============================================================================
 
 
 def _enqueue_cmd(l):
-    global _state
+    global _cmdq
     if not const.mqtt_enabled:
         return True  # noop
     lDill = dill.dumps(l)
     try:
-        _state.cmdq.put_nowait(lDill)
+        _cmdq.put_nowait(lDill)
     except queue.Full:
         logger.error("command queue is full: cannot add")
         return False
@@ -205,18 +413,71 @@ def do_motion_off():
 
 
 def _do_motion_onoff(newState):
+    if const.mqtt_publish_mode == "statedoc":
+        return True  # proximity is in the state document
     logger.debug("queuing motion_{}".format(newState))
     params = [const.mqtt_topic_pub_motion, newState]
-    return _enqueue_cmd((_mqtt_publish_value, params))
+    return _enqueue_cmd((_mqtt_publish_state_value, params))
 
 
 # called from outside this module
 def do_handle_motion_lux(currLux):
+    if const.mqtt_publish_mode == "statedoc":
+        return True  # lux is in the state document
     logger.debug("queuing motion_lux {}".format(currLux))
     params = [const.mqtt_topic_pub_light, currLux]
+    return _enqueue_cmd((_mqtt_publish_state_value, params))
+
+
+# called from outside this module
+def do_publish_telemetry(payload):
+    logger.debug("queuing {} bytes of telemetry".format(len(payload)))
+    params = [const.mqtt_topic_pub_telemetry, payload]
     return _enqueue_cmd((_mqtt_publish_value, params))
 
 
+# called from outside this module
+def do_publish_frame(payload):
+    logger.debug("queuing mirrored frame of {} bytes".format(len(payload)))
+    params = [const.mqtt_topic_pub_frame, payload]
+    return _enqueue_cmd((_mqtt_publish_value, params))
+
+
+# called from outside this module
+def do_handle_state(changes):
+    logger.debug("queuing state changes {}".format(changes))
+    params = [changes]
+    return _enqueue_cmd((_do_handle_state, params))
+
+
+# called from outside this module
+def do_disconnect():
+    global _state
+    # stops the network loop from connecting again
+    _state.disconnecting = True
+    if _state.mqtt_client:
+        _state.mqtt_client.disconnect()
+
+
+# called from outside this module
+def do_profile(kind, seconds):
+    logger.debug("queuing {} profile for {} seconds".format(kind, seconds))
+    params = [kind, seconds]
+    return _enqueue_cmd((profiler.do_profile_start, params))
+
+
+# called from outside this module
+def do_apply_config(configSnapshot):
+    logger.debug("queuing config version {}".format(configSnapshot.version))
+    params = [configSnapshot]
+    return _enqueue_cmd((_do_apply_config, params))
+
+
+def _do_apply_config(configSnapshot):
+    config.apply(configSnapshot)
+    _notifyEvent(events.ConfigApplied(configSnapshot.version, _this_module()))
+
+
 # =============================================================================
 
 
@@ -244,6 +505,7 @@ logger = log.getLogger()
 if __name__ == "__main__":
     log.initLogger()
     do_init(None)
+    profiler.do_init("mqttclient")
     signal.signal(signal.SIGINT, _signal_handler)
     while not stop_trigger:
         do_iterate()
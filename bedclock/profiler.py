@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import cProfile
+from collections import Counter
+from datetime import datetime
+import os
+import signal
+import sys
+import threading
+import tracemalloc
+
+from bedclock import const
+from bedclock import log
+from bedclock import safefs
+
+PROFILE_KIND_CPROFILE = "cprofile"
+PROFILE_KIND_SAMPLE = "sample"
+PROFILE_KIND_TRACEMALLOC = "tracemalloc"
+PROFILE_KINDS = [PROFILE_KIND_CPROFILE, PROFILE_KIND_SAMPLE, PROFILE_KIND_TRACEMALLOC]
+PROFILE_FILE_EXT = {
+    PROFILE_KIND_CPROFILE: "prof",
+    PROFILE_KIND_SAMPLE: "folded",
+    PROFILE_KIND_TRACEMALLOC: "tracemalloc",
+}
+_state = None
+
+
+class State(object):
+    def __init__(self, procName):
+        self.procName = procName
+        # only one profile can be active at a time. When kind is None,
+        # nothing is hooked into the process, so there is no overhead
+        self.kind = None
+        self.profile = None
+        self.sampler = None
+        # threads doing work of the process, besides the main one
+        self.workerThreads = []
+
+
+class Sampler(threading.Thread):
+    """Poor man's sampling profiler: periodically walks the stack of all
+    other threads in the process and counts the folded stacks seen.
+    """
+
+    def __init__(self, intervalInMilliseconds):
+        threading.Thread.__init__(self, name="profiler-sampler", daemon=True)
+        self.interval = intervalInMilliseconds / 1000.0
+        self.stopEvent = threading.Event()
+        self.samples = Counter()
+
+    def run(self):
+        myIdent = threading.get_ident()
+        while not self.stopEvent.wait(self.interval):
+            threadNames = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == myIdent:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        "{}:{}".format(os.path.basename(code.co_filename), code.co_name)
+                    )
+                    frame = frame.f_back
+                stack.append(threadNames.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopEvent.set()
+        self.join()
+
+    def dump(self, filename):
+        with open(filename, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write("{} {}\n".format(stack, count))
+
+
+# =============================================================================
+
+
+def do_init(procName):
+    global _state
+    _state = State(procName)
+    # Note: signal handlers can only be installed from the main thread, so this
+    #       must be called from within the process (i.e. run()) that is to be
+    #       profiled, not from the parent that created it.
+    signal.signal(signal.SIGUSR1, _signal_handler_start)
+    signal.signal(signal.SIGALRM, _signal_handler_stop)
+    logger.debug(
+        "profiler ready for {} (pid {}): kill -USR1 to start".format(
+            procName, os.getpid()
+        )
+    )
+
+
+# =============================================================================
+
+
+def _dump_filename(kind):
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return os.path.join(
+        const.profile_dump_dir,
+        "{}-{}-{}.{}".format(
+            _state.procName, os.getpid(), timestamp, PROFILE_FILE_EXT[kind]
+        ),
+    )
+
+
+def normalize_request(kind, seconds):
+    if kind not in PROFILE_KINDS:
+        kind = const.profile_default_kind
+    try:
+        seconds = int(seconds)
+    except (TypeError, ValueError):
+        seconds = const.profile_default_seconds
+    seconds = min(const.profile_max_seconds, max(1, seconds))
+    return kind, seconds
+
+
+# called from outside this module
+def do_add_worker_thread(name):
+    """Note a thread doing work of the process. cProfile only sees the
+    thread that enables it, so once there are worker threads a cprofile
+    request gets a sample profile instead, which covers all threads.
+    """
+    if _state is not None:
+        _state.workerThreads.append(name)
+
+
+# Note: this is expected to be invoked from the main thread of the process
+#       being profiled. That is the case for the signal handler and for the
+#       commands dequeued by do_iterate.
+def do_profile_start(kind=None, seconds=None):
+    global _state
+    if _state is None:
+        logger.error("profiler not initialized: ignoring start request")
+        return False
+    if _state.kind is not None:
+        logger.warning("{} profile already in progress".format(_state.kind))
+        return False
+    kind, seconds = normalize_request(kind, seconds)
+    if kind == PROFILE_KIND_CPROFILE and _state.workerThreads:
+        logger.info(
+            "cprofile cannot see the {} thread: sampling instead".format(
+                ", ".join(_state.workerThreads)
+            )
+        )
+        kind = PROFILE_KIND_SAMPLE
+
+    if kind == PROFILE_KIND_CPROFILE:
+        _state.profile = cProfile.Profile()
+        _state.profile.enable()
+    elif kind == PROFILE_KIND_SAMPLE:
+        _state.sampler = Sampler(const.profile_sample_interval_ms)
+        _state.sampler.start()
+    else:
+        tracemalloc.start(const.profile_tracemalloc_frames)
+    _state.kind = kind
+    # SIGALRM will stop the profile, without having to check on it from
+    # the iterate loop
+    signal.alarm(seconds)
+    logger.info(
+        "started {} profile of {} for {} seconds".format(
+            kind, _state.procName, seconds
+        )
+    )
+    return True
+
+
+def do_profile_stop():
+    global _state
+    if _state is None or _state.kind is None:
+        return None
+    kind = _state.kind
+    signal.alarm(0)
+
+    # stop collecting first, so file writing does not show up in the results
+    if kind == PROFILE_KIND_CPROFILE:
+        _state.profile.disable()
+    elif kind == PROFILE_KIND_SAMPLE:
+        _state.sampler.stop()
+    else:
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    filename = _dump_filename(kind)
+    try:
+        safefs.secure_dir(const.profile_dump_dir)
+        if kind == PROFILE_KIND_CPROFILE:
+            _state.profile.dump_stats(filename)
+        elif kind == PROFILE_KIND_SAMPLE:
+            _state.sampler.dump(filename)
+        else:
+            snapshot.dump(filename)
+        logger.info("{} profile saved to {}".format(kind, filename))
+    except OSError as e:
+        logger.error("unable to save {} profile {}: {}".format(kind, filename, e))
+        filename = None
+    _state.kind = None
+    _state.profile = None
+    _state.sampler = None
+    return filename
+
+
+# =============================================================================
+
+
+def _signal_handler_start(signal, frame):
+    do_profile_start(const.profile_default_kind, const.profile_default_seconds)
+
+
+def _signal_handler_stop(signal, frame):
+    do_profile_stop()
+
+
+# =============================================================================
+
+
+# globals
+logger = log.getLogger()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+# Files bedclock writes as root. In a directory that other users can write
+# to, they could plant a symlink where bedclock is about to write, and have
+# it overwrite any file on the system. So bedclock only writes in
+# directories nobody else can add files to, and does not follow symlinks
+# when opening what it writes.
+
+import errno
+import os
+import stat
+
+
+def secure_dir(path):
+    """Create directory path, private to this user, unless it exists. Raises
+    OSError if it is a symlink, or if anyone but this user or root can add
+    files to it.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise OSError(errno.ENOTDIR, "not a directory", path)
+    if st.st_uid not in (os.geteuid(), 0):
+        raise OSError(errno.EPERM, "owned by uid {}".format(st.st_uid), path)
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise OSError(errno.EPERM, "writable by others", path)
+
+
+def open_nofollow(path, flags, mode=0o600):
+    """os.open that fails on a symlink, rather than opening where it points."""
+    return os.open(path, flags | os.O_NOFOLLOW | os.O_CLOEXEC, mode)
+
+
+def create_exclusive(path, mode=0o600):
+    """Create path for writing. Fails if anything is there already."""
+    return open_nofollow(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 
-from datetime import datetime
 from datetime import timedelta
 import dill
 import multiprocessing
@@ -8,52 +7,239 @@ import signal
 from six.moves import queue
 import os
 import sys
-
-from rgbmatrix import graphics, RGBMatrix, RGBMatrixOptions
+import threading
+import time
 
 # need this because exported python path gets lost when invoking sudo
 sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
 
+from bedclock import bdf  # noqa
+from bedclock import clocks  # noqa
+from bedclock import colorxform  # noqa
+from bedclock import config  # noqa
 from bedclock import const  # noqa
 from bedclock import events  # noqa
+from bedclock import framemirror  # noqa
+from bedclock import lanes  # noqa
+from bedclock import layout  # noqa
 from bedclock import log  # noqa
+from bedclock import profiler  # noqa
+from bedclock import snapshot  # noqa
+from bedclock import widgets  # noqa
 
 MAX_OUTSIDE_TEMPERATURE_AGE_IN_SECONDS = 1800
 CMDQ_SIZE = 100
+# first byte of each queued command, which says how it gets prioritized
+# (see lanes.py): wake ups go ahead of everything else, and only the latest
+# lux and temperature matter
+CMD_TAG_WAKE = b"w"
+CMD_TAG_LUX = b"l"
+CMD_TAG_TEMPERATURE = b"t"
+CMD_TAG_OTHER = b"o"
+CMD_URGENT_TAGS = [CMD_TAG_WAKE]
+CMD_LATEST_TAGS = [CMD_TAG_LUX, CMD_TAG_TEMPERATURE]
 TIMERTICK_UNIT = 0.25  # 250ms (in seconds)
+BASE_COLORS = {
+    "black": (0, 0, 0),
+    "white": (255, 255, 255),
+    "red": (255, 0, 0),
+    "green": (0, 255, 0),
+    "blue": (0, 0, 255),
+    "yellow": (230, 230, 50),
+    "motionBlue": (0, 0, 123),
+}
 _state = None
+_cmdq = None  # see do_connect
+# rgbmatrix is imported by init_matrix, so only the process that drives
+# the display pays for loading it
+graphics = None
+
+
+class FrameStats(object):
+    def __init__(self):
+        self.startTime = time.monotonic()
+        self.frames = 0
+        self.droppedFrames = 0
+        self.cpuTime = 0.0
+        self.pixelWrites = 0
+
+    def __str__(self):
+        frames = max(1, self.frames)
+        return (
+            "{} frames in {:.1f}s, {} dropped, per frame: {:.2f}ms cpu "
+            "and {} pixel writes".format(
+                self.frames,
+                time.monotonic() - self.startTime,
+                self.droppedFrames,
+                self.cpuTime * 1000 / frames,
+                int(self.pixelWrites / frames),
+            )
+        )
+
+
+class PwmBitsStats(object):
+    def __init__(self, pwmBits):
+        self.pwmBits = pwmBits
+        self.startTime = time.monotonic()
+        self.startCpuTime = time.process_time()
+
+    def __str__(self):
+        # note: cpu time is for the whole process, which includes the
+        # rgbmatrix refresh thread
+        elapsed = max(0.001, time.monotonic() - self.startTime)
+        cpuTime = time.process_time() - self.startCpuTime
+        return "Was {} pwm bits for {:.0f}s at {:.1f}% cpu".format(
+            self.pwmBits, elapsed, cpuTime * 100 / elapsed
+        )
+
+
+class RenderSnapshot(object):
+    """The part of State that frames get rendered from.
+
+    Taken by the command thread and handed to the render thread, so the
+    render thread never looks at State fields that commands modify.
+    """
+
+    FIELDS = [
+        "currentBrightness",
+        "cachedLux",
+        "cachedProximity",
+        "stayOnInDarkRoom",
+        "cachedOutsideTemperature",
+        "cachedOutsideTemperatureTimestamp",
+        "displayMessage",
+        "displayMessageTimestamp",
+    ]
+
+    def __init__(self, state):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(state, field))
+        # the render thread's own state: widgets, palette, etc.
+        self.widgets = state.widgets
+        self.clock = state.clock
+
+
+class RenderWorker(threading.Thread):
+    """Renders the latest snapshot submitted, dropping the ones that got
+    replaced before it could get to them. While animating, it also renders
+    frames on its own, at the animation frame rate.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="render", daemon=True)
+        self.cond = threading.Condition()
+        self.snapshot = None
+        self.configSnapshot = None
+        # stats
+        self.submitted = 0
+        self.dropped = 0
+
+    def submit(self, snapshot):
+        with self.cond:
+            if self.snapshot is not None:
+                self.dropped += 1
+            self.snapshot = snapshot
+            self.submitted += 1
+            self.cond.notify()
+
+    def apply_config(self, configSnapshot):
+        """Has the render thread apply a config between two frames, and waits
+        for it. Neither thread then reads const while only some of the knobs
+        in the config have changed.
+        """
+        with self.cond:
+            self.configSnapshot = configSnapshot
+            self.cond.notify()
+            while self.configSnapshot is not None:
+                self.cond.wait()
+
+    def run(self):
+        try:
+            self._run()
+        except Exception:
+            # a screen that stops refreshing is worse than a restart
+            logger.exception("render thread failed")
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    def _run(self):
+        snapshot = None
+        while True:
+            with self.cond:
+                if self.snapshot is None and self.configSnapshot is None:
+                    self.cond.wait(animationTimeout())
+                if self.configSnapshot is not None:
+                    config.apply(self.configSnapshot)
+                    self.configSnapshot = None
+                    self.cond.notify()
+                newSnapshot, self.snapshot = self.snapshot, None
+            if newSnapshot is not None:
+                snapshot = newSnapshot
+                renderFrame(snapshot)
+            elif snapshot is not None and _state.animating:
+                animation_tick(snapshot)
+
+
+class InlineRenderer(object):
+    """Renders in the command thread, as the screen did before it had a
+    render thread. Used with a virtual clock, where nothing may block.
+    Frames are only drawn when submitted, so there is no animation.
+    """
+
+    def __init__(self):
+        self.submitted = 0
+        self.dropped = 0
+
+    def submit(self, snapshot):
+        self.submitted += 1
+        renderFrame(snapshot)
+
+    def apply_config(self, configSnapshot):
+        config.apply(configSnapshot)
 
 
 class State(object):
-    def __init__(self, queueEventFun):
+    def __init__(self, queueEventFun, cmdq=None, clock=None):
         self.queueEventFun = queueEventFun  # queue for output events
-        self.cmdq = multiprocessing.Queue(CMDQ_SIZE)  # queue for input commands
+        self.clock = clock if clock is not None else clocks.RealClock()
+        # queue for input commands
+        self.cmdq = cmdq if cmdq is not None else multiprocessing.Queue(CMDQ_SIZE)
+        # commands taken off cmdq, waiting to be handled
+        self.cmdLanes = lanes.Lanes(CMD_URGENT_TAGS, CMD_LATEST_TAGS, CMDQ_SIZE)
         self.matrix = None
         self.cachedNormalizedLux = const.scr_brightnessMaxValue
+        self.cachedLux = const.motion_luxMaxValue
         self.cachedProximity = 0
         self.timer_tick_services = []
         self.fonts = []
-        timer_tick_data = {
-            "black": graphics.Color(0, 0, 0),
-            "white": graphics.Color(255, 255, 255),
-            "red": graphics.Color(255, 0, 0),
-            "green": graphics.Color(0, 255, 0),
-            "blue": graphics.Color(0, 0, 255),
-            "yellow": graphics.Color(230, 230, 50),
-        }
-        self.timer_tick_data = timer_tick_data
+        self.timer_tick_data = {}
+        self.renderWorker = None
+
+        # owned by the render thread (see RenderWorker)
+        self.pwmBitsStats = PwmBitsStats(const.scr_led_pwm_bits)
+        self.widgets = {}
+        self.compositor = None
+        # copies of the frames shown, for remote preview. See init_mirror()
+        self.mirror = None
+
+        # colors used for drawing, after going through the color transform
+        # of the current (mode, brightness bucket). See updatePalette()
+        self.colorXformKey = None
+        self.palettes = {}
+        self.palette = {}
 
         # screen brightness behavior state
         self.currentBrightness = const.scr_brightnessMaxValue
         self.wantedBrightness = self.currentBrightness
         self.useLuxToDetermineBrightness = True
+        self.nextFadeStepTime = 0
 
-        # do not mess with brightness timeout in seconds
+        # do not mess with brightness until this deadline (time.monotonic)
         # will attempt to update currentBrightness to match
-        # wantedBrightness only if timeout is 0. If this is
-        # set to a negative value, that means timeout will
-        # never converge to 0
-        self.stayOnCurrentBrightnessTimeout = const.scr_wakeupTimeoutInSeconds
+        # wantedBrightness only once deadline is reached and set to None.
+        # Setting it to float("inf") means it will never be reached
+        self.stayOnCurrentBrightnessDeadline = (
+            self.clock.monotonic() + const.scr_wakeupTimeoutInSeconds
+        )
 
         # is room is dark, the knob below dictates wheter screen
         # should go completely blank or not
@@ -61,24 +247,106 @@ class State(object):
 
         # outside temperature
         self.cachedOutsideTemperature = None
-        self.cachedOutsideTemperatureAgeInSeconds = (
-            MAX_OUTSIDE_TEMPERATURE_AGE_IN_SECONDS
-        )
+        self.cachedOutsideTemperatureTimestamp = None
 
         # display message
         self.displayMessage = None
+        self.displayMessageTimestamp = self.clock.monotonic()
+
+        # frame pacing, used only while something is animating. Owned by
+        # the render thread
+        self.animating = False
+        self.nextFrameTime = 0
+        self.frameStats = FrameStats()
+
+        # deep idle: screen is dark and nothing is counting down, so there
+        # is no need for timer ticks
+        self.deepIdle = False
+        self.deepIdleTimestamp = self.clock.monotonic()
+        self.wakeups = 0
+
+        # persisted state, so a restart picks up where it left off. See
+        # restoreSnapshot() and saveSnapshot()
+        self.snapshotter = snapshot.Snapshotter(_this_module())
+        self.restoredSnapshot = False
+        self.startTime = self.clock.monotonic()
+        self.luxApplied = False
+        self.settledTimestamp = None
 
 
 # =============================================================================
 
 
-def do_init(queueEventFun=None):
+def do_init(queueEventFun=None, cmdq=None, clock=None):
     global _state
-    _state = State(queueEventFun)
+    _state = State(queueEventFun, cmdq, clock)
+    do_connect(_state.cmdq)
+    restoreSnapshot()
 
     logger.debug("init called")
 
 
+# called from outside this module
+def do_connect(cmdq):
+    """Queue commands on cmdq, for a process running this module. The
+    process starting it needs nothing else, so it calls this, not do_init.
+    """
+    global _cmdq
+    _cmdq = cmdq
+
+
+def restoreSnapshot():
+    global _state
+
+    saved = snapshot.load(_this_module())
+    if not saved:
+        return
+    normalizedLux = saved.get("normalizedLux")
+    if normalizedLux is not None:
+        # start at the brightness the room last called for, instead of
+        # lighting up the screen until the first lux read comes in
+        _state.cachedNormalizedLux = normalizedLux
+        _state.currentBrightness = _state.wantedBrightness = normalizedLux
+        _state.stayOnCurrentBrightnessDeadline = None
+    _state.cachedLux = saved.get("lux", _state.cachedLux)
+    _state.stayOnInDarkRoom = saved.get("stayOnInDarkRoom", _state.stayOnInDarkRoom)
+    _state.displayMessage = saved.get("displayMessage")
+    _state.cachedOutsideTemperature = saved.get("outsideTemperature")
+    temperatureTime = saved.get("outsideTemperatureTime")
+    if temperatureTime is not None:
+        age = _state.clock.time() - temperatureTime
+        _state.cachedOutsideTemperatureTimestamp = _state.clock.monotonic() - age
+    _state.restoredSnapshot = True
+    logger.info(
+        "restored snapshot: brightness {} stay on {} temperature {} "
+        "message '{}'".format(
+            _state.currentBrightness,
+            _state.stayOnInDarkRoom,
+            _state.cachedOutsideTemperature,
+            _state.displayMessage,
+        )
+    )
+
+
+def saveSnapshot():
+    global _state
+
+    temperatureTime = None
+    if _state.cachedOutsideTemperatureTimestamp is not None:
+        age = _state.clock.monotonic() - _state.cachedOutsideTemperatureTimestamp
+        temperatureTime = _state.clock.time() - age
+    _state.snapshotter.save(
+        {
+            "lux": _state.cachedLux,
+            "normalizedLux": _state.cachedNormalizedLux,
+            "stayOnInDarkRoom": _state.stayOnInDarkRoom,
+            "outsideTemperature": _state.cachedOutsideTemperature,
+            "outsideTemperatureTime": temperatureTime,
+            "displayMessage": _state.displayMessage,
+        }
+    )
+
+
 # =============================================================================
 
 
@@ -93,17 +361,27 @@ def _notifyEvent(event):
 
 
 def _notifyEventLuxUpdateRequest():
-    requester = os.path.split(__file__)[-1]
-    requester = requester.split(".py")[0]
-    event = events.LuxUpdateRequest(requester)
+    event = events.LuxUpdateRequest(_this_module())
     _notifyEvent(event)
 
 
+def _notifyEventFrameMirror(payload):
+    _notifyEvent(events.FrameMirror(payload))
+
+
+def _this_module():
+    requester = os.path.split(__file__)[-1]
+    return requester.split(".py")[0]
+
+
 # =============================================================================
 
 
 def init_matrix():
-    global _state
+    global _state, graphics
+    from rgbmatrix import graphics, RGBMatrix, RGBMatrixOptions
+
+    updatePalette(RenderSnapshot(_state))
 
     options = RGBMatrixOptions()
     options.hardware_mapping = const.scr_led_gpio_mapping
@@ -119,6 +397,8 @@ def init_matrix():
     options.led_rgb_sequence = const.scr_led_rgb_sequence
     if const.scr_led_show_refresh:
         options.show_refresh_rate = 1
+    if const.scr_led_limit_refresh_hz:
+        options.limit_refresh_rate_hz = const.scr_led_limit_refresh_hz
     if const.scr_led_slowdown_gpio is not None:
         options.gpio_slowdown = const.scr_led_slowdown_gpio
     if const.scr_led_no_hardware_pulse:
@@ -129,13 +409,109 @@ def init_matrix():
     _state.matrix = RGBMatrix(options=options)
 
     for fontFilename in ["10x20", "6x9", "5x8"]:
-        font = graphics.Font()
-        font.LoadFont("{}/{}.bdf".format(const.scr_fonts_dir, fontFilename))
+        font = bdf.load_font("{}/{}.bdf".format(const.scr_fonts_dir, fontFilename))
         _state.fonts.append(font)
 
     logger.debug("matrix canvas initialized")
 
 
+def init_widgets():
+    global _state
+
+    width, height = _state.matrix.width, _state.matrix.height
+    font0, font1, font2 = _state.fonts[:3]
+    place = layout.compute(width, height, _state.fonts, const.scr_clockOffsetY)
+    size, panels = layout.panel_rects(
+        const.scr_led_rows,
+        const.scr_led_cols,
+        const.scr_led_chain,
+        const.scr_led_parallel,
+        const.scr_pixel_mapper_config,
+    )
+    if size != (width, height):
+        # the mapper did something layout does not know about
+        logger.warning(
+            "canvas is {}x{}, rather than {}x{}: not tracking panels".format(
+                width, height, *size
+            )
+        )
+        panels = None
+
+    # note: widgets are listed in z-order
+    def text(name, font, **kwargs):
+        p = place[name]
+        return widgets.TextWidget(name, font, p.baseline, p.x, p.width, **kwargs)
+
+    def pixel(name):
+        return widgets.PixelWidget(name, place[name].x, place[name].y)
+
+    message = place["message"]
+    _state.widgets = {
+        w.name: w
+        for w in [
+            text("clock", font0),
+            text("weekday", font1),
+            text("date", font1),
+            text("temperature", font2, align=widgets.ALIGN_LEFT),
+            widgets.MarqueeWidget(
+                "message",
+                font2,
+                message.baseline,
+                message.x,
+                message.width,
+                gap=const.scr_marqueeGapPixels,
+            ),
+            pixel("motion"),
+            pixel("stayOn"),
+        ]
+    }
+    _state.compositor = widgets.Compositor(
+        width, height, _state.widgets.values(), panels=panels
+    )
+
+
+def init_mirror():
+    global _state
+    if not const.mirror_enabled:
+        return
+    _state.mirror = framemirror.Mirror(
+        _state.matrix.width,
+        _state.matrix.height,
+        const.mirror_tile_size,
+        const.mirror_max_fps,
+        const.mirror_cpu_budget,
+        const.mirror_keyframe_seconds,
+        const.mirror_max_payload_bytes,
+    )
+    # with a virtual clock, frames get encoded as they are rendered
+    if not _state.clock.virtual:
+        framemirror.Worker(_state.mirror, _notifyEventFrameMirror).start()
+
+
+def init_render_worker():
+    global _state
+    if _state.clock.virtual:
+        _state.renderWorker = InlineRenderer()
+        return
+    _state.renderWorker = RenderWorker()
+    _state.renderWorker.start()
+    profiler.do_add_worker_thread(_state.renderWorker.name)
+
+
+def init_display():
+    global _state
+
+    # matrix may already be there, e.g. a simulated one (see sim.py)
+    if _state.matrix is None:
+        init_matrix()
+    init_widgets()
+    init_mirror()
+    init_timer_ticks()
+    init_render_worker()
+    drawClock()
+    _notifyEventLuxUpdateRequest()
+
+
 # =============================================================================
 
 
@@ -143,30 +519,154 @@ def do_iterate():
     global _state
 
     # will happen once...
-    if _state.matrix is None:
-        init_matrix()
-        init_timer_ticks()
-        drawClock()
-        _notifyEventLuxUpdateRequest()
+    if _state.renderWorker is None:
+        init_display()
+
+    # when fading, wake up in time for the next brightness step. When in deep
+    # idle, block until a command shows up. Otherwise, wait for commands up
+    # to a full timer tick. Frames are paced by the render thread
+    timeout = TIMERTICK_UNIT
+    if _state.deepIdle:
+        timeout = None
+    elif _state.currentBrightness != _state.wantedBrightness:
+        fadeTimeout = _state.nextFadeStepTime - _state.clock.monotonic()
+        timeout = min(timeout, max(0, fadeTimeout))
 
     try:
-        cmdDill = _state.cmdq.get(True, TIMERTICK_UNIT)
-        cmdFun, params = dill.loads(cmdDill)
-        cmdFun(*params)
-    except queue.Empty:
-        pass
+        cmdDill = next_command(timeout)
+        if cmdDill is not None:
+            cmdFun, params = dill.loads(cmdDill)
+            cmdFun(*params)
     except (KeyboardInterrupt, SystemExit):
         return
+    _state.wakeups += 1
+    if _state.settledTimestamp is None:
+        checkSettled()
+    if updateDeepIdle():
+        return
     timer_tick()
 
 
+def next_command(timeout):
+    global _state
+
+    # take everything queued so far, so a wake up gets handled before
+    # commands that were queued ahead of it. Only wait for more if there
+    # is nothing left to handle
+    cmdLanes = _state.cmdLanes
+    try:
+        while True:
+            if not cmdLanes.add(_state.cmdq.get_nowait()):
+                logger.error("command lanes are full: dropped a command")
+    except queue.Empty:
+        pass
+    if not cmdLanes:
+        try:
+            cmdLanes.add(_state.clock.get(_state.cmdq, timeout))
+        except queue.Empty:
+            return None
+    return cmdLanes.pop()
+
+
+def checkSettled():
+    global _state
+
+    # the display is settled once it shows the brightness the room calls
+    # for, which is what a restart should get to as quickly as possible
+    if not _state.luxApplied or _state.stayOnCurrentBrightnessDeadline is not None:
+        return
+    if _state.currentBrightness != _state.wantedBrightness:
+        return
+    _state.settledTimestamp = _state.clock.monotonic()
+    logger.info(
+        "display settled {:.2f}s after start ({})".format(
+            _state.settledTimestamp - _state.startTime,
+            "snapshot restored" if _state.restoredSnapshot else "no snapshot",
+        )
+    )
+
+
+def updateDeepIdle():
+    global _state
+
+    deepIdle = (
+        _state.currentBrightness == const.scr_brightnessOff
+        and _state.wantedBrightness == const.scr_brightnessOff
+        and _state.stayOnCurrentBrightnessDeadline is None
+        and not _state.animating
+    )
+    if deepIdle == _state.deepIdle:
+        return deepIdle
+
+    now = _state.clock.monotonic()
+    if deepIdle:
+        logger.info("entering deep idle")
+    else:
+        idleSeconds = now - _state.deepIdleTimestamp
+        wakeupsPerHour = _state.wakeups * 3600 / max(1, idleSeconds)
+        logger.info(
+            "leaving deep idle after {:.0f} seconds: {} wakeups ({:.1f}/hour)".format(
+                idleSeconds, _state.wakeups, wakeupsPerHour
+            )
+        )
+    _state.deepIdle = deepIdle
+    _state.deepIdleTimestamp = now
+    _state.wakeups = 0
+    _notifyEvent(events.ScreenDeepIdle(deepIdle, _this_module()))
+    return deepIdle
+
+
+def animationTimeout():
+    global _state
+
+    # how long the render thread can wait for a snapshot. None means forever
+    if not _state.animating:
+        return None
+    return max(0, _state.nextFrameTime - time.monotonic())
+
+
+def animation_tick(snapshot):
+    global _state
+
+    now = time.monotonic()
+    if now < _state.nextFrameTime:
+        return
+    framePeriod = 1.0 / const.scr_animationFps
+    droppedFrames = int((now - _state.nextFrameTime) / framePeriod)
+    _state.nextFrameTime += (droppedFrames + 1) * framePeriod
+
+    stats = _state.frameStats
+    cpuStart = time.thread_time()
+    renderFrame(snapshot)
+    stats.cpuTime += time.thread_time() - cpuStart
+    stats.frames += 1
+    stats.droppedFrames += droppedFrames
+    stats.pixelWrites += _state.compositor.lastPixelWrites
+    if now - stats.startTime >= const.scr_animationStatsPeriodInSeconds:
+        logger.info("animation: {}".format(stats))
+        _state.frameStats = FrameStats()
+
+
+def setAnimating(animating):
+    global _state
+
+    if animating == _state.animating:
+        return
+    _state.animating = animating
+    if animating:
+        _state.frameStats = FrameStats()
+        _state.nextFrameTime = time.monotonic()
+        logger.debug("animation started")
+    else:
+        logger.info("animation stopped: {}".format(_state.frameStats))
+
+
 def timer_tick_always():
     adjustBrightness()
 
 
 def timer_tick_250ms():
     # drawLineAnimation()
-    updateMotionPixel()
     pass
 
 
@@ -175,8 +675,7 @@ def timer_tick_500ms():
 
 
 def timer_tick_1sec():
-    updateOutsideTemperatureAgeInSeconds()
-    updateBrightnessTimeoutInSeconds()
+    checkBrightnessTimeout()
     pass
 
 
@@ -190,10 +689,10 @@ def timer_tick_1min():
 
 
 class TimerTickService(object):
-    def __init__(self, intervalInMilliseconds, fun, now=datetime.now()):
+    def __init__(self, intervalInMilliseconds, fun):
         self.intervalInMilliseconds = intervalInMilliseconds
         self.fun = fun
-        self.nextExpiration = datetime.now() + timedelta(
+        self.nextExpiration = _state.clock.now() + timedelta(
             0, 0, intervalInMilliseconds * 1000
         )
 
@@ -214,7 +713,7 @@ def timer_tick():
 
     timer_tick_always()
     for timer_tick_service in _state.timer_tick_services:
-        now = datetime.now()
+        now = _state.clock.now()
         if timer_tick_service.nextExpiration <= now:
             timer_tick_service.fun()
             timer_tick_service.nextExpiration = now + timedelta(
@@ -231,6 +730,11 @@ def adjustBrightness():
     # if brightness is already where we want it to be, we are done
     if _state.currentBrightness == _state.wantedBrightness:
         return
+    # fades are paced here, since drawClock no longer waits for vsync
+    now = _state.clock.monotonic()
+    if now < _state.nextFadeStepTime:
+        return
+    _state.nextFadeStepTime = now + 1.0 / const.scr_fadeStepsPerSecond
 
     brightIncr = {True: -1}.get(_state.wantedBrightness < _state.currentBrightness, 1)
     _state.currentBrightness += brightIncr
@@ -243,32 +747,26 @@ def adjustBrightness():
         # Reaching target also has side effect of forcing a draw of the clock face
         if _state.currentBrightness:
             drawClock()
-    else:
-        # queue an event to self, so we are not bound to wait for TIMERTICK_UNIT timeout.
-        # Note that this will cause timer_tick to be called twice in do_iterate(). No biggie.
-        if _state.cmdq.empty():
-            _enqueue_cmd((timer_tick, []))
+        _notifyEvent(events.ScreenBrightness(_state.currentBrightness, _this_module()))
+    # while not there yet, do_iterate wakes up in time for the next step
 
 
-def updateOutsideTemperatureAgeInSeconds():
-    global _state
-    if (
-        _state.cachedOutsideTemperatureAgeInSeconds
-        < MAX_OUTSIDE_TEMPERATURE_AGE_IN_SECONDS
-    ):
-        _state.cachedOutsideTemperatureAgeInSeconds += 1
+def outsideTemperatureAgeInSeconds(timestamp):
+    if timestamp is None:
+        return MAX_OUTSIDE_TEMPERATURE_AGE_IN_SECONDS
+    return _state.clock.monotonic() - timestamp
 
 
-def updateBrightnessTimeoutInSeconds():
+def checkBrightnessTimeout():
     global _state
-    if _state.stayOnCurrentBrightnessTimeout > 0:
-        _state.stayOnCurrentBrightnessTimeout -= 1
-        if _state.stayOnCurrentBrightnessTimeout != 0:
-            return
-        # update wanted brightness to what lux has determined it to be?
-        if _state.useLuxToDetermineBrightness:
-            _notifyEventLuxUpdateRequest()
-        logger.info("stayOnCurrentBrightnessTimeout is now zero")
+    deadline = _state.stayOnCurrentBrightnessDeadline
+    if deadline is None or _state.clock.monotonic() < deadline:
+        return
+    _state.stayOnCurrentBrightnessDeadline = None
+    # update wanted brightness to what lux has determined it to be?
+    if _state.useLuxToDetermineBrightness:
+        _notifyEventLuxUpdateRequest()
+    logger.info("stayOnCurrentBrightnessDeadline reached")
 
 
 def checkForDisplayWakeup(prevProximity, currProximity):
@@ -277,35 +775,31 @@ def checkForDisplayWakeup(prevProximity, currProximity):
     if currProximity < prevProximity:
         return
 
-    _state.stayOnCurrentBrightnessTimeout = const.scr_wakeupTimeoutInSeconds
+    _state.stayOnCurrentBrightnessDeadline = (
+        _state.clock.monotonic() + const.scr_wakeupTimeoutInSeconds
+    )
     jumpstartCurrentBrightness = int(const.scr_brightnessMaxValue / 6)
     _state.currentBrightness = max(jumpstartCurrentBrightness, _state.currentBrightness)
     _state.wantedBrightness = const.scr_brightnessMaxValue
+    # take the first step right away, regardless of fade pacing
+    _state.nextFadeStepTime = 0
     adjustBrightness()
     logger.info("woke screen up")
 
 
-def updateMotionPixel(canvas=None):
+def updateMotionPixel(snapshot):
     global _state
 
-    if canvas is None:
-        canvas = _state.matrix
-    data = _state.timer_tick_data
-
-    # turn motion detected pixel on/off
-    # if it was already off and it is still off, this is a noop
-    # it is possible canvas has been cleared, so if it is supposed to be
-    # on, make it so every time
-    currMotionPixelIsTurnedOn = data.get("motionPixelIsTurnedOn", True)
-    newMotionPixelIsTurnedOn = _state.cachedProximity != 0
-    if newMotionPixelIsTurnedOn or currMotionPixelIsTurnedOn:
-        r, g, b = 0, 0, {True: 123}.get(newMotionPixelIsTurnedOn, 0)
-        canvas.SetPixel(canvas.width - 1, canvas.height - 1, r, g, b)
-        data["motionPixelIsTurnedOn"] = newMotionPixelIsTurnedOn
+    # turn motion detected pixel on/off. Returns True if a redraw is needed
+    motionColor = None
+    if snapshot.cachedProximity != 0:
+        motionColor = getColor("motionBlue")
+    dirty = _state.widgets["motion"].update(motionColor)
 
     # draw a dot to indicate that stay on in dark is turned on
-    if _state.stayOnInDarkRoom:
-        canvas.SetPixel(0, 0, *getColorRGB("white"))
+    stayOnColor = getColorRGB("white") if snapshot.stayOnInDarkRoom else None
+    dirty |= _state.widgets["stayOn"].update(stayOnColor)
+    return dirty
 
 
 def drawLineAnimation(canvas=None, counterIncr=1):
@@ -317,11 +811,12 @@ def drawLineAnimation(canvas=None, counterIncr=1):
 
     drawLineAnimationCounter = data.get("drawLineAnimationCounter", 1)
     data["drawLineAnimationCounter"] = drawLineAnimationCounter + counterIncr
-    red = data.get("red")
+    red = graphics.Color(*getColor("red"))
 
     if drawLineAnimationCounter >= canvas.height:
         data["drawLineAnimationCounter"] = 0
-        graphics.DrawLine(canvas, 0, 0, 0, canvas.height, data.get("black"))
+        black = graphics.Color(*getColor("black"))
+        graphics.DrawLine(canvas, 0, 0, 0, canvas.height, black)
     else:
         graphics.DrawLine(
             canvas, 0, 0, 0, drawLineAnimationCounter % canvas.height, red
@@ -331,109 +826,179 @@ def drawLineAnimation(canvas=None, counterIncr=1):
 def drawClock():
     global _state
 
-    # try to avoid memleak by reusing previous frame canvas
+    # hand a snapshot of the state over to the render thread. If it is
+    # still busy with an older one, that one gets replaced
+    _state.renderWorker.submit(RenderSnapshot(_state))
+
+
+def renderFrame(snapshot):
+    global _state
+
+    updatePalette(snapshot)
+
+    # try to avoid memleak by reusing previous frame canvas. It is not
+    # cleared: the compositor only writes the pixels that changed since
+    # this canvas was last drawn
     data = _state.timer_tick_data
     canvas = data.get("previousFrameCanvas")
     if canvas is None:
         canvas = _state.matrix.CreateFrameCanvas()
-    else:
-        # re-use, recycle
-        canvas.Clear()
-    if _state.currentBrightness != const.scr_brightnessOff:
-        _drawClock2(canvas, data, _state)
-        _drawTemperature(canvas, data, _state)
-        _drawDisplayMessage(canvas, data, _state)
+    if snapshot.currentBrightness != const.scr_brightnessOff:
+        canvas.brightness = snapshot.currentBrightness
+        _drawClock2(snapshot)
+        _drawTemperature(snapshot)
+        _drawDisplayMessage(snapshot)
     else:
         canvas.brightness = const.scr_brightnessMinValue
-    updateMotionPixel(canvas)
+        for name in ["clock", "weekday", "date", "temperature", "message"]:
+            _state.widgets[name].hide()
+        setAnimating(False)
+    updatePwmBits(canvas)
+    updateMotionPixel(snapshot)
+    compositor = _state.compositor
+    pixelWrites = compositor.draw(canvas)
+    # while animating, frame stats get reported by animation_tick
+    if not _state.animating:
+        logger.debug(
+            "frame {} pixel writes: {} (total {}), {} snapshots dropped".format(
+                compositor.frames,
+                pixelWrites,
+                compositor.totalPixelWrites,
+                _state.renderWorker.dropped if _state.renderWorker else 0,
+            )
+        )
+    mirror = _state.mirror
+    if mirror is not None:
+        mirror.offer(compositor.frame, canvas.brightness)
+        if _state.clock.virtual:
+            payload = mirror.poll(_state.clock.monotonic())
+            if payload is not None:
+                _notifyEventFrameMirror(payload)
     data["previousFrameCanvas"] = _state.matrix.SwapOnVSync(canvas)
 
 
-def _drawClock2(canvas, data, _state):
-    font0 = _state.fonts[0]
-    font1 = _state.fonts[1]
-    green = data.get("green")
-    blue = data.get("blue")
-    red = data.get("red")
-
-    canvas.brightness = _state.currentBrightness
-
-    # baseline y axis position can be between 13 and 44
-    baseClockPosY = data.get("baseClockPosY", 28)
+def _drawClock2(snapshot):
+    green = getColor("green")
+    blue = getColor("blue")
+    red = getColor("red")
 
     # datetime format. Ref: http://strftime.org/  and https://pymotw.com/2/datetime/
-    now = datetime.now()
+    now = snapshot.clock.now()
     # remove '0' pad from hour's format
     clock = now.strftime("%-I:%M")
     amPm = now.strftime("%p").lower()
     clockColor, dateColor = {"am": (green, red), "pm": (red, green)}.get(
         amPm, (blue, blue)
     )
-    posX = getCenterPosX(canvas, font0, clock)
-    # canvas, font, x, y, color, text
-    graphics.DrawText(canvas, font0, posX, baseClockPosY, clockColor, clock)
+    snapshot.widgets["clock"].update(clock, clockColor)
 
     # Weekday
     weekday = now.strftime("%A")
-    posX = getCenterPosX(canvas, font1, weekday)
-    graphics.DrawText(canvas, font1, posX, baseClockPosY + 9, blue, weekday)
+    snapshot.widgets["weekday"].update(weekday, blue)
 
     # Date
     cal = now.strftime("%-d / %b")
-    posX = getCenterPosX(canvas, font1, cal)
-    graphics.DrawText(canvas, font1, posX, baseClockPosY + 18, dateColor, cal)
+    snapshot.widgets["date"].update(cal, dateColor)
 
 
-def _drawTemperature(canvas, data, _state):
-    if not _state.cachedOutsideTemperature:
+def _drawTemperature(snapshot):
+    widget = snapshot.widgets["temperature"]
+    if not snapshot.cachedOutsideTemperature:
+        widget.hide()
         return
-    if (
-        _state.cachedOutsideTemperatureAgeInSeconds
-        >= MAX_OUTSIDE_TEMPERATURE_AGE_IN_SECONDS
-    ):
+    age = outsideTemperatureAgeInSeconds(snapshot.cachedOutsideTemperatureTimestamp)
+    if age >= MAX_OUTSIDE_TEMPERATURE_AGE_IN_SECONDS:
+        widget.hide()
         return
-    _drawTemperature2(canvas, data, _state)
+    _drawTemperature2(snapshot)
 
 
-def _drawTemperature2(canvas, data, _state):
-    font = _state.fonts[2]
-    color = data.get("yellow")
-    temperature = "{}F".format(_state.cachedOutsideTemperature)
-    posX = 1
-    # posY = 6
-    posY = canvas.height - 1
-    # canvas, font, x, y, color, text
-    graphics.DrawText(canvas, font, posX, posY, color, temperature)
+def _drawTemperature2(snapshot):
+    color = getColor("yellow")
+    temperature = "{}F".format(snapshot.cachedOutsideTemperature)
+    snapshot.widgets["temperature"].update(temperature, color)
 
 
-def _drawDisplayMessage(canvas, data, _state):
-    if not _state.displayMessage:
+def _drawDisplayMessage(snapshot):
+    widget = snapshot.widgets["message"]
+    if not snapshot.displayMessage:
+        widget.hide()
+        setAnimating(False)
         return
-    font = _state.fonts[2]
-    color = data.get("white")
-    # posX = 0
-    posX = getCenterPosX(canvas, font, _state.displayMessage)
-    posY = 7
-    # canvas, font, x, y, color, text
-    graphics.DrawText(canvas, font, posX, posY, color, _state.displayMessage)
+    color = getColor("white")
+    # long messages scroll as a marquee, instead of getting cut off
+    offset = 0
+    scrolls = const.scr_marqueeEnabled and widget.scrolls(snapshot.displayMessage)
+    if scrolls:
+        elapsed = snapshot.clock.monotonic() - snapshot.displayMessageTimestamp
+        offset = int(elapsed * const.scr_marqueePixelsPerSecond)
+    widget.update(snapshot.displayMessage, color, offset)
+    setAnimating(scrolls)
 
 
-def getCenterPosX(canvas, font, msg):
-    numberOfChars = len(msg)
-    pixelsUsed = numberOfChars * font.CharacterWidth(0)
-    if pixelsUsed >= canvas.width:
-        return 0
-    return int((canvas.width - pixelsUsed) / 2)
+def pwmBitsForBrightness(brightness):
+    for brightnessBelow, pwmBits in const.scr_pwmBitsPolicy:
+        if brightness < brightnessBelow:
+            return pwmBits
+    return const.scr_led_pwm_bits
 
 
-# =============================================================================
+def updatePwmBits(canvas):
+    global _state
+
+    # at low brightness, most pwm bits buy nothing, yet the refresh thread
+    # spends time on each of them. Each frame buffer has its own setting, so
+    # this is applied to every canvas as it gets drawn
+    pwmBits = pwmBitsForBrightness(canvas.brightness)
+    if canvas.pwmBits != pwmBits:
+        canvas.pwmBits = pwmBits
+
+    stats = _state.pwmBitsStats
+    if pwmBits == stats.pwmBits:
+        return
+    logger.info("pwm bits changing to {}. {}".format(pwmBits, stats))
+    _state.pwmBitsStats = PwmBitsStats(pwmBits)
+
+
+def updatePalette(snapshot):
+    global _state
+
+    # the whole frame is drawn using the colors in the palette, so applying
+    # the color transform luts to the palette is the same as applying them
+    # to every pixel of the frame. Palettes are cached per transform key
+    key = colorxform.xform_key(
+        _state.clock.now(), snapshot.cachedLux, snapshot.currentBrightness
+    )
+    if key == _state.colorXformKey:
+        return
+    palette = _state.palettes.get(key)
+    if palette is None:
+        luts = colorxform.build_luts(*key)
+        palette = {
+            name: colorxform.transform_rgb(luts, rgb)
+            for name, rgb in BASE_COLORS.items()
+        }
+        _state.palettes[key] = palette
+    logger.debug(
+        "color transform changed from {} to {}".format(_state.colorXformKey, key)
+    )
+    _state.colorXformKey = key
+    _state.palette = palette
 
 
-def _enqueue_cmd(l):
+def getColor(name):
     global _state
-    lDill = dill.dumps(l)
+    return _state.palette.get(name)
+
+
+# =============================================================================
+
+
+def _enqueue_cmd(l, tag=CMD_TAG_OTHER):
+    global _cmdq
+    lDill = tag + dill.dumps(l)
     try:
-        _state.cmdq.put_nowait(lDill)
+        _cmdq.put_nowait(lDill)
     except queue.Full:
         logger.error("command queue is full: cannot add")
         return False
@@ -452,6 +1017,8 @@ def _do_handle_screen_stays_on(enable):
     stayOnInDarkRoomFun = lambda x: True if x else False
     _state.stayOnInDarkRoom = stayOnInDarkRoomFun(enable)
     logger.info("stay on in dark room is now {}".format(_state.stayOnInDarkRoom))
+    saveSnapshot()
+    drawClock()
     # update wanted brightness to what lux has determined it to be?
     if _state.useLuxToDetermineBrightness:
         _notifyEventLuxUpdateRequest()
@@ -467,7 +1034,9 @@ def do_handle_display_message(message):
 def _do_handle_display_message(message):
     global _state
     _state.displayMessage = message
+    _state.displayMessageTimestamp = _state.clock.monotonic()
     logger.info("screen display message is now '{}'".format(_state.displayMessage))
+    saveSnapshot()
     drawClock()
 
 
@@ -475,7 +1044,7 @@ def _do_handle_display_message(message):
 def do_handle_motion_proximity(currProximity=0):
     logger.debug("queuing motion_proximity {}".format(currProximity))
     params = [currProximity]
-    return _enqueue_cmd((_do_handle_motion_proximity, params))
+    return _enqueue_cmd((_do_handle_motion_proximity, params), CMD_TAG_WAKE)
 
 
 def _do_handle_motion_proximity(currProximity):
@@ -486,17 +1055,22 @@ def _do_handle_motion_proximity(currProximity):
     )
     _state.cachedProximity = currProximity
     checkForDisplayWakeup(prevProximity, currProximity)
+    # motion pixel: do not wait for a timer tick, which may not come while in
+    # deep idle
+    if bool(prevProximity) != bool(currProximity):
+        drawClock()
 
 
 # called from outside this module
 def do_handle_motion_lux(currLux=0):
     logger.debug("queuing motion_lux {}".format(currLux))
     params = [currLux]
-    return _enqueue_cmd((_do_handle_motion_lux, params))
+    return _enqueue_cmd((_do_handle_motion_lux, params), CMD_TAG_LUX)
 
 
 def _do_handle_motion_lux(currLux):
     global _state
+    _state.cachedLux = currLux
     # map lux values into a percentage. The brighter the room, the more
     # intensity we will need for the matrix display
     currNormalizedLux = normalizedLux(currLux, _state.stayOnInDarkRoom)
@@ -516,9 +1090,11 @@ def _do_handle_motion_lux(currLux):
 
     if (
         _state.useLuxToDetermineBrightness
-        and _state.stayOnCurrentBrightnessTimeout == 0
+        and _state.stayOnCurrentBrightnessDeadline is None
     ):
         _state.wantedBrightness = _state.cachedNormalizedLux
+        _state.luxApplied = True
+    saveSnapshot()
 
 
 def normalizedLux(rawLux, stayOnInDarkRoom):
@@ -537,14 +1113,36 @@ def normalizedLux(rawLux, stayOnInDarkRoom):
 def do_handle_outside_temperature(temperature):
     # logger.debug("queuing outside temperature {}".format(temperature))
     params = [temperature]
-    return _enqueue_cmd((_do_handle_outside_temperature, params))
+    return _enqueue_cmd((_do_handle_outside_temperature, params), CMD_TAG_TEMPERATURE)
 
 
 def _do_handle_outside_temperature(temperature):
     global _state
     _state.cachedOutsideTemperature = temperature
-    _state.cachedOutsideTemperatureAgeInSeconds = 0
+    _state.cachedOutsideTemperatureTimestamp = _state.clock.monotonic()
     logger.debug("outside temperature updated to {}".format(temperature))
+    saveSnapshot()
+
+
+# called from outside this module
+def do_profile(kind, seconds):
+    logger.debug("queuing {} profile for {} seconds".format(kind, seconds))
+    params = [kind, seconds]
+    return _enqueue_cmd((profiler.do_profile_start, params))
+
+
+# called from outside this module
+def do_apply_config(configSnapshot):
+    logger.debug("queuing config version {}".format(configSnapshot.version))
+    params = [configSnapshot]
+    return _enqueue_cmd((_do_apply_config, params))
+
+
+def _do_apply_config(configSnapshot):
+    global _state
+    # the render thread reads const too, so it does the applying
+    _state.renderWorker.apply_config(configSnapshot)
+    _notifyEvent(events.ConfigApplied(configSnapshot.version, _this_module()))
 
 
 # =============================================================================
@@ -553,9 +1151,8 @@ def _do_handle_outside_temperature(temperature):
 def getColorRGB(color):
     global _state
     if isinstance(color, str):
-        data = _state.timer_tick_data
-        color = data.get("yellow")
-    return (color.red, color.green, color.blue)
+        color = getColor("yellow")
+    return tuple(color)
 
 
 # =============================================================================
@@ -577,6 +1174,7 @@ logger = log.getLogger()
 if __name__ == "__main__":
     log.initLogger()
     do_init(None)
+    profiler.do_init("screen")
     signal.signal(signal.SIGINT, _signal_handler)
     while not stop_trigger:
         do_iterate()
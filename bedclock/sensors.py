@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+# The APDS9960 sensors motion polls, e.g. one on each side of the bed. Each
+# sensor has a schedule of its own for lux and proximity reads, plus its
+# own proximity threshold and lux scale, since no two spots see the same
+# light. Reads happen in a small thread pool, so a slow sensor does not
+# hold up the others, while a lock per i2c bus keeps reads of sensors on
+# the same bus (say, behind a TCA9548A mux) from stepping on each other.
+# Readings get fused: lux is the average of what the sensors see and
+# proximity the highest, so reaching for either side wakes the clock up.
+
+import collections
+from concurrent import futures
+import time
+
+from bedclock import const
+
+# read latencies kept per sensor, for stats()
+LATENCY_SAMPLES = 1024
+# what reading a sensor may raise, other than a bug. i2c errors are OSError
+READ_ERRORS = (OSError, RuntimeError, ValueError)
+
+
+class Sensor(object):
+    def __init__(
+        self,
+        name,
+        device,
+        busLock,
+        luxSeconds=0,
+        proximitySeconds=0,
+        proximityMinThreshold=0,
+        luxScale=1.0,
+    ):
+        self.name = name
+        self.device = device  # an APDS9960, or anything that looks like one
+        self.busLock = busLock  # shared by all sensors on the same bus
+        self.luxSeconds = luxSeconds
+        self.proximitySeconds = proximitySeconds
+        self.proximityMinThreshold = proximityMinThreshold
+        self.luxScale = luxScale
+        # latest readings, None until the first one
+        self.lux = None
+        self.proximity = None
+        self.rawProximity = None
+        self.nextLuxTime = 0
+        self.nextProximityTime = 0
+        self.busy = False  # a read is in the pool
+        # stats
+        self.reads = 0
+        self.errors = 0
+        self.consecutiveErrors = 0
+        self.lastError = None
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def read(self, now, wantLux, wantProximity, luxFun):
+        """Read what is due. Returns (read lux, read proximity) as bools."""
+        # the latency of this read alone, waiting for the bus included, but
+        # not for a pool thread or for the sensors read before this one
+        start = time.perf_counter()
+        readLux = readProximity = False
+        try:
+            with self.busLock:
+                if wantLux and now >= self.nextLuxTime and self.device.color_data_ready:
+                    r, g, b, _c = self.device.color_data
+                    self.lux = max(0, luxFun(r, g, b) * self.luxScale)
+                    self.nextLuxTime = now + self.luxSeconds
+                    readLux = True
+                if wantProximity and now >= self.nextProximityTime:
+                    self.rawProximity = self.device.proximity
+                    self.proximity = self.rawProximity
+                    if self.proximity < self.proximityMinThreshold:
+                        self.proximity = 0
+                    self.nextProximityTime = now + self.proximitySeconds
+                    readProximity = True
+        except READ_ERRORS as e:
+            self.errors += 1
+            self.consecutiveErrors += 1
+            self.lastError = e
+            return readLux, readProximity
+        finally:
+            self.busy = False
+        if readLux or readProximity:
+            self.consecutiveErrors = 0
+            self.reads += 1
+            self.latencies.append(time.perf_counter() - start)
+        return readLux, readProximity
+
+
+def from_config(config, index, device, busLock):
+    """Sensor for an entry of const.motion_sensors."""
+    return Sensor(
+        config.get("name", "sensor{}".format(index)),
+        device,
+        busLock,
+        config.get("lux_seconds", 0),
+        config.get("proximity_seconds", 0),
+        config.get("proximity_min_threshold", const.motion_proximityMinThreshold),
+        config.get("lux_scale", 1.0),
+    )
+
+
+Readings = collections.namedtuple("Readings", "lux proximity rawProximity errors")
+
+
+class SensorArray(object):
+    """Polls sensors, in a pool of threads or, with no threads, in the
+    caller's thread (as needed with a virtual clock).
+    """
+
+    def __init__(self, sensors, luxFun, threads=0):
+        self.sensors = list(sensors)
+        self.luxFun = luxFun
+        self.pool = None
+        if threads and len(self.sensors) > 1:
+            self.pool = futures.ThreadPoolExecutor(threads, "sensor")
+
+    def poll(self, now, wantLux, wantProximity, timeout=None):
+        """Read the sensors that are due, waiting up to timeout seconds for
+        them. Returns Readings, where lux and proximity are fused from all
+        sensors, or None when no sensor read them this time. Errors are
+        (sensor, exception) of the reads that failed.
+        """
+        readLux = readProximity = False
+        errors = []
+        pending = []
+        for sensor in self.sensors:
+            if sensor.busy:
+                continue  # still at it, since a previous poll
+            args = (now, wantLux, wantProximity, self.luxFun)
+            errorCount = sensor.errors
+            if self.pool is None:
+                read = sensor.read(*args)
+                readLux, readProximity = readLux or read[0], readProximity or read[1]
+                if sensor.errors != errorCount:
+                    errors.append((sensor, sensor.lastError))
+                continue
+            sensor.busy = True
+            pending.append((sensor, errorCount, self.pool.submit(sensor.read, *args)))
+        if pending:
+            futures.wait([f for _, _, f in pending], timeout)
+        for sensor, errorCount, future in pending:
+            if not future.done():
+                continue  # its readings get used by a later poll
+            read = future.result()
+            readLux, readProximity = readLux or read[0], readProximity or read[1]
+            if sensor.errors != errorCount:
+                errors.append((sensor, sensor.lastError))
+        stale = const.motion_sensor_stale_errors
+        if any(sensor.consecutiveErrors == stale for sensor, _ in errors):
+            # what a sensor that just went stale saw no longer counts. With
+            # no other sensor seeing anything, nobody is near
+            readProximity = True
+        return Readings(
+            self.fused_lux() if readLux else None,
+            (self.fused_proximity() or 0) if readProximity else None,
+            (self.raw_proximity() or 0) if readProximity else None,
+            errors,
+        )
+
+    def _fresh(self):
+        # sensors whose latest readings can still be trusted
+        return [
+            s
+            for s in self.sensors
+            if s.consecutiveErrors < const.motion_sensor_stale_errors
+        ]
+
+    def failing(self):
+        """True when every sensor failed its last motion_sensor_reinit_errors
+        reads.
+        """
+        return all(
+            s.consecutiveErrors >= const.motion_sensor_reinit_errors
+            for s in self.sensors
+        )
+
+    def fused_lux(self):
+        values = [s.lux for s in self._fresh() if s.lux is not None]
+        return sum(values) / len(values) if values else None
+
+    def fused_proximity(self):
+        values = [s.proximity for s in self._fresh() if s.proximity is not None]
+        return max(values) if values else None
+
+    def raw_proximity(self):
+        values = [s.rawProximity for s in self._fresh() if s.rawProximity is not None]
+        return max(values) if values else None
+
+    def stats(self):
+        stats = {}
+        for sensor in self.sensors:
+            latencies = sorted(sensor.latencies)
+            pick = lambda pct: latencies[int(len(latencies) * pct)] * 1000
+            stats[sensor.name] = {
+                "reads": sensor.reads,
+                "errors": sensor.errors,
+                "p50Ms": pick(0.5) if latencies else None,
+                "p99Ms": pick(0.99) if latencies else None,
+            }
+        return stats
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
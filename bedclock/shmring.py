@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+
+# Transport between main and its children made of single producer, single
+# consumer ring buffers in shared memory, as a cheaper stand-in for
+# multiprocessing.Queue: a put is a copy into a slot and two stores, with no
+# feeder thread, lock or pipe write involved. The consumer only gets a wake
+# up byte through a pipe when it is sleeping, waiting for something to show
+# up.
+#
+# A ring has a single producer process. So every child gets a ring of its
+# own to send events to main (see EventHub), and a command queue (see
+# CommandQueue) where commands from main go through a ring while the ones a
+# child gives itself go through a local queue.
+#
+# Nothing here has memory barriers, which python does not offer. Instead,
+# each slot carries its index and a crc of its payload, so a slot that is
+# not completely visible yet is retried rather than taken. And sleeps are
+# capped at MAX_SLEEP_SECONDS, in case a wake up gets missed because the
+# producer looked at the sleeping flag just before the consumer set it.
+# Ref: https://docs.python.org/3/library/multiprocessing.shared_memory.html
+
+import atexit
+import collections
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import pickle
+import queue
+import struct
+import threading
+import time
+import zlib
+
+POLICY_DROP = "drop"  # a put on a full ring fails with queue.Full
+POLICY_OVERWRITE = "overwrite"  # a put on a full ring replaces the oldest
+POLICIES = (POLICY_DROP, POLICY_OVERWRITE)
+# head, tail and sleeping flag sit in cache lines of their own, since
+# different processes write them
+CACHE_LINE = 64
+HEAD_OFFSET = 0
+TAIL_OFFSET = CACHE_LINE
+SLEEPING_OFFSET = 2 * CACHE_LINE
+# counted by the producer and the consumer, respectively
+DROPPED_OFFSET = 3 * CACHE_LINE
+OVERWRITTEN_OFFSET = DROPPED_OFFSET + 8
+SLOTS_OFFSET = 4 * CACHE_LINE
+INDEX = struct.Struct("<Q")
+FLAG = struct.Struct("<I")
+# index + 1 of the record in the slot (0 while being written), size, crc
+SLOT_HEADER = struct.Struct("<QII")
+MAX_SLEEP_SECONDS = 1.0
+# spinning only pays off when the producer runs on another cpu meanwhile
+SPIN_SECONDS = 0.0002 if (os.cpu_count() or 1) > 1 else 0
+TAKE_RETRIES = 100
+
+
+class Ring(object):
+    """Fixed size slots in shared memory, written by one process and read by
+    one process. Pickles into a handle to the same memory, so it can be
+    handed to a child like a multiprocessing.Queue.
+    """
+
+    def __init__(self, slots, slotSize, policy=POLICY_DROP):
+        if policy not in POLICIES:
+            raise ValueError("unknown ring policy {}".format(policy))
+        self.slots = slots
+        self.slotSize = slotSize
+        self.policy = policy
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=SLOTS_OFFSET + slots * slotSize
+        )
+        # the creator is the one who gets rid of the memory
+        self.creatorPid = os.getpid()
+        atexit.register(self._unlink)
+        self._setup()
+
+    def _setup(self):
+        self.buf = self.shm.buf
+        # producer and consumer keep their own copy of the index they own
+        self.head = INDEX.unpack_from(self.buf, HEAD_OFFSET)[0]
+        self.tail = INDEX.unpack_from(self.buf, TAIL_OFFSET)[0]
+
+    def __getstate__(self):
+        return (self.slots, self.slotSize, self.policy, self.shm, self.creatorPid)
+
+    def __setstate__(self, state):
+        self.slots, self.slotSize, self.policy, self.shm, self.creatorPid = state
+        self._setup()
+
+    def _unlink(self):
+        if os.getpid() != self.creatorPid:
+            return
+        self.buf = None
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except (BufferError, FileNotFoundError):
+            pass
+
+    # -------------------------------------------------------------------------
+    # producer side
+
+    def put(self, data):
+        size = len(data)
+        if size > self.slotSize - SLOT_HEADER.size:
+            raise ValueError(
+                "{} bytes do not fit in a {} byte slot".format(size, self.slotSize)
+            )
+        buf = self.buf
+        head = self.head
+        if head - INDEX.unpack_from(buf, TAIL_OFFSET)[0] >= self.slots:
+            if self.policy == POLICY_DROP:
+                dropped = INDEX.unpack_from(buf, DROPPED_OFFSET)[0]
+                INDEX.pack_into(buf, DROPPED_OFFSET, dropped + 1)
+                raise queue.Full
+        offset = SLOTS_OFFSET + (head % self.slots) * self.slotSize
+        SLOT_HEADER.pack_into(buf, offset, 0, 0, 0)
+        start = offset + SLOT_HEADER.size
+        buf[start:start + size] = data
+        SLOT_HEADER.pack_into(buf, offset, head + 1, size, zlib.crc32(data))
+        self.head = head + 1
+        INDEX.pack_into(buf, HEAD_OFFSET, self.head)
+
+    def consumer_sleeping(self):
+        return FLAG.unpack_from(self.buf, SLEEPING_OFFSET)[0]
+
+    # -------------------------------------------------------------------------
+    # consumer side
+
+    def take(self):
+        """Return the oldest record, or None if there is none (yet)."""
+        buf = self.buf
+        for _ in range(TAKE_RETRIES):
+            head = INDEX.unpack_from(buf, HEAD_OFFSET)[0]
+            tail = self.tail
+            if head == tail:
+                return None
+            if head - tail > self.slots:
+                # the producer went around the ring, overwriting the oldest
+                self._skip(head - self.slots - tail)
+                continue
+            offset = SLOTS_OFFSET + (tail % self.slots) * self.slotSize
+            index, size, crc = SLOT_HEADER.unpack_from(buf, offset)
+            if index > tail + 1:
+                # overwritten while we looked
+                self._skip(1)
+                continue
+            if index == tail + 1:
+                start = offset + SLOT_HEADER.size
+                data = bytes(buf[start:start + size])
+                again = SLOT_HEADER.unpack_from(buf, offset)[0]
+                if again == index and zlib.crc32(data) == crc:
+                    self.tail = tail + 1
+                    INDEX.pack_into(buf, TAIL_OFFSET, self.tail)
+                    return data
+            # the record is not completely visible yet
+            time.sleep(0)
+        return None
+
+    def _skip(self, count):
+        overwritten = INDEX.unpack_from(self.buf, OVERWRITTEN_OFFSET)[0]
+        INDEX.pack_into(self.buf, OVERWRITTEN_OFFSET, overwritten + count)
+        self.tail += count
+        INDEX.pack_into(self.buf, TAIL_OFFSET, self.tail)
+
+    def set_sleeping(self, sleeping):
+        FLAG.pack_into(self.buf, SLEEPING_OFFSET, int(sleeping))
+
+    def pending(self):
+        return INDEX.unpack_from(self.buf, HEAD_OFFSET)[0] - self.tail
+
+    def stats(self):
+        return {
+            "pending": min(self.slots, self.pending()),
+            "dropped": INDEX.unpack_from(self.buf, DROPPED_OFFSET)[0],
+            "overwritten": INDEX.unpack_from(self.buf, OVERWRITTEN_OFFSET)[0],
+        }
+
+
+# =============================================================================
+
+
+class _Waker(object):
+    """Pipe for waking up a consumer, shared by all of its producers."""
+
+    def __init__(self):
+        self.reader, self.writer = multiprocessing.Pipe(duplex=False)
+
+    def wake(self):
+        # small enough for the pipe to keep writes from producers whole
+        self.writer.send_bytes(b"w")
+
+    def wait(self, timeout):
+        if self.reader.poll(timeout):
+            while self.reader.poll():
+                self.reader.recv_bytes()
+
+
+class _Consumer(object):
+    """What EventHub and CommandQueue have in common: get() from a few rings
+    and a local queue, behaving like multiprocessing.Queue.get().
+    """
+
+    def __init__(self):
+        self.rings = []
+        self.waker = _Waker()
+        self.local = collections.deque()
+        self.next = 0
+
+    def _decode(self, data):
+        return data
+
+    def _take(self):
+        if self.local:
+            return self.local.popleft()
+        # start from a different ring each time, so none starves the others
+        rings = self.rings
+        for i in range(len(rings)):
+            ring = rings[(self.next + i) % len(rings)]
+            data = ring.take()
+            if data is not None:
+                self.next = (self.next + i + 1) % len(rings)
+                return self._decode(data)
+        return None
+
+    def _set_sleeping(self, sleeping):
+        for ring in self.rings:
+            ring.set_sleeping(sleeping)
+
+    def get(self, block=True, timeout=None):
+        item = self._take()
+        if item is not None or not block:
+            if item is None:
+                raise queue.Empty
+            return item
+        now = time.monotonic()
+        end = None if timeout is None else now + timeout
+        # a busy producer is likely to put something very soon, which is
+        # cheaper to spin for than to be woken up for
+        spinEnd = now + SPIN_SECONDS
+        while time.monotonic() < spinEnd:
+            item = self._take()
+            if item is not None:
+                return item
+        while True:
+            self._set_sleeping(True)
+            # look again, since a put may have missed the flag
+            item = self._take()
+            if item is None:
+                remaining = MAX_SLEEP_SECONDS
+                if end is not None:
+                    remaining = min(remaining, end - time.monotonic())
+                if remaining > 0:
+                    self.waker.wait(remaining)
+                item = self._take()
+            self._set_sleeping(False)
+            if item is not None:
+                return item
+            if end is not None and time.monotonic() >= end:
+                raise queue.Empty
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def empty(self):
+        return not self.local and not any(r.pending() for r in self.rings)
+
+    def stats(self):
+        return {"ring{}".format(i): r.stats() for i, r in enumerate(self.rings)}
+
+
+class _Producer(object):
+    def __init__(self, ring, waker, encode):
+        self.ring = ring
+        self.waker = waker
+        self.encode = encode
+        # threads of the producer process take turns
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        return (self.ring, self.waker, self.encode)
+
+    def __setstate__(self, state):
+        self.ring, self.waker, self.encode = state
+        self.lock = threading.Lock()
+
+    def put_nowait(self, item):
+        data = self.encode(item)
+        with self.lock:
+            self.ring.put(data)
+            if self.ring.consumer_sleeping():
+                self.waker.wake()
+
+
+class EventHub(_Consumer):
+    """Where main gets events from. Each producer process sends its events
+    through a ring of its own, made by producer().
+    """
+
+    def __init__(self, slots, slotSize):
+        _Consumer.__init__(self)
+        self.slotsPerRing = slots
+        self.slotSize = slotSize
+
+    def producer(self, policy=POLICY_DROP):
+        ring = Ring(self.slotsPerRing, self.slotSize, policy)
+        self.rings.append(ring)
+        return _Producer(ring, self.waker, _pickle)
+
+    def _decode(self, data):
+        return pickle.loads(data)
+
+
+class CommandQueue(_Consumer):
+    """Command queue of a child, holding bytes. Puts from the process that
+    made it (main) go through a ring, and puts from any other process (the
+    child itself) through a local queue.
+    """
+
+    def __init__(self, slots, slotSize, policy=POLICY_DROP):
+        _Consumer.__init__(self)
+        self.maxLocal = slots
+        self.creatorPid = os.getpid()
+        ring = Ring(slots, slotSize, policy)
+        self.rings.append(ring)
+        self.producer = _Producer(ring, self.waker, bytes)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["local"] = collections.deque()
+        return state
+
+    def put_nowait(self, item):
+        if os.getpid() == self.creatorPid:
+            self.producer.put_nowait(item)
+            return
+        # deque appends are thread safe and consumer is in this process,
+        # so it only needs waking if it is waiting on the pipe
+        if len(self.local) >= self.maxLocal:
+            raise queue.Full
+        self.local.append(item)
+        if self.rings[0].consumer_sleeping():
+            self.waker.wake()
+
+
+def _pickle(item):
+    return pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+
+# Stand-ins for the hardware, so bedclock modules can be exercised on a
+# machine that has no led matrix attached. See bench.py
+
+import collections
+import contextlib
+import queue
+import threading
+import time
+
+from bedclock import bdf
+from bedclock import clocks
+from bedclock import const
+from bedclock import layout
+from bedclock import sensors
+
+# font name: (width, height, ascent) of the fonts loaded by screen.init_matrix
+FONT_SIZES = {"10x20": (10, 20, 16), "6x9": (6, 9, 7), "5x8": (5, 8, 7)}
+# how often a paced Simulation looks for commands, while waiting
+PACE_SECONDS = 0.002
+
+
+class FakeCanvas(object):
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.brightness = const.scr_brightnessMaxValue
+        self.pwmBits = const.scr_led_pwm_bits
+        self.pixels = bytearray(width * height * 3)
+        self.pixelWrites = 0
+
+    def Clear(self):
+        self.pixels = bytearray(len(self.pixels))
+
+    def SetPixel(self, x, y, r, g, b):
+        offset = (y * self.width + x) * 3
+        self.pixels[offset:offset + 3] = bytes((r, g, b))
+        self.pixelWrites += 1
+
+
+class FakeMatrix(FakeCanvas):
+    """Matrix where SwapOnVSync takes vsyncSeconds, like waiting on the
+    refresh of a real panel.
+    """
+
+    def __init__(self, width=None, height=None, vsyncSeconds=0.0):
+        size = layout.canvas_size(
+            const.scr_led_rows,
+            const.scr_led_cols,
+            const.scr_led_chain,
+            const.scr_led_parallel,
+            const.scr_pixel_mapper_config,
+        )
+        FakeCanvas.__init__(self, width or size[0], height or size[1])
+        self.vsyncSeconds = vsyncSeconds
+        self.frontCanvas = FakeCanvas(self.width, self.height)
+        self.swaps = 0
+
+    def CreateFrameCanvas(self):
+        return FakeCanvas(self.width, self.height)
+
+    def SwapOnVSync(self, canvas):
+        # canvas becomes the one shown. The one that was shown is handed back
+        # to be drawn into next
+        if self.vsyncSeconds:
+            time.sleep(self.vsyncSeconds)
+        previous, self.frontCanvas = self.frontCanvas, canvas
+        self.swaps += 1
+        return previous
+
+
+def block_font(width, height, ascent):
+    """Font where every glyph is a box, with the metrics of a real font."""
+    font = bdf.Font()
+    font.ascent, font.descent, font.height = ascent, height - ascent, height
+    pixels = []
+    for dy in range(-ascent, height - ascent):
+        for dx in range(width - 1):
+            if dy in (-ascent, height - ascent - 1) or dx in (0, width - 2):
+                pixels.append((dx, dy))
+    for codepoint in list(range(32, 127)) + [bdf.REPLACEMENT_CODEPOINT]:
+        glyphPixels = [] if codepoint == ord(" ") else pixels
+        font.glyphs[codepoint] = bdf.Glyph(width, glyphPixels)
+    return font
+
+
+def screen_fonts():
+    return [block_font(*FONT_SIZES[name]) for name in ["10x20", "6x9", "5x8"]]
+
+
+class FakeMqttInfo(object):
+    def wait_for_publish(self):
+        pass
+
+
+class FakeMqttMessage(object):
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeMqttClient(object):
+    """Stands in for a connected paho client, keeping track of publishes.
+    deliver() plays the broker, handing a message to on_message.
+    """
+
+    def __init__(self):
+        self.publishCounts = collections.Counter()
+        self.publishBytes = collections.Counter()
+        self.lastPublished = {}
+        self.on_message = None
+
+    def deliver(self, topic, payload):
+        if self.on_message:
+            self.on_message(self, None, FakeMqttMessage(topic, payload))
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.publishCounts[topic] += 1
+        if not isinstance(payload, (bytes, str)):
+            payload = str(payload)
+        self.publishBytes[topic] += len(payload)
+        self.lastPublished[topic] = payload
+        return FakeMqttInfo()
+
+    def loop_start(self):
+        pass
+
+
+# lux formula used by adafruit_apds9960.colorutility
+LUX_GREEN_COEFFICIENT = 1.57837
+
+
+class FakeColorUtility(object):
+    @staticmethod
+    def calculate_lux(r, g, b):
+        return (-0.32466 * r) + (LUX_GREEN_COEFFICIENT * g) + (-0.73191 * b)
+
+
+class FakeAPDS(object):
+    """Sensor whose readings come from traces: functions that take a
+    datetime and return lux or proximity. Each read takes readSeconds, like
+    an i2c transaction would.
+    """
+
+    def __init__(self, clock, luxTrace, proximityTrace, readSeconds=0):
+        self.clock = clock
+        self.luxTrace = luxTrace
+        self.proximityTrace = proximityTrace
+        self.readSeconds = readSeconds
+        self.color_data_ready = True
+
+    @property
+    def color_data(self):
+        if self.readSeconds:
+            time.sleep(self.readSeconds)
+        green = int(self.luxTrace(self.clock.now()) / LUX_GREEN_COEFFICIENT)
+        return 0, green, 0, green
+
+    @property
+    def proximity(self):
+        if self.readSeconds:
+            time.sleep(self.readSeconds)
+        return int(self.proximityTrace(self.clock.now()))
+
+
+def daylight_lux(now):
+    # dark at night, lamp in the evening, sun during the day
+    hour = now.hour + now.minute / 60.0
+    if hour < 6.5 or hour >= 22.5:
+        return 1
+    if hour >= 19:
+        return 40
+    return int(2000 * min(1.0, (hour - 6.5) / 3, (19 - hour) / 3)) + 40
+
+
+def restless_proximity(now):
+    # someone reaching for the clock for half a minute, every 90 minutes
+    minutes = now.hour * 60 + now.minute
+    return 30 if minutes % 90 == 0 and now.second < 30 else 0
+
+
+# =============================================================================
+
+
+def _loop(iterateFun):
+    def run():
+        while True:
+            iterateFun()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def sim_screen(vsyncSeconds=0.0, queueEventFun=None):
+    """Run the screen module in a thread, drawing into a FakeMatrix."""
+    from bedclock import screen
+
+    screen.do_init(queueEventFun)
+    screen._state.matrix = FakeMatrix(vsyncSeconds=vsyncSeconds)
+    screen._state.fonts = screen_fonts()
+    _loop(screen.do_iterate)
+    return screen._state
+
+
+def sim_mqttclient(queueEventFun=None):
+    """Run the mqttclient module in a thread, publishing into a
+    FakeMqttClient.
+    """
+    from bedclock import mqttclient
+
+    mqttclient.do_init(queueEventFun)
+    mqttclient._state.mqtt_client = FakeMqttClient()
+    mqttclient._state.mqtt_client.on_message = mqttclient.client_message_callback
+    _loop(mqttclient.do_iterate)
+    return mqttclient._state
+
+
+def sim_motion(queueEventFun=None):
+    """Run commands given to the motion module, without polling a sensor."""
+    from bedclock import motion
+
+    motion.do_init(queueEventFun)
+    _loop(lambda: motion.do_iterate_cmdq(True))
+    return motion._state
+
+
+@contextlib.contextmanager
+def no_persistence():
+    """Keep simulations away from what the real processes persist, and put
+    the knobs for it back as they were on the way out.
+    """
+    saved = const.snapshot_dir, const.ts_dir
+    const.snapshot_dir = None
+    const.ts_dir = None
+    try:
+        yield
+    finally:
+        const.snapshot_dir, const.ts_dir = saved
+
+
+def wait_idle(cmdqs, timeout=10, settleSeconds=0.25):
+    """Wait for the command queues to be empty, then a bit more for the last
+    commands taken to be handled.
+    """
+    end = time.monotonic() + timeout
+    while any(not q.empty() for q in cmdqs) and time.monotonic() < end:
+        time.sleep(0.01)
+    time.sleep(settleSeconds)
+
+
+class Simulation(object):
+    """Motion, screen and mqttclient stepped one iteration at a time on a
+    VirtualClock, with main's event hub in between, all in one thread.
+
+    Each module is stepped when the wait it asked for ends, or as soon as a
+    command shows up for it, so simulated time goes as fast as the modules
+    can run. Use it as a context manager, or call close() when done.
+    """
+
+    def __init__(self, start=None, luxTrace=daylight_lux, proximityTrace=None):
+        from bedclock import main, motion, mqttclient, screen
+
+        self.exitStack = contextlib.ExitStack()
+        self.exitStack.enter_context(no_persistence())
+        self.main = main
+        self.clock = clocks.VirtualClock(start)
+        self.hub = collections.deque()
+        self.eventCounts = collections.Counter()
+
+        motion.do_init(self.hub.append, queue.Queue(motion.CMDQ_SIZE), self.clock)
+        apds = FakeAPDS(self.clock, luxTrace, proximityTrace or restless_proximity)
+        motion._state.sensors = sensors.SensorArray(
+            [sensors.from_config(const.motion_sensors[0], 0, apds, threading.Lock())],
+            FakeColorUtility.calculate_lux,
+        )
+        motion.do_lux_notify_on()
+        motion.do_motion_notify_on()
+        screen.do_init(self.hub.append, queue.Queue(screen.CMDQ_SIZE), self.clock)
+        screen._state.matrix = FakeMatrix()
+        screen._state.fonts = screen_fonts()
+        mqttclient.do_init(
+            self.hub.append, cmdq=queue.Queue(mqttclient.CMDQ_SIZE), clock=self.clock
+        )
+        mqttclient._state.mqtt_client = FakeMqttClient()
+        self.states = {
+            "motion": motion._state,
+            "screen": screen._state,
+            "mqttclient": mqttclient._state,
+        }
+        # [time of next step, iterate function, command queue]
+        self.actors = [
+            [0.0, motion.do_iterate, motion._state.cmdq],
+            [0.0, screen.do_iterate, screen._state.cmdq],
+            [0.0, mqttclient.do_iterate, mqttclient._state.cmdq],
+        ]
+        self.steps = 0
+
+    def close(self):
+        self.exitStack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, seconds, speedup=None):
+        """Run for seconds of simulated time. With a speedup, simulated time
+        is held to that many seconds per wall clock second, e.g. for modules
+        that talk to a real broker (see fleet.py).
+        """
+        clock = self.clock
+        end = clock.t + seconds
+        wallStart = time.monotonic()
+        simStart = clock.t
+        while True:
+            actor = min(self.actors, key=lambda a: a[0])
+            if actor[0] > end:
+                break
+            if speedup and not self._pace(actor[0], simStart, wallStart, speedup):
+                continue  # a command showed up before then
+            clock.advance_to(actor[0])
+            clock.wakeTime = None
+            actor[1]()
+            self.steps += 1
+            # not asking to wait means it has more to do right away
+            actor[0] = clock.t if clock.wakeTime is None else clock.wakeTime
+            while self.hub:
+                event = self.hub.popleft()
+                self.eventCounts[event.name] += 1
+                self.main.trackState(event)
+                self.main.processEvent(event)
+            for a in self.actors:
+                if not a[2].empty():
+                    a[0] = min(a[0], clock.t)
+        if speedup:
+            self._pace(end, simStart, wallStart, speedup)
+        clock.advance_to(end)
+        wallSeconds = time.monotonic() - wallStart
+        return {
+            "simSeconds": seconds,
+            "wallSeconds": wallSeconds,
+            "simSecondsPerWallSecond": seconds / max(wallSeconds, 1e-9),
+            "steps": self.steps,
+        }
+
+    def _pace(self, t, simStart, wallStart, speedup):
+        """Wait for the wall clock to catch up with simulated time t. Returns
+        False if a command shows up first, with the actors it is for due now.
+        """
+        while True:
+            now = simStart + (time.monotonic() - wallStart) * speedup
+            if now >= t:
+                return True
+            pending = [a for a in self.actors if not a[2].empty()]
+            if pending:
+                self.clock.advance_to(now)
+                for a in pending:
+                    a[0] = min(a[0], now)
+                return False
+            time.sleep(min(PACE_SECONDS, (t - now) / speedup))
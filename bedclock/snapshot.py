@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Small json files with the state a process needs to come back up the way it
+# was before a restart. A snapshot is written to a temporary file that then
+# gets renamed over the previous one, so a crash or power cut never leaves a
+# partially written snapshot behind.
+
+import json
+import os
+import threading
+import time
+
+from bedclock import clocks
+from bedclock import const
+from bedclock import log
+from bedclock import safefs
+
+
+# =============================================================================
+
+
+def snapshot_path(name):
+    return os.path.join(const.snapshot_dir, "{}.json".format(name))
+
+
+def write_atomic(path, data):
+    tmpPath = "{}.tmp".format(path)
+    # left behind by a crash
+    try:
+        os.unlink(tmpPath)
+    except FileNotFoundError:
+        pass
+    with os.fdopen(safefs.create_exclusive(tmpPath), "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpPath, path)
+
+
+def load(name):
+    """Return the state last saved by name, or None if there is none to use."""
+    if not const.snapshot_dir:
+        return None
+    path = snapshot_path(name)
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+        savedAt, state = snapshot["savedAt"], snapshot["state"]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("ignoring unreadable snapshot {}: {}".format(path, e))
+        return None
+    age = time.time() - savedAt
+    if not 0 <= age <= const.snapshot_max_age_seconds:
+        logger.info("ignoring {} snapshot saved {:.0f}s ago".format(name, age))
+        return None
+    logger.debug("loaded {} snapshot saved {:.0f}s ago".format(name, age))
+    return state
+
+
+# =============================================================================
+
+
+class Snapshotter(object):
+    """Saves state at most once every debounceSeconds.
+
+    The last state given to save() always makes it to disk, no later than
+    debounceSeconds after it was given. Writes happen in a timer thread, so
+    callers never wait on the filesystem.
+    """
+
+    def __init__(self, name, debounceSeconds=None, clock=None, timer=None):
+        self.name = name
+        # None to follow const.snapshot_debounce_seconds, which a config
+        # reload may change
+        self.debounceSeconds = debounceSeconds
+        self.clock = clock if clock is not None else clocks.RealClock()
+        # called as timer(delay, fun) to get a timer to start
+        self.timerFactory = timer if timer is not None else threading.Timer
+        self.lock = threading.Lock()
+        # held while writing, so writes of two flushes do not cross
+        self.writeLock = threading.Lock()
+        self.pending = None
+        self.savedState = None
+        self.timer = None
+        self.lastWrite = None
+        self.writes = 0
+
+    def save(self, state):
+        if not const.snapshot_dir:
+            return
+        with self.lock:
+            if self.pending is None and state == self.savedState:
+                return
+            self.pending = state
+            if self.timer is not None:
+                return
+            delay = 0
+            if self.lastWrite is not None:
+                debounceSeconds = self.debounceSeconds
+                if debounceSeconds is None:
+                    debounceSeconds = const.snapshot_debounce_seconds
+                nextWrite = self.lastWrite + debounceSeconds
+                delay = max(0, nextWrite - self.clock.monotonic())
+            self.timer = self.timerFactory(delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self.writeLock:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+                state, self.pending = self.pending, None
+                if state is None or state == self.savedState:
+                    return
+            # without holding self.lock, so save() does not wait on the disk
+            path = snapshot_path(self.name)
+            try:
+                safefs.secure_dir(os.path.dirname(path))
+                write_atomic(path, {"savedAt": time.time(), "state": state})
+            except OSError as e:
+                logger.warning("unable to save {}: {}".format(path, e))
+                return
+            with self.lock:
+                self.savedState = state
+                self.lastWrite = self.clock.monotonic()
+                self.writes += 1
+
+
+# =============================================================================
+
+
+# globals
+logger = log.getLogger()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# The whole state of the clock as one small json document, for mqtt
+# consumers that want the full picture rather than one topic per value.
+# Two retained topics carry it:
+#   /bedclock/state        the full document, republished every fullSeconds
+#   /bedclock/state/delta  the fields changed since that full document
+# Every document has a sequence number "seq" and deltas have the "base" seq
+# of the full document they apply to. Since deltas are cumulative, a
+# consumer (see Decoder) only needs the latest of each topic to know the
+# current state, even if it subscribes late or misses messages.
+#
+#   $ mosquitto_sub -h ${MQTT_BROKER} -v -t /bedclock/state/# | \
+#       python3 bedclock/statedoc.py
+
+import json
+import os
+import sys
+import time
+
+# need this because exported python path gets lost when invoking sudo
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+from bedclock import const  # noqa
+
+VERSION = 1
+# keys that are about the document rather than the clock
+META_KEYS = ("v", "seq", "base", "t")
+
+
+def _dumps(doc):
+    return json.dumps(doc, separators=(",", ":"), sort_keys=True)
+
+
+class StateDoc(object):
+    def __init__(self, fullSeconds):
+        self.fullSeconds = fullSeconds
+        self.fields = {}
+        self.base = {}  # fields as of the last full document
+        self.seq = 0
+        self.baseSeq = None
+        self.baseTime = None
+        self.dirty = False
+
+    def update(self, changes):
+        for key, value in changes.items():
+            if self.fields.get(key) != value or key not in self.fields:
+                self.fields[key] = value
+                self.dirty = True
+
+    def resend(self):
+        """Make the next document a full one, e.g. after the broker lost the
+        retained ones.
+        """
+        self.baseTime = None
+        self.dirty = self.dirty or bool(self.fields)
+
+    def encode(self, now):
+        """Return (is full, payload) of the document due, or None when
+        nothing changed since the last one.
+        """
+        if not self.dirty:
+            return None
+        self.dirty = False
+        self.seq += 1
+        doc = {"v": VERSION, "seq": self.seq, "t": int(now)}
+        if self.baseTime is None or now - self.baseTime >= self.fullSeconds:
+            self.base = dict(self.fields)
+            self.baseSeq = self.seq
+            self.baseTime = now
+            doc.update(self.fields)
+            return True, _dumps(doc)
+        doc["base"] = self.baseSeq
+        for key, value in self.fields.items():
+            if key not in self.base or self.base[key] != value:
+                doc[key] = value
+        return False, _dumps(doc)
+
+
+# =============================================================================
+
+
+class Decoder(object):
+    """Reference decoder: feed it the payloads of the full and delta topics,
+    in whatever order they arrive.
+    """
+
+    def __init__(self):
+        self.full = None
+        self.delta = None
+
+    def feed(self, isDelta, payload):
+        doc = json.loads(payload)
+        if doc.get("v") != VERSION:
+            return
+        current = self.delta if isDelta else self.full
+        if current is not None and doc["seq"] <= current["seq"]:
+            return  # old news
+        if isDelta:
+            self.delta = doc
+        else:
+            self.full = doc
+
+    def state(self):
+        """Current state, or None until a full document shows up."""
+        if self.full is None:
+            return None
+        state = dict(self.full)
+        if self.delta is not None and self.delta["base"] == self.full["seq"]:
+            state.update(self.delta)
+        for key in META_KEYS:
+            state.pop(key, None)
+        temperatureTime = state.get("temperatureTime")
+        if temperatureTime is not None:
+            state["temperatureAge"] = time.time() - temperatureTime
+        return state
+
+
+# =============================================================================
+
+
+if __name__ == "__main__":
+    # decode the output of mosquitto_sub -v, which is "<topic> <payload>"
+    fullTopic = const.mqtt_topics_pub[const.mqtt_topic_pub_state]
+    deltaTopic = const.mqtt_topics_pub[const.mqtt_topic_pub_state_delta]
+    decoder = Decoder()
+    for line in sys.stdin:
+        topic, _, payload = line.strip().partition(" ")
+        if topic not in (fullTopic, deltaTopic):
+            continue
+        decoder.feed(topic == deltaTopic, payload)
+        print(json.dumps(decoder.state()), flush=True)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+# Every lux and proximity sample motion takes, packed into compact batches
+# for the /bedclock/telemetry topic. A payload is one or more batches, each
+# of them a header with the first sample, followed by the milliseconds
+# since the previous sample (unsigned 16 bits) and the change in value
+# (signed 16 bits) of each of the other samples. All little endian. To look
+# at them:
+#
+#   $ mosquitto_sub -h ${MQTT_BROKER} -t /bedclock/telemetry -F %x | \
+#       python3 bedclock/telemetry.py --hex
+
+import argparse
+import array
+import binascii
+import struct
+import sys
+import time
+
+MAGIC = b"BT"
+VERSION = 1
+# magic, version, series, number of samples, time and value of the first one
+BATCH_HEADER = struct.Struct("<2sBBHdi")
+SERIES = ["lux", "proximity"]
+MAX_DELTA_MS = 0xFFFF
+MIN_DELTA_VALUE, MAX_DELTA_VALUE = -0x8000, 0x7FFF
+MAX_SAMPLES = 0xFFFF
+BIG_ENDIAN_HOST = sys.byteorder == "big"
+
+
+class _Batch(object):
+    def __init__(self, seriesId, t, value):
+        self.seriesId = seriesId
+        self.t0 = t
+        self.v0 = value
+        self.elapsedMs = 0
+        self.value = value
+        self.deltaMs = array.array("H")
+        self.deltaValues = array.array("h")
+
+    def add(self, t, value):
+        """Returns False if the sample does not fit in this batch."""
+        # relative to the first sample, so rounding does not add up
+        elapsedMs = int(round((t - self.t0) * 1000))
+        deltaMs = elapsedMs - self.elapsedMs
+        deltaValue = value - self.value
+        if not 0 <= deltaMs <= MAX_DELTA_MS:
+            return False
+        if not MIN_DELTA_VALUE <= deltaValue <= MAX_DELTA_VALUE:
+            return False
+        if len(self) >= MAX_SAMPLES:
+            return False
+        self.deltaMs.append(deltaMs)
+        self.deltaValues.append(deltaValue)
+        self.elapsedMs = elapsedMs
+        self.value = value
+        return True
+
+    def __len__(self):
+        return len(self.deltaMs) + 1
+
+    def encode(self):
+        deltaMs, deltaValues = self.deltaMs, self.deltaValues
+        if BIG_ENDIAN_HOST:
+            deltaMs = array.array("H", deltaMs)
+            deltaValues = array.array("h", deltaValues)
+            deltaMs.byteswap()
+            deltaValues.byteswap()
+        header = BATCH_HEADER.pack(
+            MAGIC, VERSION, self.seriesId, len(self), self.t0, self.v0
+        )
+        return header + deltaMs.tobytes() + deltaValues.tobytes()
+
+
+class Batcher(object):
+    """Collects samples, handing out a payload every flushSeconds, or sooner
+    when a series has flushSamples samples.
+    """
+
+    def __init__(self, flushSeconds, flushSamples):
+        self.flushSeconds = flushSeconds
+        self.flushSamples = flushSamples
+        self.batches = {}
+        self.ready = []
+        self.lastFlush = None
+        self.samples = 0
+        self.payloads = 0
+        self.payloadBytes = 0
+
+    def add(self, name, t, value):
+        value = int(value)
+        self.samples += 1
+        batch = self.batches.get(name)
+        if batch is not None and not batch.add(t, value):
+            self.ready.append(batch.encode())
+            batch = None
+        if batch is None:
+            batch = self.batches[name] = _Batch(SERIES.index(name), t, value)
+        if len(batch) >= self.flushSamples:
+            self.ready.append(batch.encode())
+            del self.batches[name]
+
+    def poll(self, now):
+        """Return the payload to publish, if one is due."""
+        if self.lastFlush is None:
+            self.lastFlush = now
+        if now - self.lastFlush >= self.flushSeconds:
+            self.ready.extend(batch.encode() for batch in self.batches.values())
+            self.batches.clear()
+        if not self.ready:
+            return None
+        self.lastFlush = now
+        payload = b"".join(self.ready)
+        self.ready = []
+        self.payloads += 1
+        self.payloadBytes += len(payload)
+        return payload
+
+
+# =============================================================================
+
+
+def decode(payload):
+    """Yield (series name, [(time, value), ...]) for each batch in payload."""
+    offset = 0
+    while offset < len(payload):
+        magic, version, seriesId, count, t, value = BATCH_HEADER.unpack_from(
+            payload, offset
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a version {} telemetry batch".format(VERSION))
+        offset += BATCH_HEADER.size
+        deltaMs = array.array("H", payload[offset:offset + 2 * (count - 1)])
+        offset += 2 * (count - 1)
+        deltaValues = array.array("h", payload[offset:offset + 2 * (count - 1)])
+        offset += 2 * (count - 1)
+        if BIG_ENDIAN_HOST:
+            deltaMs.byteswap()
+            deltaValues.byteswap()
+        samples = [(t, value)]
+        elapsedMs = 0
+        for dMs, dValue in zip(deltaMs, deltaValues):
+            elapsedMs += dMs
+            value += dValue
+            samples.append((t + elapsedMs / 1000.0, value))
+        yield SERIES[seriesId], samples
+
+
+def _print_samples(payload):
+    for name, samples in decode(payload):
+        for t, value in samples:
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+            print("{}.{:03d},{},{}".format(when, int(t * 1000) % 1000, name, value))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="decode bedclock telemetry")
+    parser.add_argument(
+        "files", nargs="*", help="files with a raw payload each, or stdin"
+    )
+    parser.add_argument(
+        "--hex", action="store_true", help="stdin has a hex encoded payload per line"
+    )
+    args = parser.parse_args()
+    if args.hex:
+        for line in sys.stdin:
+            if line.strip():
+                _print_samples(binascii.unhexlify(line.strip()))
+    elif args.files:
+        for path in args.files:
+            with open(path, "rb") as f:
+                _print_samples(f.read())
+    else:
+        _print_samples(sys.stdin.buffer.read())
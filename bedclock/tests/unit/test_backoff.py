@@ -0,0 +1,28 @@
+import random
+
+from bedclock import backoff
+
+
+def test_delays_grow_up_to_max():
+    b = backoff.Backoff(1, 30, jitter=0)
+    assert [b.next_delay() for _ in range(7)] == [1, 2, 4, 8, 16, 30, 30]
+    b.reset()
+    assert b.next_delay() == 1
+
+
+def test_jitter_spreads_delays():
+    b = backoff.Backoff(1, 120, jitter=1.0, rng=random.Random(7))
+    delays = []
+    for _ in range(1000):
+        b.reset()
+        b.next_delay()
+        delays.append(b.next_delay())  # the second attempt
+    assert all(0 <= d <= 2 for d in delays)
+    # spread across the whole range, rather than all at once
+    assert min(delays) < 0.1 and max(delays) > 1.9
+
+    # with half of it jittered, the first wait is between 2 and 4 seconds
+    half = backoff.Backoff(4, 120, jitter=0.5, rng=random.Random(7))
+    for _ in range(100):
+        half.reset()
+        assert 2 <= half.next_delay() <= 4
@@ -0,0 +1,126 @@
+import socket
+import struct
+import time
+
+from bedclock import broker
+from bedclock import const
+
+
+class _Socket(object):
+    # what was received past the packet asked for
+    def __init__(self, sock):
+        self.sock = sock
+        self.buf = bytearray()
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+
+def _connect(port, clientId, clean=True, sessionPresent=False):
+    sock = _Socket(socket.create_connection(("127.0.0.1", port), timeout=5))
+    body = (
+        broker._encode_string("MQTT")
+        + bytes([4, 0x02 if clean else 0])
+        + struct.pack(">H", 60)
+        + broker._encode_string(clientId)
+    )
+    sock.sendall(broker._packet(broker.CONNECT, 0, body))
+    connack = bytes([int(sessionPresent), 0])
+    assert _receive(sock)[:2] == (broker.CONNACK, connack)
+    return sock
+
+
+def _receive(sock):
+    while True:
+        packet = broker.read_packet(sock.buf)
+        if packet is not None:
+            kind, flags, body, size = packet
+            del sock.buf[:size]
+            return kind, body, flags
+        data = sock.sock.recv(4096)
+        if not data:
+            return None
+        sock.buf += data
+
+
+def _subscribe(sock, topicFilter, qos):
+    body = struct.pack(">H", 1) + broker._encode_string(topicFilter) + bytes([qos])
+    sock.sendall(broker._packet(broker.SUBSCRIBE, 0x02, body))
+    assert _receive(sock) == (broker.SUBACK, b"\x00\x01" + bytes([qos]), 0)
+
+
+def test_topic_matches():
+    assert broker.topic_matches("/bedclock/+/light", "/bedclock/fleet-1/light")
+    assert broker.topic_matches("/bedclock/#", "/bedclock/fleet-1/state/delta")
+    assert broker.topic_matches("/msg", "/msg")
+    assert not broker.topic_matches("/bedclock/+", "/bedclock/fleet-1/light")
+    assert not broker.topic_matches("/bedclock/+/light", "/bedclock/light")
+
+
+def test_publish_subscribe_and_retain():
+    stand_in = broker.Broker("127.0.0.1", 0).start()
+    try:
+        publisher = _connect(stand_in.port, "publisher")
+        retained = broker.publish_packet("/bedclock/a/state", b"doc", 1, True, 6)
+        publisher.sendall(retained)
+        assert _receive(publisher) == (broker.PUBACK, b"\x00\x06", 0)
+        subscriber = _connect(stand_in.port, "subscriber")
+        _subscribe(subscriber, "/bedclock/+/#", 1)
+        kind, body, flags = _receive(subscriber)
+        assert kind == broker.PUBLISH and flags & 0x01  # the retained one
+        assert body.endswith(b"doc")
+        publisher.sendall(broker.publish_packet("/bedclock/a/light", b"12", 1, 0, 7))
+        assert _receive(publisher) == (broker.PUBACK, b"\x00\x07", 0)
+        kind, body, flags = _receive(subscriber)
+        assert (kind, flags) == (broker.PUBLISH, 0x02)
+        assert body.endswith(b"12")
+        assert stand_in.stats()["publishesIn"] == 2
+    finally:
+        stand_in.stop()
+
+
+def test_same_client_id_takes_over():
+    stand_in = broker.Broker("127.0.0.1", 0).start()
+    try:
+        first = _connect(stand_in.port, "bedclock")
+        _connect(stand_in.port, "bedclock")
+        assert _receive(first) is None  # kicked off
+        assert stand_in.stats()["takeovers"] == 1
+    finally:
+        stand_in.stop()
+
+
+def test_persistent_session():
+    stand_in = broker.Broker("127.0.0.1", 0).start()
+    try:
+        clock = _connect(stand_in.port, "clock", clean=False)
+        _subscribe(clock, "/msg", 1)
+        clock.sock.close()
+        while stand_in.stats()["clients"]:
+            time.sleep(0.01)
+        publisher = _connect(stand_in.port, "publisher")
+        publisher.sendall(broker.publish_packet("/msg", b"away", 1, False, 3))
+        assert _receive(publisher) == (broker.PUBACK, b"\x00\x03", 0)
+    finally:
+        stand_in.stop()
+    # the next broker takes over what this one persisted
+    stand_in = broker.Broker("127.0.0.1", 0, *stand_in.persisted()).start()
+    try:
+        # no need to subscribe again, and what was missed is waiting
+        clock = _connect(stand_in.port, "clock", clean=False, sessionPresent=True)
+        kind, body, flags = _receive(clock)
+        assert kind == broker.PUBLISH and body.endswith(b"away")
+        assert stand_in.stats()["subscribes"] == 0
+    finally:
+        stand_in.stop()
+
+
+def test_instance_topics():
+    pub, sub = const.mqtt_topics(None)
+    assert pub[const.mqtt_topic_pub_light] == "/bedclock/light"
+    pub, sub = const.mqtt_topics("kids")
+    assert pub[const.mqtt_topic_pub_light] == "/bedclock/kids/light"
+    assert sub[const.mqtt_topic_sub_stay] == "/bedclock/kids/stay"
+    # shared by all clocks
+    assert sub[const.mqtt_topic_sub_msg] == "/msg"
+    assert sub[const.mqtt_topic_sub_temperature] == "/sensor/temperature_outside"
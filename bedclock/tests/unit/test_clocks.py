@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+import queue
+
+import pytest
+
+from bedclock import clocks
+
+
+def test_virtual_time():
+    start = datetime(2020, 1, 1, 23, 59, 30)
+    clock = clocks.VirtualClock(start)
+    assert clock.now() == start
+    assert clock.monotonic() == 0
+    clock.advance_to(45)
+    assert clock.now() == start + timedelta(seconds=45)
+    assert clock.time() == start.timestamp() + 45
+    # time does not go back
+    clock.advance_to(10)
+    assert clock.monotonic() == 45
+
+
+def test_virtual_waits_do_not_block():
+    clock = clocks.VirtualClock()
+    q = queue.Queue()
+    clock.sleep(5)
+    assert clock.wakeTime == 5
+    with pytest.raises(queue.Empty):
+        clock.get(q, 2)
+    assert clock.wakeTime == 2
+    # the earliest wake wins
+    clock.sleep(3)
+    assert clock.wakeTime == 2
+    q.put("cmd")
+    assert clock.get(q, 2) == "cmd"
@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from bedclock import colorxform
+from bedclock import const
+
+
+def test_select_mode():
+    night = datetime(2020, 1, 1, 3, 0)
+    day = datetime(2020, 1, 1, 15, 0)
+    assert colorxform.select_mode(night, 0) == colorxform.MODE_NIGHT
+    assert colorxform.select_mode(night, const.motion_luxMaxValue) == colorxform.MODE_DAY
+    assert colorxform.select_mode(day, 0) == colorxform.MODE_DAY
+
+
+def test_luts_are_cached():
+    key = (colorxform.MODE_NIGHT, 0)
+    assert colorxform.build_luts(*key) is colorxform.build_luts(*key)
+    day = colorxform.build_luts(colorxform.MODE_DAY, 0)
+    assert day[0] == bytes(range(256))
+
+
+def test_night_colors():
+    luts = colorxform.build_luts(colorxform.MODE_NIGHT, 0)
+    assert colorxform.transform_rgb(luts, (0, 0, 0)) == (0, 0, 0)
+    r, g, b = colorxform.transform_rgb(luts, (255, 255, 255))
+    # red shifted and dimmed, but nothing lit goes completely dark
+    assert r > g > b > 0
+    assert r < 255
+    assert colorxform.transform_rgb(luts, (0, 0, 123))[2] > 0
@@ -0,0 +1,119 @@
+import json
+import os
+
+import pytest
+
+from bedclock import config
+from bedclock import const
+
+
+@pytest.fixture(autouse=True)
+def defaults():
+    yield
+    config.apply(config.Snapshot(0, {}))
+
+
+def test_read_file(tmp_path):
+    path = str(tmp_path / "config.json")
+    assert config.read_file(path) == {}  # no file, no changes
+    with open(path, "w") as f:
+        json.dump({"motion_luxDeltaThreshold": 5}, f)
+    assert config.read_file(path) == {"motion_luxDeltaThreshold": 5}
+    path = str(tmp_path / "config.toml")
+    with open(path, "w") as f:
+        f.write("scr_pwmBitsPolicy = [[20, 8]]\n")
+    assert config.read_file(path) == {"scr_pwmBitsPolicy": [[20, 8]]}
+    with open(path, "w") as f:
+        f.write("scr_pwmBitsPolicy = \n")
+    with pytest.raises(ValueError):
+        config.read_file(path)
+
+
+def test_check():
+    values, errors = config.check(
+        {
+            "scr_nightModeRgbGain": [1.0, 0.5, 0.2],
+            "scr_brightnessMaxValue": 80.5,
+            "scr_nightModeGamma": 2,
+            "ctlsock_path": None,
+            "mqtt_republish_seconds": None,
+            "scr_led_rgb_sequence": None,
+            "motion_luxHighWatermark": "high",
+            "scr_marqueeEnabled": 1,
+            "mqtt_topics_pub": {},
+            "motion_luxHighWaterMark": 10,
+        }
+    )
+    assert values == {
+        "scr_nightModeRgbGain": (1.0, 0.5, 0.2),
+        "scr_nightModeGamma": 2.0,
+        "ctlsock_path": None,
+        "mqtt_republish_seconds": None,
+    }
+    assert errors == [
+        "motion_luxHighWaterMark: not a knob",
+        "motion_luxHighWatermark: expected int, not 'high'",
+        "mqtt_topics_pub: not a knob",
+        "scr_brightnessMaxValue: expected int, not 80.5",
+        "scr_led_rgb_sequence: expected str, not None",
+        "scr_marqueeEnabled: expected bool, not 1",
+    ]
+
+
+def test_reload_is_versioned_and_rejects_reinit_knobs():
+    start = config.current().version
+    default = const.motion_luxDeltaThreshold
+    snapshot = config.do_reload({"motion_luxDeltaThreshold": default + 3})
+    assert snapshot.version == start + 1
+    assert const.motion_luxDeltaThreshold == default + 3
+    assert config.current() is snapshot
+    # nothing changed, nothing to send
+    assert config.do_reload({"motion_luxDeltaThreshold": default + 3}) is None
+    # all or nothing: the live knob does not change either
+    values = {"motion_luxDeltaThreshold": 1, "scr_led_rows": 16}
+    assert config.do_reload(values) is None
+    assert const.motion_luxDeltaThreshold == default + 3
+    assert const.scr_led_rows == 64
+    # knobs no longer in the file get their defaults back
+    snapshot = config.do_reload({})
+    assert snapshot.version == start + 2
+    assert const.motion_luxDeltaThreshold == default
+
+
+def test_apply_at_start_sets_any_knob():
+    changed = config.apply(config.Snapshot(1, {"mqtt_instance": "kids"}))
+    assert changed == ["mqtt_instance"]
+    assert const.mqtt_topics_pub[const.mqtt_topic_pub_light] == "/bedclock/kids/light"
+    config.apply(config.Snapshot(2, {}))
+    assert const.mqtt_topics_pub[const.mqtt_topic_pub_light] == "/bedclock/light"
+
+
+def test_watcher_polls_for_changes(tmp_path):
+    path = str(tmp_path / "config.json")
+    watcher = config.Watcher(path, 1, None)
+    assert watcher.poll() is None  # still no file
+    with open(path, "w") as f:
+        f.write('{"scr_fadeStepsPerSecond": 10}')
+    assert watcher.poll() == {"scr_fadeStepsPerSecond": 10}
+    assert watcher.poll() is None
+    with open(path, "w") as f:
+        f.write('{"scr_fadeStepsPerSecond": ')  # caught half written
+    assert watcher.poll() is None
+    with open(path, "a") as f:
+        f.write("20}")
+    assert watcher.poll() == {"scr_fadeStepsPerSecond": 20}
+    os.remove(path)
+    assert watcher.poll() == {}
+
+
+def test_derived_knobs_follow_their_watermark():
+    high = const.motion_luxHighWatermark
+    changed = config.apply(config.Snapshot(1, {"motion_luxLowWatermark": 3}))
+    assert changed == ["motion_luxDarkRoomThreshold", "motion_luxLowWatermark"]
+    assert const.motion_luxDarkRoomThreshold == 3
+    values = {"motion_luxHighWatermark": 30, "scr_nightModeLuxThreshold": 25}
+    config.apply(config.Snapshot(2, values))
+    assert const.motion_luxDarkRoomThreshold == const.motion_luxLowWatermark
+    assert const.scr_nightModeLuxThreshold == 25
+    config.apply(config.Snapshot(3, {}))
+    assert const.scr_nightModeLuxThreshold == high
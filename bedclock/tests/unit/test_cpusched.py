@@ -0,0 +1,62 @@
+import errno
+import logging
+import types
+
+import pytest
+
+from bedclock import const
+from bedclock import cpusched
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    # what apply_settings asked of the os, without changing this process.
+    # Calls to the functions in failing raise EPERM
+    calls = types.SimpleNamespace(made=[], failing=set())
+
+    def record(name):
+        def fun(*args):
+            calls.made.append(name)
+            if name in calls.failing:
+                raise OSError(errno.EPERM, "not permitted")
+
+        return fun
+
+    monkeypatch.setattr(cpusched.os, "sched_getaffinity", lambda pid: {0, 1})
+    for name in ["sched_setaffinity", "sched_setscheduler", "setpriority"]:
+        monkeypatch.setattr(cpusched.os, name, record(name))
+    return calls
+
+
+def test_unset_or_unsupported_is_a_noop(calls, caplog, monkeypatch):
+    cpusched.apply_settings("screen", {})
+    assert calls.made == []
+    with caplog.at_level(logging.WARNING, logger="bedclock"):
+        cpusched.apply_settings("screen", {"cpus": [5, 6], "policy": "deadline"})
+    assert calls.made == []
+    assert "none of cpus [5, 6]" in caplog.text
+    assert "unable to set policy deadline" in caplog.text
+    # no settings for the process in the profile
+    monkeypatch.setattr(const, "proc_sched_profiles", {"quiet": {"main": {"nice": 5}}})
+    cpusched.apply_profile("screen", "quiet")
+    cpusched.apply_profile("screen", "missing")
+    assert calls.made == []
+
+
+def test_settings_applied(calls):
+    cpusched.apply_settings(
+        "screen", {"cpus": [1, 3], "policy": "fifo", "priority": 10, "nice": -5}
+    )
+    assert calls.made == ["sched_setaffinity", "sched_setscheduler", "setpriority"]
+
+
+def test_errors_are_logged(calls, caplog):
+    calls.failing = {"sched_setscheduler", "setpriority"}
+    with caplog.at_level(logging.WARNING, logger="bedclock"):
+        cpusched.apply_settings(
+            "screen", {"cpus": [0], "policy": "rr", "priority": 50, "nice": -20}
+        )
+    # one failing does not stop the others from being tried
+    assert calls.made == ["sched_setaffinity", "sched_setscheduler", "setpriority"]
+    assert "screen: unable to set policy rr priority 50" in caplog.text
+    assert "screen: unable to set nice -20" in caplog.text
@@ -0,0 +1,75 @@
+import threading
+
+from bedclock import ctlsock
+
+
+def _server(tmp_path, queued):
+    state = {"brightness": 8, "lux": 3}
+    path = str(tmp_path / "ctl.sock")
+    return ctlsock.Server(path, lambda: dict(state), queued.append, 4).start()
+
+
+def test_state_and_commands(tmp_path):
+    queued = []
+    server = _server(tmp_path, queued)
+    try:
+        client = ctlsock.Client(server.path)
+        assert client.state() == {"ok": True, "state": {"brightness": 8, "lux": 3}}
+        response = client.commands([["stay", "on"], ["message", "hi"], ["lux_report"]])
+        assert response == {"ok": True, "queued": 3}
+        assert [e.name for e in queued] == [
+            "ScreenStaysOn",
+            "DisplayMessage",
+            "LuxUpdateRequest",
+        ]
+        assert queued[0].value is True
+        # a bad command means nothing in the batch gets queued
+        response = client.commands([["temperature", "72"], ["reboot"]])
+        assert not response["ok"]
+        assert len(queued) == 3
+        # pipelined requests
+        for i in range(10):
+            client.send({"op": "state", "id": i})
+        assert [client.receive()["id"] for _ in range(10)] == list(range(10))
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_bad_requests_keep_the_server_up(tmp_path):
+    queued = []
+    server = _server(tmp_path, queued)
+    server.stateFun = lambda: 1 / 0
+    try:
+        client = ctlsock.Client(server.path)
+        for commands in (5, "stay", [[["x"]]], [[{}]], [[None, 1]]):
+            assert not client.commands(commands)["ok"]
+        assert not client.state()["ok"]  # stateFun raised
+        server.stateFun = lambda: {"lux": 3}
+        assert client.state() == {"ok": True, "state": {"lux": 3}}
+        assert not queued
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_concurrent_clients(tmp_path):
+    queued = []
+    server = _server(tmp_path, queued)
+    errors = []
+
+    def run():
+        client = ctlsock.Client(server.path)
+        for _ in range(100):
+            if not client.commands([["temperature", "72"]])["ok"]:
+                errors.append(1)
+        client.close()
+
+    try:
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        assert not errors
+        assert len(queued) == 400
+    finally:
+        server.stop()
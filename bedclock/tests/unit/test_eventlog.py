@@ -0,0 +1,78 @@
+import multiprocessing
+
+import pytest
+
+from bedclock import eventlog
+from bedclock import events
+
+
+def test_record_and_read(tmp_path):
+    path = str(tmp_path / "events.log")
+    recorder = eventlog.Recorder(path, 1024 * 1024)
+    recorded = [
+        events.MotionLux(42),
+        events.DisplayMessage("hello", "test"),
+        events.ProfileRequest("screen", "sample", 10, "test"),
+        events.MotionDetected(),
+    ]
+    for event in recorded:
+        recorder.record(event)
+    recorder.close()
+    replayed = list(eventlog.read_events(path))
+    assert [t for t, _ in replayed] == sorted(t for t, _ in replayed)
+    for original, (_, event) in zip(recorded, replayed):
+        assert type(event) is type(original)
+        assert (event.name, event.description, event.value) == (
+            original.name,
+            original.description,
+            original.value,
+        )
+
+    # a record cut short ends the log
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 1)
+    assert len(list(eventlog.read_events(path))) == len(recorded) - 1
+
+
+def test_previous_log_kept(tmp_path):
+    path = str(tmp_path / "events.log")
+    recorder = eventlog.Recorder(path, 1024)
+    recorder.record(events.MotionLux(1))
+    recorder.close()
+    # previous log is moved aside when recording starts
+    recorder = eventlog.Recorder(path, 1024)
+    assert [e.value for _, e in eventlog.read_events(path + ".1")] == [1]
+    # and when the log reaches max bytes
+    recorder.maxBytes = recorder.f.tell() + 1
+    recorder.record(events.MotionLux(2))
+    recorder.close()
+    assert [e.value for _, e in eventlog.read_events(path + ".1")] == [2]
+    assert list(eventlog.read_events(path)) == []
+
+
+def test_replay_final_state(tmp_path):
+    pytest.importorskip("dill")
+    pytest.importorskip("paho.mqtt.client")
+    path = str(tmp_path / "events.log")
+    recorder = eventlog.Recorder(path, 1024 * 1024)
+    for event in [
+        events.ScreenStaysOn(True, "test"),
+        events.OutsideTemperature(54, "test"),
+        events.DisplayMessage("good night", "test"),
+        events.ProfileRequest("screen", "sample", 10, "test"),
+        events.MotionLux(0),
+        events.ScreenDeepIdle(True, "test"),
+    ]:
+        recorder.record(event)
+    recorder.close()
+    # in a process of its own: the simulated backends run in threads that
+    # outlive the replay, and would share module state with other tests
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        results = pool.apply(eventlog.replay, (path, 0))
+    assert (results["events"], results["skipped"]) == (5, 1)
+    assert results["droppedCommands"] == 0
+    assert results["screen"]["stayOnInDarkRoom"]
+    assert results["screen"]["cachedOutsideTemperature"] == 54
+    assert results["screen"]["displayMessage"] == "good night"
+    assert results["motion"]["deepIdle"]
+    assert results["mqtt"] == {"/bedclock/light": 1}
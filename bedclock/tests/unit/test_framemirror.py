@@ -0,0 +1,56 @@
+from bedclock import framemirror
+
+
+def _mirror():
+    return framemirror.Mirror(16, 12, 8, 2, 0.5, 60, 4096)
+
+
+def test_deltas_round_trip():
+    mirror = _mirror()
+    decoder = framemirror.Decoder()
+    frame = bytearray(16 * 12 * 3)
+    frame[0:3] = b"\x01\x02\x03"
+    mirror.offer(frame, 50)
+    keyframe = mirror.poll(0)
+    assert decoder.feed(keyframe)
+    assert decoder.frame == frame and decoder.brightness == 50
+
+    # same frame again is not even offered
+    mirror.offer(frame, 50)
+    assert mirror.offers == 1 and mirror.poll(10) is None
+
+    # frames offered faster than maxFps replace each other
+    frame[(11 * 16 + 15) * 3] = 255
+    mirror.offer(frame, 50)
+    assert mirror.poll(0.1) is None
+    frame[(11 * 16 + 14) * 3] = 255
+    mirror.offer(frame, 60)
+    delta = mirror.poll(0.5)
+    assert mirror.replaced == 1
+    # only the bottom right tile changed
+    assert framemirror.HEADER.unpack_from(delta)[-1] == 1
+    assert decoder.feed(delta)
+    assert decoder.frame == frame and decoder.brightness == 60
+    assert decoder.png().startswith(b"\x89PNG")
+
+    # nothing changes, but key frames keep going out
+    keyframe = mirror.poll(100)
+    assert framemirror.HEADER.unpack_from(keyframe)[2] & framemirror.FLAG_KEYFRAME
+    assert decoder.feed(keyframe) and decoder.frame == frame
+
+
+def test_missed_payload_waits_for_keyframe():
+    mirror = _mirror()
+    frame = bytearray(16 * 12 * 3)
+    payloads = []
+    # a key frame, two deltas and the next key frame
+    for i in range(4):
+        frame[i * 3] = 255
+        mirror.offer(frame, 50)
+        payloads.append(mirror.poll(i * 20))
+    decoder = framemirror.Decoder()
+    assert decoder.feed(payloads[0])
+    assert not decoder.feed(payloads[2])
+    assert decoder.skipped == 1
+    assert decoder.feed(payloads[3])
+    assert decoder.frame == frame
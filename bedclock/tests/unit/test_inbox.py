@@ -0,0 +1,44 @@
+import threading
+
+from bedclock import inbox
+
+
+def test_latest_value_per_topic():
+    box = inbox.Inbox(maxTopics=2)
+    assert box.put("temperature", b"1")
+    assert not box.put("stay", b"on")
+    assert not box.put("temperature", b"2")
+    # a new topic does not fit while two are pending
+    assert not box.put("msg", b"hi")
+    assert box.take_all() == [("stay", b"on"), ("temperature", b"2")]
+    assert box.stats() == {"received": 4, "coalesced": 1, "dropped": 1, "pending": 0}
+    assert box.put("msg", b"hi")
+
+
+def test_flood():
+    # stand-in broker: a thread delivering a burst, like paho's network
+    # thread on reconnect, while the handler drains the inbox
+    box = inbox.Inbox(maxTopics=8)
+    handled = []
+    done = threading.Event()
+
+    def broker():
+        for i in range(20000):
+            box.put("temperature", i)
+            if i == 10000:
+                box.put("stay", "on")
+        done.set()
+
+    thread = threading.Thread(target=broker)
+    thread.start()
+    while not done.is_set() or len(box):
+        handled.extend(box.take_all())
+    thread.join()
+    stats = box.stats()
+    assert stats["received"] == 20001
+    assert stats["dropped"] == 0
+    assert stats["coalesced"] + len(handled) == stats["received"]
+    assert ("stay", "on") in handled
+    temperatures = [payload for topic, payload in handled if topic == "temperature"]
+    assert temperatures == sorted(temperatures)
+    assert temperatures[-1] == 19999
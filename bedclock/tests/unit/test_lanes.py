@@ -0,0 +1,17 @@
+from bedclock import lanes
+
+
+def test_priorities():
+    cmdLanes = lanes.Lanes([b"w"], [b"l", b"t"], maxPending=3)
+    for command in [b"t1", b"o1", b"l1", b"t2", b"w1", b"l2", b"w2"]:
+        assert cmdLanes.add(command)
+    # full, but urgent ones always get in
+    assert not cmdLanes.add(b"o2")
+    assert cmdLanes.add(b"w3")
+    assert len(cmdLanes) == 6
+    popped = []
+    while cmdLanes:
+        popped.append(cmdLanes.pop())
+    assert popped == [b"1", b"2", b"3", b"1", b"2", b"2"]
+    assert cmdLanes.pop() is None
+    assert (cmdLanes.coalesced, cmdLanes.dropped) == (2, 1)
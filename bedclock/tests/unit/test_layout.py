@@ -0,0 +1,62 @@
+import collections
+
+from bedclock import layout
+from bedclock import widgets
+
+Font = collections.namedtuple("Font", "height ascent descent")
+# metrics of the 10x20, 6x9 and 5x8 fonts
+FONTS = [Font(20, 16, 4), Font(9, 7, 2), Font(8, 7, 1)]
+
+
+class FakeCanvas(object):
+    def __init__(self):
+        self.writes = []
+
+    def Clear(self):
+        pass
+
+    def SetPixel(self, x, y, r, g, b):
+        self.writes.append((x, y))
+
+
+def test_single_panel_layout():
+    place = layout.compute(64, 64, FONTS, clockOffsetY=-3)
+    assert [place[n].baseline for n in ["clock", "weekday", "date"]] == [28, 37, 46]
+    assert (place["message"].baseline, place["message"].width) == (7, 64)
+    assert (place["temperature"].x, place["temperature"].baseline) == (1, 63)
+    assert (place["motion"].x, place["motion"].y) == (63, 63)
+
+
+def test_wide_layout_and_panels():
+    size, panels = layout.panel_rects(64, 64, 2, 1, "")
+    assert size == (128, 64)
+    assert panels == [(0, 0, 64, 64), (64, 0, 64, 64)]
+    place = layout.compute(128, 64, FONTS)
+    assert place["clock"].width == 64
+    assert place["weekday"].x == place["date"].x == 64
+
+    size, panels = layout.panel_rects(64, 64, 2, 2, "Rotate:90")
+    assert size == (128, 128)
+    assert sorted(panels) == [(x, y, 64, 64) for x in (0, 64) for y in (0, 64)]
+    assert layout.panel_rects(32, 64, 4, 1, "U-mapper")[0] == (128, 64)
+    # mappers layout does not know about make the canvas a single panel
+    unknown = layout.panel_rects(32, 64, 2, 1, "Mirror:H")
+    assert unknown == ((128, 32), [(0, 0, 128, 32)])
+
+
+def test_compositor_per_panel():
+    left = widgets.PixelWidget("left", 10, 10)
+    right = widgets.PixelWidget("right", 100, 10)
+    compositor = widgets.Compositor(
+        128, 64, [left, right], numBuffers=1, panels=[(0, 0, 64, 64), (64, 0, 64, 64)]
+    )
+    left.update((1, 2, 3))
+    right.update((1, 2, 3))
+    compositor.draw(FakeCanvas())
+    assert compositor.panelFrames == [1, 1]
+    right.update((4, 5, 6))
+    canvas = FakeCanvas()
+    assert compositor.draw(canvas) == 1
+    assert canvas.writes == [(100, 10)]
+    assert compositor.panelFrames == [1, 2]
+    assert compositor.panelPixelWrites == [1, 2]
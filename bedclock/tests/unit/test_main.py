@@ -0,0 +1,48 @@
+import multiprocessing
+import types
+
+import pytest
+
+from bedclock import config
+from bedclock import const
+from bedclock import events
+from bedclock import main
+from bedclock import motion
+
+
+@pytest.fixture(autouse=True)
+def defaults():
+    yield
+    config.apply(config.Snapshot(0, {}))
+
+
+def test_config_is_sent_until_applied(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    sent = []
+    queued = [False, True, True]  # the first one does not fit in the queue
+    monkeypatch.setattr(
+        motion, "do_apply_config", lambda s: sent.append(s.version) or queued.pop(0)
+    )
+    monkeypatch.setattr(motion, "do_connect", lambda cmdq: None)
+    process = main.MotionProcess(multiprocessing.Queue())
+    monkeypatch.setattr(main, "myProcesses", [process])
+    monkeypatch.setattr(main, "configVersions", {"motion": config.current().version})
+    monkeypatch.setattr(main, "configSent", {})
+
+    values = {"motion_luxDeltaThreshold": const.motion_luxDeltaThreshold + 1}
+    main.processEvent(events.ConfigReload(values, "test"))
+    version = config.current().version
+    assert sent == [version]
+    now[0] += 1
+    main.sendConfig()
+    assert sent == [version]  # too soon to send it again
+    for _ in range(2):
+        now[0] += main.CONFIG_RETRY_SECONDS
+        main.sendConfig()
+    assert sent == [version] * 3  # queued, but nothing says it got applied
+    main.processEvent(events.ConfigApplied(version, "motion"))
+    now[0] += main.CONFIG_RETRY_SECONDS
+    main.sendConfig()
+    assert sent == [version] * 3
+    assert main.configVersions["motion"] == version
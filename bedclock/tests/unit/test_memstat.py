@@ -0,0 +1,15 @@
+from bedclock import memstat
+
+
+def test_read_memory():
+    mem = memstat.read_memory()
+    assert mem["rss"] > 0
+    assert 0 < mem["uss"] <= mem["rss"]
+    assert mem["uss"] <= mem["pss"] <= mem["rss"]
+
+
+def test_monitor_budget():
+    monitor = memstat.MemoryMonitor("test", 0, memstat.MEM_ACTION_WARN, 1)
+    assert monitor.check()
+    monitor.budgetKb = 1
+    assert not monitor.check()
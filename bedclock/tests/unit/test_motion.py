@@ -0,0 +1,111 @@
+import queue
+import threading
+
+import pytest
+
+pytest.importorskip("dill")
+
+from bedclock import clocks  # noqa
+from bedclock import const  # noqa
+from bedclock import motion  # noqa
+from bedclock import sensors  # noqa
+from bedclock import sim  # noqa
+
+
+class CountingDevice(object):
+    def __init__(self):
+        self.color_data_ready = True
+        self.luxReads = 0
+        self.proximity = 0
+
+    @property
+    def color_data(self):
+        self.luxReads += 1
+        return 0, 5, 0, 5
+
+
+@pytest.fixture
+def clock():
+    clock = clocks.VirtualClock()
+    with sim.no_persistence():
+        motion.do_init(None, queue.Queue(motion.CMDQ_SIZE), clock)
+        yield clock
+
+
+def _step(clock):
+    # returns how long motion asked to sleep
+    clock.wakeTime = None
+    motion.do_iterate()
+    if clock.wakeTime is None:
+        return 0
+    wait = clock.wakeTime - clock.t
+    clock.advance_to(clock.wakeTime)
+    return wait
+
+
+def test_deep_idle_polls_less(clock):
+    device = CountingDevice()
+    motion._state.sensors = sensors.SensorArray(
+        [sensors.Sensor("test", device, threading.Lock())], lambda r, g, b: g
+    )
+    assert _step(clock) == pytest.approx(const.motion_pollInMs / 1000.0)
+    assert device.luxReads == 1
+
+    motion.do_handle_screen_deep_idle(True)
+    _step(clock)  # takes the command
+    assert motion._state.deepIdle
+    waits = [_step(clock) for _ in range(5)]
+    assert waits == pytest.approx([const.motion_idlePollInMs / 1000.0] * 5)
+    assert const.motion_idlePollInMs > const.motion_pollInMs
+    assert device.luxReads == 1  # no color until motion_idleLuxPollInSeconds
+    while clock.t < const.motion_idleLuxPollInSeconds + 1:
+        _step(clock)
+    assert device.luxReads == 2
+
+    motion.do_handle_screen_deep_idle(False)
+    _step(clock)
+    assert not motion._state.deepIdle
+    waits = [_step(clock) for _ in range(3)]
+    assert waits == pytest.approx([const.motion_pollInMs / 1000.0] * 3)
+    assert device.luxReads == 5
+
+
+class BrokenDevice(object):
+    color_data_ready = True
+
+    @property
+    def color_data(self):
+        raise OSError("gone")
+
+    @property
+    def proximity(self):
+        raise OSError("gone")
+
+
+def test_failing_sensors_get_initialized_again(clock, monkeypatch):
+    monkeypatch.setattr(const, "motion_sensor_reinit_errors", 3)
+    # what init_sensors finds, each time it is called
+    devices = [BrokenDevice(), CountingDevice(), BrokenDevice()]
+
+    def init_sensors():
+        sensor = sensors.Sensor("test", devices.pop(0), threading.Lock())
+        motion._state.sensors = sensors.SensorArray([sensor], lambda r, g, b: g)
+
+    monkeypatch.setattr(motion, "init_sensors", init_sensors)
+    init_sensors()
+    for _ in range(3):
+        _step(clock)
+    # all failing: initialized again, and reading fine after that
+    assert motion._state.sensorsReinitialized
+    _step(clock)
+    assert not motion._state.sensorsReinitialized
+
+    motion._state.sensors.sensors[0].device = BrokenDevice()
+    for _ in range(3):
+        _step(clock)
+    assert motion._state.sensorsReinitialized
+    # still failing after being initialized again: time for a restart
+    _step(clock)
+    _step(clock)
+    with pytest.raises(RuntimeError):
+        _step(clock)
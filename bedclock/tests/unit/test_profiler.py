@@ -0,0 +1,55 @@
+import os
+import signal
+import time
+
+import pytest
+
+from bedclock import const
+from bedclock import profiler
+
+
+@pytest.fixture(autouse=True)
+def signal_handlers():
+    # do_init installs handlers for these in the pytest process
+    saved = {s: signal.getsignal(s) for s in (signal.SIGUSR1, signal.SIGALRM)}
+    yield
+    signal.alarm(0)
+    for signum, handler in saved.items():
+        signal.signal(signum, handler)
+    profiler._state = None
+
+
+def test_normalize_request():
+    assert profiler.normalize_request("sample", "12") == ("sample", 12)
+    assert profiler.normalize_request("bogus", None) == (
+        const.profile_default_kind,
+        const.profile_default_seconds,
+    )
+    assert profiler.normalize_request("tracemalloc", 99999) == (
+        "tracemalloc",
+        const.profile_max_seconds,
+    )
+
+
+def test_profile_dump(tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "profile_dump_dir", str(tmp_path))
+    profiler.do_init("test")
+    for kind in profiler.PROFILE_KINDS:
+        assert profiler.do_profile_start(kind, 60)
+        # only one profile at a time
+        assert not profiler.do_profile_start(kind, 60)
+        time.sleep(0.05)
+        filename = profiler.do_profile_stop()
+        assert filename.endswith(profiler.PROFILE_FILE_EXT[kind])
+        assert "test-{}-".format(os.getpid()) in filename
+        assert os.path.exists(filename)
+    assert profiler.do_profile_stop() is None
+
+
+def test_cprofile_with_worker_threads(tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "profile_dump_dir", str(tmp_path))
+    profiler.do_init("test")
+    profiler.do_add_worker_thread("render")
+    assert profiler.do_profile_start(profiler.PROFILE_KIND_CPROFILE, 60)
+    # sampled, so the render thread shows up too
+    assert profiler.do_profile_stop().endswith(".folded")
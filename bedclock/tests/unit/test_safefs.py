@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from bedclock import safefs
+from bedclock import snapshot
+
+
+def test_secure_dir(tmp_path):
+    private = str(tmp_path / "private" / "snapshots")
+    safefs.secure_dir(private)
+    assert os.stat(private).st_mode & 0o777 == 0o700
+    safefs.secure_dir(private)  # already there
+    shared = str(tmp_path / "shared")
+    os.mkdir(shared)
+    os.chmod(shared, 0o1777)
+    with pytest.raises(OSError):
+        safefs.secure_dir(shared)
+    link = str(tmp_path / "link")
+    os.symlink(private, link)
+    with pytest.raises(OSError):
+        safefs.secure_dir(link)
+
+
+def test_no_writing_through_symlinks(tmp_path):
+    victim = tmp_path / "victim"
+    victim.write_text("precious")
+    path = str(tmp_path / "test.json")
+    os.symlink(str(victim), path + ".tmp")
+    # a planted temporary file gets replaced, not written through
+    snapshot.write_atomic(path, {"lux": 1})
+    assert victim.read_text() == "precious"
+    os.symlink(str(victim), str(tmp_path / "new"))
+    with pytest.raises(OSError):
+        safefs.create_exclusive(str(tmp_path / "new"))
+    with pytest.raises(OSError):
+        safefs.open_nofollow(str(tmp_path / "new"), os.O_RDWR | os.O_CREAT)
+    assert victim.read_text() == "precious"
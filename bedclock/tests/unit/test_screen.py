@@ -0,0 +1,146 @@
+from datetime import datetime, timedelta
+import threading
+import time
+import types
+
+import pytest
+
+pytest.importorskip("dill")
+pytest.importorskip("paho.mqtt.client")
+
+from bedclock import const  # noqa
+from bedclock import screen  # noqa
+from bedclock import sim  # noqa
+
+
+def test_deep_idle_in_the_dark():
+    reachAt = []
+
+    def proximity(now):
+        reaching = reachAt and reachAt[0] <= now < reachAt[0] + timedelta(seconds=5)
+        return 30 if reaching else 0
+
+    with sim.Simulation(datetime(2026, 10, 19, 2, 0), lambda now: 1, proximity) as s:
+        screenState, motionState = s.states["screen"], s.states["motion"]
+        s.run(60)
+        # dark room, nobody around: the screen goes dark and both idle
+        assert screenState.deepIdle and motionState.deepIdle
+        assert s.eventCounts["ScreenDeepIdle"] == 1
+        swaps = screenState.matrix.swaps
+        s.run(600)
+        # woken up by commands only, not by timer ticks, and nothing drawn
+        assert screenState.wakeups < 10
+        assert screenState.matrix.swaps == swaps
+
+        # someone reaches for the clock
+        reachAt.append(s.clock.now() + timedelta(seconds=1))
+        s.run(3)
+        assert not screenState.deepIdle and not motionState.deepIdle
+        assert screenState.currentBrightness > 0
+        assert s.eventCounts["ScreenDeepIdle"] == 2
+        # and back to sleep once they are gone
+        s.run(120)
+        assert screenState.deepIdle and motionState.deepIdle
+        assert s.eventCounts["ScreenDeepIdle"] == 3
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    # renderFrame only returns once rendering is set, so tests can keep the
+    # worker busy
+    renderer = types.SimpleNamespace(frames=[], rendering=threading.Event())
+    renderer.rendering.set()
+
+    def renderFrame(snapshot):
+        renderer.frames.append(snapshot)
+        renderer.rendering.wait()
+
+    monkeypatch.setattr(screen, "renderFrame", renderFrame)
+    monkeypatch.setattr(screen, "animationTimeout", lambda: None)
+    monkeypatch.setattr(screen, "_state", types.SimpleNamespace(animating=False))
+    return renderer
+
+
+def _wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert condition()
+
+
+def test_render_worker_replaces_snapshots_not_taken(renderer):
+    worker = screen.RenderWorker()
+    worker.submit("first")
+    worker.submit("second")
+    worker.submit("third")
+    assert worker.snapshot == "third"
+    assert (worker.submitted, worker.dropped) == (3, 2)
+    worker.start()
+    _wait_for(lambda: renderer.frames)
+    assert renderer.frames == ["third"]
+
+
+def test_render_worker_renders_the_latest(renderer):
+    worker = screen.RenderWorker()
+    worker.start()
+    renderer.rendering.clear()
+    worker.submit("first")
+    _wait_for(lambda: renderer.frames == ["first"])
+    # submitted while the first one is still being rendered
+    for snapshot in ["second", "third", "fourth"]:
+        worker.submit(snapshot)
+    renderer.rendering.set()
+    _wait_for(lambda: len(renderer.frames) == 2)
+    assert renderer.frames == ["first", "fourth"]
+    assert worker.dropped == 2
+    worker.submit("fifth")
+    _wait_for(lambda: len(renderer.frames) == 3)
+    assert renderer.frames[-1] == "fifth"
+
+
+PWM_BITS_POLICY = [(16, 7), (40, 9)]
+
+
+@pytest.mark.parametrize(
+    "policy, brightness, pwmBits",
+    [
+        (PWM_BITS_POLICY, 0, 7),
+        (PWM_BITS_POLICY, 15, 7),
+        (PWM_BITS_POLICY, 16, 9),
+        (PWM_BITS_POLICY, 39, 9),
+        (PWM_BITS_POLICY, 40, 11),
+        (PWM_BITS_POLICY, 100, 11),
+        # first match wins
+        ([(40, 9), (16, 7)], 10, 9),
+        # no policy
+        ([], 0, 11),
+    ],
+)
+def test_pwm_bits_for_brightness(monkeypatch, policy, brightness, pwmBits):
+    monkeypatch.setattr(const, "scr_pwmBitsPolicy", policy)
+    monkeypatch.setattr(const, "scr_led_pwm_bits", 11)
+    assert screen.pwmBitsForBrightness(brightness) == pwmBits
+
+
+def test_update_pwm_bits(monkeypatch):
+    monkeypatch.setattr(const, "scr_pwmBitsPolicy", PWM_BITS_POLICY)
+    monkeypatch.setattr(const, "scr_led_pwm_bits", 11)
+    state = types.SimpleNamespace(pwmBitsStats=screen.PwmBitsStats(11))
+    monkeypatch.setattr(screen, "_state", state)
+    canvas = sim.FakeCanvas(4, 4)
+    # brightness: pwm bits of the canvas, and whether the stats start over
+    for brightness, pwmBits, changed in [
+        (100, 11, False),
+        (30, 9, True),
+        (20, 9, False),
+        (5, 7, True),
+        (15, 7, False),
+        (16, 9, True),
+        (40, 11, True),
+    ]:
+        stats = state.pwmBitsStats
+        canvas.brightness = brightness
+        screen.updatePwmBits(canvas)
+        assert canvas.pwmBits == pwmBits
+        assert state.pwmBitsStats.pwmBits == pwmBits
+        assert (state.pwmBitsStats is not stats) == changed
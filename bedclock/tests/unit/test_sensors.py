@@ -0,0 +1,141 @@
+import threading
+import time
+
+from bedclock import const
+from bedclock import sensors
+
+
+class FakeDevice(object):
+    def __init__(self, lux, proximity, busy=None, readSeconds=0):
+        self.lux = lux
+        self._proximity = proximity
+        self.color_data_ready = True
+        self.busy = busy  # shared by devices on the same bus
+        self.readSeconds = readSeconds
+        self.overlaps = 0
+
+    def _access(self):
+        if self.busy is not None:
+            if self.busy.get("on"):
+                self.overlaps += 1
+            self.busy["on"] = True
+        time.sleep(self.readSeconds)
+        if self.busy is not None:
+            self.busy["on"] = False
+
+    @property
+    def color_data(self):
+        self._access()
+        return 0, self.lux, 0, self.lux
+
+    @property
+    def proximity(self):
+        self._access()
+        if isinstance(self._proximity, Exception):
+            raise self._proximity
+        return self._proximity
+
+
+def _green(r, g, b):
+    return g
+
+
+def test_fused_readings_and_schedules():
+    left = sensors.Sensor("left", FakeDevice(10, 4), threading.Lock(), 0, 0, 5)
+    right = sensors.Sensor(
+        "right", FakeDevice(30, 8), threading.Lock(), 10, 0, 5, luxScale=2
+    )
+    array = sensors.SensorArray([left, right], _green)
+    readings = array.poll(0, True, True)
+    # left's proximity is below its threshold
+    assert readings.lux == (10 + 60) / 2
+    assert readings.proximity == 8 and readings.rawProximity == 8
+    # right only reads lux every 10 seconds
+    left.device.lux = 20
+    right.device.lux = 0
+    assert array.poll(5, True, False).lux == (20 + 60) / 2
+    assert array.poll(10, True, False).lux == (20 + 0) / 2
+    assert array.poll(11, False, False) == (None, None, None, [])
+    assert array.stats()["right"]["reads"] == 2
+
+
+def test_errors_and_shared_bus():
+    busy = {}
+    lock = threading.Lock()
+    devices = [FakeDevice(10, 9, busy, 0.01) for _ in range(3)]
+    devices.append(FakeDevice(10, OSError("gone")))
+    array = sensors.SensorArray(
+        [sensors.Sensor(str(i), d, lock) for i, d in enumerate(devices[:3])]
+        + [sensors.Sensor("gone", devices[3], threading.Lock())],
+        _green,
+        threads=4,
+    )
+    try:
+        for i in range(3):
+            readings = array.poll(i, True, True, timeout=5)
+            assert readings.proximity == 9
+            assert [s.name for s, _ in readings.errors] == ["gone"]
+        # sensors on the same bus took turns
+        assert sum(d.overlaps for d in devices) == 0
+        assert array.sensors[3].consecutiveErrors == 3
+        assert array.stats()["0"]["reads"] == 3
+    finally:
+        array.shutdown()
+
+
+def test_latency_is_per_read():
+    slow = sensors.Sensor("slow", FakeDevice(10, 0, readSeconds=0.2), threading.Lock())
+    fast = sensors.Sensor("fast", FakeDevice(10, 0), threading.Lock())
+    array = sensors.SensorArray([slow, fast], _green)
+    array.poll(0, False, True)
+    # read after the slow one, but not waiting for it
+    assert slow.latencies[0] >= 0.2
+    assert fast.latencies[0] < 0.2
+
+
+class BrokenDevice(object):
+    color_data_ready = True
+
+    @property
+    def color_data(self):
+        raise OSError("gone")
+
+    @property
+    def proximity(self):
+        raise OSError("gone")
+
+
+def test_failing_sensor_goes_stale(monkeypatch):
+    monkeypatch.setattr(const, "motion_sensor_stale_errors", 3)
+    monkeypatch.setattr(const, "motion_sensor_reinit_errors", 5)
+    near = sensors.Sensor("near", FakeDevice(10, 9), threading.Lock())
+    far = sensors.Sensor("far", FakeDevice(30, 0), threading.Lock())
+    array = sensors.SensorArray([near, far], _green)
+    assert array.poll(0, True, True)[:2] == (20, 9)
+    near.device = BrokenDevice()
+    for now in (1, 2):
+        assert array.poll(now, True, True)[:2] == (20, 9)
+    # its last readings no longer count
+    assert array.poll(3, True, True)[:2] == (30, 0)
+    assert not array.failing()
+    far.device = BrokenDevice()
+    for now in range(4, 6):
+        array.poll(now, True, True)
+    assert not array.failing()
+    # far went stale too: nobody near, lux unknown
+    assert array.poll(6, True, True)[:2] == (None, 0)
+    array.poll(7, True, True)
+    assert not array.failing()
+    array.poll(8, True, True)  # its fifth failure in a row, and near's eighth
+    assert array.failing()
+
+
+def test_lone_sensor_going_stale_clears_proximity(monkeypatch):
+    monkeypatch.setattr(const, "motion_sensor_stale_errors", 2)
+    sensor = sensors.Sensor("only", FakeDevice(10, 9), threading.Lock())
+    array = sensors.SensorArray([sensor], _green)
+    assert array.poll(0, False, True).proximity == 9
+    sensor.device = BrokenDevice()
+    assert array.poll(1, False, True).proximity is None
+    assert array.poll(2, False, True).proximity == 0
+    assert array.poll(3, False, True).proximity is None
@@ -0,0 +1,56 @@
+import multiprocessing
+import queue
+
+import pytest
+
+from bedclock import shmring
+
+
+def test_ring_policies():
+    ring = shmring.Ring(4, 64)
+    for i in range(4):
+        ring.put(bytes([i]))
+    with pytest.raises(queue.Full):
+        ring.put(b"x")
+    assert [ring.take() for _ in range(5)] == [b"\x00", b"\x01", b"\x02", b"\x03", None]
+    with pytest.raises(ValueError):
+        ring.put(bytes(64))
+    assert ring.stats() == {"pending": 0, "dropped": 1, "overwritten": 0}
+
+    ring = shmring.Ring(4, 64, shmring.POLICY_OVERWRITE)
+    for i in range(10):
+        ring.put(bytes([i]))
+    assert [ring.take() for _ in range(5)] == [b"\x06", b"\x07", b"\x08", b"\x09", None]
+    assert ring.stats()["overwritten"] == 6
+
+
+def _child(producer, cmdq, count):
+    # echo commands back as events, then send count events of its own
+    producer.put_nowait(("echo", cmdq.get(True, 10)))
+    cmdq.put_nowait(b"local")
+    producer.put_nowait(("echo", cmdq.get(True, 10)))
+    for i in range(count):
+        while True:
+            try:
+                producer.put_nowait(("event", i))
+                break
+            except queue.Full:
+                pass
+
+
+def test_across_processes():
+    context = multiprocessing.get_context("fork")
+    hub = shmring.EventHub(8, 256)
+    cmdq = shmring.CommandQueue(4, 256)
+    child = context.Process(target=_child, args=(hub.producer(), cmdq, 1000))
+    child.start()
+    cmdq.put_nowait(b"ping")
+    assert hub.get(True, 10) == ("echo", b"ping")
+    assert hub.get(True, 10) == ("echo", b"local")
+    assert [hub.get(True, 10) for _ in range(1000)] == [
+        ("event", i) for i in range(1000)
+    ]
+    with pytest.raises(queue.Empty):
+        hub.get(True, 0.1)
+    child.join(10)
+    assert child.exitcode == 0
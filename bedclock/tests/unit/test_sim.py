@@ -0,0 +1,37 @@
+import time
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("dill")
+pytest.importorskip("paho.mqtt.client")
+
+from bedclock import const  # noqa
+from bedclock import sim  # noqa
+
+
+def test_day_runs_in_seconds(tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "snapshot_dir", str(tmp_path))
+    start = time.monotonic()
+    with sim.Simulation(datetime(2026, 10, 19)) as simulation:
+        results = simulation.run(86400)
+        # simulations persist nothing
+        assert const.snapshot_dir is None and const.ts_dir is None
+    assert time.monotonic() - start < 60
+    assert const.snapshot_dir == str(tmp_path)
+    assert results["simSeconds"] == 86400
+
+    # the light came and went, and someone moved about during the day
+    counts = simulation.eventCounts
+    assert counts["MotionLux"] > 0 and counts["MotionProximity"] > 0
+    assert counts["ScreenBrightness"] > 0
+    assert simulation.states["screen"].matrix.swaps > 0
+    # back at midnight, in the dark with nobody moving
+    screenState = simulation.states["screen"]
+    assert screenState.currentBrightness == const.scr_brightnessOff
+    assert screenState.wantedBrightness == const.scr_brightnessOff
+    assert screenState.deepIdle
+    motionState = simulation.states["motion"]
+    assert motionState.currLux == 0 and motionState.currProximity == 0
+    assert motionState.deepIdle
+    assert not any(tmp_path.iterdir())
@@ -0,0 +1,86 @@
+import json
+import time
+
+from bedclock import clocks
+from bedclock import const
+from bedclock import snapshot
+
+
+def test_save_and_load(tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "snapshot_dir", str(tmp_path / "snapshots"))
+    assert snapshot.load("test") is None
+    snapshotter = snapshot.Snapshotter("test", debounceSeconds=60)
+    snapshotter.save({"lux": 1})
+    snapshotter.flush()
+    assert snapshot.load("test") == {"lux": 1}
+    assert not list((tmp_path / "snapshots").glob("*.tmp"))
+
+
+class _Timer(object):
+    # started timers wait for the test to fire them
+    def __init__(self, started, delay, fun):
+        self.started = started
+        self.delay = delay
+        self.fun = fun
+
+    def start(self):
+        self.started.append(self)
+
+    def cancel(self):
+        pass
+
+
+def test_debounce(tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "snapshot_dir", str(tmp_path))
+    clock = clocks.VirtualClock()
+    started = []
+    snapshotter = snapshot.Snapshotter(
+        "test", 0.2, clock, lambda delay, fun: _Timer(started, delay, fun)
+    )
+    for lux in range(5):
+        snapshotter.save({"lux": lux})
+    # nothing written yet, so the first write is right away
+    assert [t.delay for t in started] == [0]
+    started.pop().fun()
+    assert snapshotter.writes == 1
+    assert snapshot.load("test") == {"lux": 4}
+    clock.advance_to(clock.t + 0.05)
+    snapshotter.save({"lux": 5})
+    snapshotter.save({"lux": 6})
+    # the next one waits for the rest of the debounce period
+    assert [round(t.delay, 6) for t in started] == [0.15]
+    started.pop().fun()
+    assert snapshotter.writes == 2
+    assert snapshot.load("test") == {"lux": 6}
+    # nothing to write when state did not change
+    snapshotter.save({"lux": 6})
+    snapshotter.flush()
+    assert snapshotter.writes == 2
+    assert not started
+
+
+def test_debounce_follows_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "snapshot_dir", str(tmp_path))
+    monkeypatch.setattr(const, "snapshot_debounce_seconds", 10)
+    clock = clocks.VirtualClock()
+    started = []
+    snapshotter = snapshot.Snapshotter(
+        "test", clock=clock, timer=lambda delay, fun: _Timer(started, delay, fun)
+    )
+    snapshotter.save({"lux": 1})
+    started.pop().fun()
+    # as a config reload would
+    monkeypatch.setattr(const, "snapshot_debounce_seconds", 3)
+    snapshotter.save({"lux": 2})
+    assert [t.delay for t in started] == [3]
+
+
+def test_stale_or_broken(tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "snapshot_dir", str(tmp_path))
+    savedAt = time.time() - const.snapshot_max_age_seconds - 1
+    path = snapshot.snapshot_path("test")
+    snapshot.write_atomic(path, {"savedAt": savedAt, "state": {"lux": 1}})
+    assert snapshot.load("test") is None
+    with open(path, "w") as f:
+        f.write(json.dumps({"savedAt": time.time()})[:-3])
+    assert snapshot.load("test") is None
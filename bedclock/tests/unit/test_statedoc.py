@@ -0,0 +1,43 @@
+from bedclock import statedoc
+
+
+def test_deltas_and_decoder():
+    doc = statedoc.StateDoc(fullSeconds=3600)
+    assert doc.encode(0) is None
+    doc.update({"brightness": 8, "lux": 3, "message": None})
+    isFull, full = doc.encode(0)
+    assert isFull
+    doc.update({"brightness": 8})
+    assert doc.encode(10) is None
+    doc.update({"lux": 40})
+    isFull, delta1 = doc.encode(20)
+    assert not isFull and '"brightness"' not in delta1
+    doc.update({"message": "hi"})
+    isFull, delta2 = doc.encode(30)
+    # deltas are cumulative since the last full document
+    assert '"lux":40' in delta2 and '"message":"hi"' in delta2
+
+    decoder = statedoc.Decoder()
+    decoder.feed(True, delta2)
+    assert decoder.state() is None
+    decoder.feed(False, full)
+    decoder.feed(True, delta1)  # older than delta2, so ignored
+    assert decoder.state() == {"brightness": 8, "lux": 40, "message": "hi"}
+
+    doc.update({"brightness": 20})
+    isFull, newFull = doc.encode(3600)
+    assert isFull
+    decoder.feed(False, newFull)
+    # the retained delta is for the previous full document
+    assert decoder.state() == {"brightness": 20, "lux": 40, "message": "hi"}
+
+
+def test_resend_is_full():
+    doc = statedoc.StateDoc(fullSeconds=3600)
+    doc.resend()
+    assert doc.encode(0) is None  # nothing to resend yet
+    doc.update({"lux": 3})
+    doc.encode(0)
+    doc.resend()
+    isFull, full = doc.encode(10)
+    assert isFull and '"lux":3' in full
@@ -0,0 +1,29 @@
+from bedclock import telemetry
+
+
+def test_batches_round_trip():
+    batcher = telemetry.Batcher(flushSeconds=60, flushSamples=100)
+    samples = [(1000.0 + i * 0.321, (i * 7) % 300) for i in range(250)]
+    payloads = []
+    for i, (t, value) in enumerate(samples):
+        batcher.add("lux", t, value)
+        batcher.add("proximity", t, i % 2)
+        if i == 120:
+            # gap too long for a 16 bit millisecond delta
+            batcher.add("proximity", t + 100, 5)
+        payload = batcher.poll(t)
+        if payload:
+            payloads.append(payload)
+    payloads.append(batcher.poll(10000))
+    assert batcher.poll(20000) is None
+
+    decoded = {"lux": [], "proximity": []}
+    for payload in payloads:
+        for name, batch in telemetry.decode(payload):
+            decoded[name].extend(batch)
+    assert [v for _, v in decoded["lux"]] == [v for _, v in samples]
+    assert all(abs(t - s[0]) < 0.001 for (t, _), s in zip(decoded["lux"], samples))
+    assert len(decoded["proximity"]) == 251
+    assert decoded["proximity"][121][1] == 5
+    # 4 bytes per sample, plus a header per batch
+    assert batcher.payloadBytes < 501 * 5
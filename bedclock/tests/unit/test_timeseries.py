@@ -0,0 +1,45 @@
+from bedclock import const
+from bedclock import timeseries
+
+TIERS = [(0, 100), (60, 50)]
+
+
+def test_tiers_and_query(tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "ts_dir", str(tmp_path))
+    series = timeseries.open_series("lux", "f", TIERS)
+    # one sample every 10 seconds for 30 minutes
+    for i in range(180):
+        series.append(6000 + i * 10, float(i % 6))
+    # raw ring only holds the last 100 samples
+    raw = series.query(6800, 8000, maxPoints=1000)
+    assert raw["bucketSeconds"] == 0
+    assert raw["records"][0] == [6800.0, 2.0]
+    assert len(raw["records"]) == 100
+    # recent enough for the raw tier
+    recent = series.query(7700, 7750, maxPoints=1000)
+    assert [r[0] for r in recent["records"]] == [7700, 7710, 7720, 7730, 7740, 7750]
+    # too far back for the raw tier, so per minute min/max/avg it is
+    minutes = series.query(6000, 6119)
+    assert minutes["fields"] == ["time", "min", "max", "avg"]
+    assert minutes["records"] == [[6000.0, 0.0, 5.0, 2.5], [6060.0, 0.0, 5.0, 2.5]]
+    # too many records even for the coarsest tier
+    assert len(series.query(6000, 8000, maxPoints=10)["records"]) == 10
+    series.close()
+
+
+def test_persisted_and_readonly(tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "ts_dir", str(tmp_path))
+    assert timeseries.query("proximity", 0, 100) is None
+    series = timeseries.open_series("proximity", "H", TIERS)
+    series.append(10, 3)
+    series.append(5, 4)  # clock going back gets clamped
+    series.close()
+    series = timeseries.open_series("proximity", "H", TIERS)
+    series.append(11, 5)
+    results = timeseries.query("proximity", 0, 100)
+    assert results["records"] == [[10.0, 3], [10.0, 4], [11.0, 5]]
+    series.close()
+    # different tiers means starting over
+    series = timeseries.open_series("proximity", "H", [(0, 10)])
+    assert series.query(0, 100)["records"] == []
+    series.close()
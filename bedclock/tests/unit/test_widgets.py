@@ -0,0 +1,118 @@
+from bedclock import bdf
+from bedclock import widgets
+
+FONT = """STARTFONT 2.1
+FONTBOUNDINGBOX 4 6 0 -1
+STARTPROPERTIES 2
+FONT_ASCENT 5
+FONT_DESCENT 1
+ENDPROPERTIES
+CHARS 2
+STARTCHAR one
+ENCODING 49
+DWIDTH 4 0
+BBX 3 5 0 0
+BITMAP
+40
+C0
+40
+40
+E0
+ENDCHAR
+STARTCHAR dash
+ENCODING 45
+DWIDTH 4 0
+BBX 3 1 0 2
+BITMAP
+E0
+ENDCHAR
+ENDFONT
+""".splitlines()
+
+
+class FakeCanvas(object):
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.pixels = {}
+        self.writes = 0
+
+    def Clear(self):
+        self.pixels = {}
+
+    def SetPixel(self, x, y, r, g, b):
+        self.writes += 1
+        if (r, g, b) == (0, 0, 0):
+            self.pixels.pop((x, y), None)
+        else:
+            self.pixels[(x, y)] = (r, g, b)
+
+
+def test_bdf_font():
+    font = bdf.parse_font(FONT)
+    assert (font.ascent, font.descent) == (5, 1)
+    assert font.text_width("1-1") == 12
+    assert font.character_width(ord("x")) == -1
+    pixels = set(font.text_pixels("-", 10, 20))
+    assert pixels == {(10, 17), (11, 17), (12, 17)}
+    assert len(list(font.text_pixels("1", 0, 5))) == 8
+
+
+def test_compositor_dirty_rects():
+    font = bdf.parse_font(FONT)
+    red, blue = (255, 0, 0), (0, 0, 255)
+    text = widgets.TextWidget("text", font, 10, width=16)
+    dot = widgets.PixelWidget("dot", 15, 15)
+    compositor = widgets.Compositor(16, 16, [text, dot])
+    canvases = [FakeCanvas(16, 16), FakeCanvas(16, 16)]
+
+    text.update("11", red)
+    dot.update(blue)
+    for canvas in canvases:
+        compositor.draw(canvas)
+        assert len(canvas.pixels) == 17
+        assert canvas.pixels[(15, 15)] == blue
+
+    # nothing changed: nothing gets written
+    assert compositor.draw(canvases[0]) == 0
+    assert not text.update("11", red)
+
+    # single pixel change only writes that pixel, in each of the buffers
+    dot.hide()
+    assert compositor.draw(canvases[1]) == 1
+    assert compositor.draw(canvases[0]) == 1
+    assert (15, 15) not in canvases[0].pixels
+
+    # text change only touches pixels inside the text
+    text.update("1-", red)
+    writes = compositor.draw(canvases[1])
+    assert 0 < writes <= 4 * 6
+    assert canvases[1].pixels == {
+        (x, y): red for x, y in font.text_pixels("1-", text.textPosX("1-"), 10)
+    }
+
+
+def test_marquee():
+    font = bdf.parse_font(FONT)
+    red = (255, 0, 0)
+    marquee = widgets.MarqueeWidget("msg", font, 10, width=8, gap=4)
+    compositor = widgets.Compositor(8, 16, [marquee])
+
+    # fits: no scrolling, offset is ignored
+    assert not marquee.scrolls("1")
+    marquee.update("1", red, 5)
+    assert marquee.render() == marquee.render()
+    assert {p[0] for p in marquee.render()} == {2, 3, 4}
+
+    # strip is text (12 pixels) plus gap (4 pixels)
+    text = "1-1"
+    assert marquee.scrolls(text)
+    frames = []
+    for offset in range(17):
+        marquee.update(text, red, offset)
+        compositor.draw(FakeCanvas(8, 16))
+        frames.append(bytes(compositor.frame))
+        assert all(0 <= p[0] < 8 for p in marquee.pixels)
+    assert marquee.stripWidth == 16
+    assert frames[0] == frames[16]
+    assert frames[0] != frames[1]
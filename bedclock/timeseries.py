@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+# Memory bounded store for sensor samples. Each series is a file with a few
+# rings (tiers): the first one keeps every sample, the others keep min, max
+# and average per bucket of time, so older history costs less. The file is
+# memory mapped, so samples survive restarts and readers in other processes
+# can query a time range without copying the rings.
+# Ref: https://docs.python.org/3/library/mmap.html
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+# need this because exported python path gets lost when invoking sudo
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+from bedclock import const  # noqa
+from bedclock import log  # noqa
+from bedclock import safefs  # noqa
+
+MAGIC = b"BCTS"
+VERSION = 1
+# magic, version, value typecode, number of tiers
+HEADER = struct.Struct("<4sHcxI")
+# bucket seconds, capacity, records written so far
+TIER_HEADER = struct.Struct("<IIQ")
+TIME_TYPECODE = "d"
+AVG_TYPECODE = "f"
+ALIGNMENT = 8
+# series kept by motion, and the typecode of their values
+SERIES_LUX = "lux"
+SERIES_PROXIMITY = "proximity"
+SERIES = {SERIES_LUX: "f", SERIES_PROXIMITY: "H"}
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _tier_fields(bucketSeconds, typecode):
+    if not bucketSeconds:
+        return [("time", TIME_TYPECODE), ("value", typecode)]
+    return [
+        ("time", TIME_TYPECODE),
+        ("min", typecode),
+        ("max", typecode),
+        ("avg", AVG_TYPECODE),
+    ]
+
+
+def _layout(typecode, tiers):
+    """Return file size and, for each tier, its header offset and the
+    offset of each of its fields.
+    """
+    offset = HEADER.size
+    headerOffsets = []
+    for _ in tiers:
+        headerOffsets.append(offset)
+        offset += TIER_HEADER.size
+    layout = []
+    for headerOffset, (bucketSeconds, capacity) in zip(headerOffsets, tiers):
+        fieldOffsets = []
+        for name, fieldTypecode in _tier_fields(bucketSeconds, typecode):
+            offset = _aligned(offset)
+            fieldOffsets.append((name, fieldTypecode, offset))
+            offset += capacity * struct.calcsize(fieldTypecode)
+        layout.append((headerOffset, fieldOffsets))
+    return _aligned(offset), layout
+
+
+# =============================================================================
+
+
+class Tier(object):
+    def __init__(self, buf, headerOffset, bucketSeconds, capacity, fieldOffsets):
+        self.buf = buf
+        self.headerOffset = headerOffset
+        self.bucketSeconds = bucketSeconds
+        self.capacity = capacity
+        self.fieldNames = [name for name, _, _ in fieldOffsets]
+        self.fields = []
+        for _name, typecode, offset in fieldOffsets:
+            size = capacity * struct.calcsize(typecode)
+            self.fields.append(buf[offset:offset + size].cast(typecode))
+        # bucket being accumulated, only used by the writer
+        self.bucket = None
+
+    def written(self):
+        return TIER_HEADER.unpack_from(self.buf, self.headerOffset)[2]
+
+    def _set_written(self, written):
+        TIER_HEADER.pack_into(
+            self.buf, self.headerOffset, self.bucketSeconds, self.capacity, written
+        )
+
+    def append(self, values):
+        written = self.written()
+        slot = written % self.capacity
+        for field, value in zip(self.fields, values):
+            field[slot] = value
+        # bumped last, so readers do not look at a half written record
+        self._set_written(written + 1)
+
+    def accumulate(self, t, value):
+        bucketStart = t - t % self.bucketSeconds
+        bucket = self.bucket
+        if bucket is not None and bucket[0] != bucketStart:
+            start, low, high, total, count = bucket
+            self.append((start, low, high, total / count))
+            bucket = None
+        if bucket is None:
+            self.bucket = [bucketStart, value, value, value, 1]
+            return
+        bucket[1] = min(bucket[1], value)
+        bucket[2] = max(bucket[2], value)
+        bucket[3] += value
+        bucket[4] += 1
+
+    def first(self):
+        """Logical index of the oldest record still in the ring."""
+        return max(0, self.written() - self.capacity)
+
+    def time_at(self, index):
+        return self.fields[0][index % self.capacity]
+
+    def bisect(self, t, lo, hi):
+        # records are in time order, so binary search over logical indexes
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.time_at(mid) < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, start, end):
+        lo, hi = self.first(), self.written()
+        return self.bisect(start, lo, hi), self.bisect(end, lo, hi)
+
+    def records(self, lo, hi, step=1):
+        for index in range(lo, hi, step):
+            slot = index % self.capacity
+            yield [field[slot] for field in self.fields]
+
+    def release(self):
+        for field in self.fields:
+            field.release()
+        self.fields = []
+
+
+class Series(object):
+    def __init__(self, name, f, buf, typecode, tiers):
+        self.name = name
+        self.f = f
+        self.mmap = buf
+        self.typecode = typecode
+        self.view = memoryview(buf)
+        _size, layout = _layout(typecode, tiers)
+        self.tiers = [
+            Tier(self.view, headerOffset, bucketSeconds, capacity, fieldOffsets)
+            for (bucketSeconds, capacity), (headerOffset, fieldOffsets) in zip(
+                tiers, layout
+            )
+        ]
+        self.lastTime = 0
+        raw = self.tiers[0]
+        if raw.written():
+            self.lastTime = raw.time_at(raw.written() - 1)
+
+    def append(self, t, value):
+        # the rings must stay in time order, so a clock that goes back
+        # in time gets clamped to the last sample
+        t = max(t, self.lastTime)
+        self.lastTime = t
+        for tier in self.tiers:
+            if tier.bucketSeconds:
+                tier.accumulate(t, value)
+            else:
+                tier.append((t, value))
+
+    def query(self, start, end, maxPoints=None):
+        """Return records between start and end (inclusive), from the finest
+        tier that holds them all in no more than maxPoints records.
+        """
+        if maxPoints is None:
+            maxPoints = const.ts_query_max_points
+        for tier in self.tiers:
+            lo, hi = tier.range(start, end + 1e-6)
+            covers = tier.first() == 0 or tier.time_at(tier.first()) <= start
+            if covers and hi - lo <= maxPoints:
+                break
+        # even the coarsest tier has too many: skip records evenly
+        step = max(1, -(-(hi - lo) // max(1, maxPoints)))
+        return {
+            "series": self.name,
+            "bucketSeconds": tier.bucketSeconds,
+            "fields": tier.fieldNames,
+            "records": list(tier.records(lo, hi, step)),
+        }
+
+    def close(self):
+        for tier in self.tiers:
+            tier.release()
+        self.view.release()
+        self.mmap.close()
+        self.f.close()
+
+
+# =============================================================================
+
+
+def series_path(name):
+    return os.path.join(const.ts_dir, "{}.ts".format(name))
+
+
+def _read_header(buf):
+    magic, version, typecode, numTiers = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        return None, []
+    tiers = []
+    for i in range(numTiers):
+        offset = HEADER.size + i * TIER_HEADER.size
+        bucketSeconds, capacity, _written = TIER_HEADER.unpack_from(buf, offset)
+        tiers.append((bucketSeconds, capacity))
+    return typecode.decode("ascii"), tiers
+
+
+def open_series(name, typecode, tiers=None):
+    """Open series name for writing, creating it if needed. A file with a
+    different typecode or tiers gets recreated.
+    """
+    if tiers is None:
+        tiers = const.ts_tiers
+    tiers = [tuple(t) for t in tiers]
+    size, _ = _layout(typecode, tiers)
+    path = series_path(name)
+    safefs.secure_dir(os.path.dirname(path))
+    f = os.fdopen(safefs.open_nofollow(path, os.O_RDWR | os.O_CREAT), "r+b")
+    f.seek(0, os.SEEK_END)
+    fresh = f.tell() != size
+    if not fresh:
+        buf = mmap.mmap(f.fileno(), size)
+        fresh = _read_header(buf) != (typecode, tiers)
+        if fresh:
+            buf.close()
+    if fresh:
+        logger.info("creating {} series {} ({} bytes)".format(typecode, path, size))
+        f.truncate(0)
+        f.truncate(size)
+        buf = mmap.mmap(f.fileno(), size)
+        HEADER.pack_into(buf, 0, MAGIC, VERSION, typecode.encode("ascii"), len(tiers))
+        for i, (bucketSeconds, capacity) in enumerate(tiers):
+            offset = HEADER.size + i * TIER_HEADER.size
+            TIER_HEADER.pack_into(buf, offset, bucketSeconds, capacity, 0)
+    return Series(name, f, buf, typecode, tiers)
+
+
+def open_series_readonly(name):
+    """Open series name for queries. Returns None if there is no such series."""
+    try:
+        f = open(series_path(name), "rb")
+    except FileNotFoundError:
+        return None
+    try:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # empty file
+        f.close()
+        return None
+    typecode, tiers = _read_header(buf)
+    if typecode is None or _layout(typecode, tiers)[0] > len(buf):
+        buf.close()
+        f.close()
+        return None
+    return Series(name, f, buf, typecode, tiers)
+
+
+def query(name, start, end, maxPoints=None):
+    """Query series name from another process. Returns None if unavailable."""
+    series = open_series_readonly(name)
+    if series is None:
+        return None
+    try:
+        return series.query(start, end, maxPoints)
+    finally:
+        series.close()
+
+
+def parse_time(value, now=None):
+    """Absolute epoch seconds, or relative to now when zero or negative."""
+    t = float(value)
+    if t <= 0:
+        t += time.time() if now is None else now
+    return t
+
+
+# =============================================================================
+
+
+# globals
+logger = log.getLogger()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="query a bedclock time series")
+    parser.add_argument("series", choices=sorted(SERIES))
+    parser.add_argument("--start", default="-3600", help="epoch, or <= 0 for now-N")
+    parser.add_argument("--end", default="0", help="epoch, or <= 0 for now-N")
+    parser.add_argument("--points", type=int, default=const.ts_query_max_points)
+    args = parser.parse_args()
+    results = query(
+        args.series, parse_time(args.start), parse_time(args.end), args.points
+    )
+    if results is None:
+        sys.exit("no series {} in {}".format(args.series, const.ts_dir))
+    print(json.dumps(results, indent=1))
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+# Retained mode rendering for the screen. Each widget caches the pixels it
+# rendered and only re-renders when its inputs change. The compositor keeps
+# a model of the composed frame plus a shadow of what each of the canvas
+# buffers holds, so only pixels inside dirty rectangles that actually differ
+# get written to the canvas. Dirty rectangles are split along the panels the
+# canvas is made of (see layout.py), so a change on one panel does not have
+# the others looked at.
+
+ALIGN_LEFT = "left"
+ALIGN_CENTER = "center"
+
+
+def _bounding_rect(pixels):
+    if not pixels:
+        return None
+    xs = [p[0] for p in pixels]
+    ys = [p[1] for p in pixels]
+    return min(xs), min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1
+
+
+def _intersect(a, b):
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+class Widget(object):
+    def __init__(self, name):
+        self.name = name
+        self.inputs = None
+        self.dirty = True
+        # results of the last render: lit pixels as (x, y, (r, g, b)) and
+        # their bounding rect as (x, y, width, height)
+        self.pixels = []
+        self.rect = None
+
+    def update(self, *inputs):
+        """Set the inputs of the widget, None meaning not visible.
+
+        Returns True if the widget became dirty.
+        """
+        if len(inputs) == 1 and inputs[0] is None:
+            inputs = None
+        if inputs == self.inputs:
+            return False
+        self.inputs = inputs
+        self.dirty = True
+        return True
+
+    def hide(self):
+        return self.update(None)
+
+    def render(self):
+        """Return lit pixels for the current inputs."""
+        raise NotImplementedError
+
+
+class TextWidget(Widget):
+    def __init__(self, name, font, baseline, x=0, width=0, align=ALIGN_CENTER):
+        Widget.__init__(self, name)
+        self.font = font
+        self.baseline = baseline
+        self.x = x
+        self.width = width
+        self.align = align
+
+    def textPosX(self, text):
+        if self.align != ALIGN_CENTER:
+            return self.x
+        pixelsUsed = self.font.text_width(text)
+        if pixelsUsed >= self.width:
+            return self.x
+        return self.x + int((self.width - pixelsUsed) / 2)
+
+    def render(self):
+        text, color = self.inputs[:2]
+        textPixels = self.font.text_pixels(text, self.textPosX(text), self.baseline)
+        return [(x, y, color) for x, y in textPixels]
+
+
+class MarqueeWidget(TextWidget):
+    """Text that scrolls horizontally when it is wider than the widget.
+
+    Inputs are text, color and scroll offset. The text is rendered once into
+    an off-screen strip (text followed by a gap), and each frame only picks
+    the slice of the strip that is visible at the given offset.
+    """
+
+    def __init__(self, name, font, baseline, x=0, width=0, gap=0):
+        TextWidget.__init__(self, name, font, baseline, x, width)
+        self.gap = gap
+        self.stripText = None
+        self.stripWidth = 0
+        self.stripPixels = []
+
+    def scrolls(self, text):
+        return self.font.text_width(text) > self.width
+
+    def strip(self, text):
+        if text != self.stripText:
+            self.stripText = text
+            self.stripWidth = self.font.text_width(text) + self.gap
+            self.stripPixels = list(self.font.text_pixels(text, 0, self.baseline))
+        return self.stripWidth, self.stripPixels
+
+    def render(self):
+        text, color, offset = self.inputs
+        if not self.scrolls(text):
+            return TextWidget.render(self)
+        stripWidth, stripPixels = self.strip(text)
+        x0 = self.x - offset % stripWidth
+        x1 = self.x + self.width
+        pixels = []
+        for sx, y in stripPixels:
+            # strip repeats, so a pixel may show up twice in the window
+            for x in (x0 + sx, x0 + sx + stripWidth):
+                if self.x <= x < x1:
+                    pixels.append((x, y, color))
+        return pixels
+
+
+class PixelWidget(Widget):
+    def __init__(self, name, x, y):
+        Widget.__init__(self, name)
+        self.x = x
+        self.y = y
+
+    def render(self):
+        (color,) = self.inputs
+        return [(self.x, self.y, color)]
+
+
+# =============================================================================
+
+
+class Compositor(object):
+    def __init__(self, width, height, widgets, numBuffers=2, panels=None):
+        self.width = width
+        self.height = height
+        self.rect = (0, 0, width, height)
+        self.widgets = list(widgets)  # in z-order: last one is on top
+        # rect of each panel, in canvas coordinates
+        self.panels = list(panels) if panels else [self.rect]
+        # composed frame, as interleaved rgb bytes
+        self.frame = bytearray(width * height * 3)
+        # what each canvas buffer currently holds. None means unknown. The
+        # caller is expected to alternate buffers, as SwapOnVSync does
+        self.shadows = [None] * numBuffers
+        self.pendingRects = [[] for _ in range(numBuffers)]
+        self.bufferIndex = 0
+        # stats
+        self.frames = 0
+        self.lastPixelWrites = 0
+        self.totalPixelWrites = 0
+        self.panelPixelWrites = [0] * len(self.panels)
+        # frames that had pixels written on each panel
+        self.panelFrames = [0] * len(self.panels)
+
+    def invalidate(self):
+        """Forget what the canvas buffers hold, e.g. after a Clear()."""
+        self.shadows = [None] * len(self.shadows)
+
+    def compose(self):
+        dirtyRects = []
+        for widget in self.widgets:
+            if not widget.dirty:
+                continue
+            if widget.rect:
+                dirtyRects.append(widget.rect)
+            widget.pixels = [] if widget.inputs is None else widget.render()
+            widget.rect = _bounding_rect(widget.pixels)
+            if widget.rect:
+                dirtyRects.append(widget.rect)
+            widget.dirty = False
+        dirtyRects = [r for r in (_intersect(self.rect, r) for r in dirtyRects) if r]
+        for rect in dirtyRects:
+            self._recompose(rect)
+        # as (panel index, part of the rect on that panel)
+        panelRects = []
+        for rect in dirtyRects:
+            for i, panel in enumerate(self.panels):
+                part = _intersect(rect, panel)
+                if part:
+                    panelRects.append((i, part))
+        for pendingRects in self.pendingRects:
+            pendingRects.extend(panelRects)
+        return panelRects
+
+    def _recompose(self, rect):
+        x0, y0, w, h = rect
+        frame, stride = self.frame, self.width * 3
+        blank = bytes(w * 3)
+        for y in range(y0, y0 + h):
+            offset = y * stride + x0 * 3
+            frame[offset:offset + w * 3] = blank
+        x1, y1 = x0 + w, y0 + h
+        for widget in self.widgets:
+            if not widget.rect or not _intersect(rect, widget.rect):
+                continue
+            for x, y, rgb in widget.pixels:
+                if x0 <= x < x1 and y0 <= y < y1:
+                    offset = y * stride + x * 3
+                    frame[offset:offset + 3] = bytes(rgb)
+
+    def draw(self, canvas):
+        """Compose and write the pixels that changed into canvas.
+
+        Returns the number of pixel writes done on the canvas.
+        """
+        self.compose()
+        i = self.bufferIndex
+        shadow = self.shadows[i]
+        if shadow is None:
+            canvas.Clear()
+            shadow = self.shadows[i] = bytearray(len(self.frame))
+            rects = list(enumerate(self.panels))
+        else:
+            rects = self.pendingRects[i]
+        pixelWrites = 0
+        panelWrites = [0] * len(self.panels)
+        frame, stride = self.frame, self.width * 3
+        for panel, (x0, y0, w, h) in rects:
+            for y in range(y0, y0 + h):
+                start = y * stride + x0 * 3
+                end = start + w * 3
+                if frame[start:end] == shadow[start:end]:
+                    continue
+                for offset in range(start, end, 3):
+                    rgb = frame[offset:offset + 3]
+                    if rgb != shadow[offset:offset + 3]:
+                        pixel = offset // 3
+                        x, y = pixel % self.width, pixel // self.width
+                        canvas.SetPixel(x, y, *rgb)
+                        shadow[offset:offset + 3] = rgb
+                        panelWrites[panel] += 1
+        for panel, writes in enumerate(panelWrites):
+            if writes:
+                pixelWrites += writes
+                self.panelPixelWrites[panel] += writes
+                self.panelFrames[panel] += 1
+        self.pendingRects[i] = []
+        self.bufferIndex = (i + 1) % len(self.shadows)
+        self.frames += 1
+        self.lastPixelWrites = pixelWrites
+        self.totalPixelWrites += pixelWrites
+        return pixelWrites